@@ -0,0 +1,225 @@
+"""
+DOWNLOAD DOS DADOS ABERTOS DA ANS (FTP/PDA)
+Lista os diretórios trimestrais e baixa os arquivos em paralelo, gravando
+direto em disco, retomando downloads parciais (HTTP Range) e pulando
+arquivos que já estão completos (mesmo ETag ou mesmo tamanho).
+"""
+
+import os
+import re
+import json
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urljoin, unquote
+
+import requests
+
+# ============================================================================
+# CONFIGURAÇÕES
+# ============================================================================
+
+DEMONSTRACOES_PATH = "demonstracoes_contabeis/"
+WORKERS_DOWNLOAD = int(os.getenv('ANS_WORKERS_DOWNLOAD', '4'))
+TIMEOUT = (10, 60)  # (conexão, leitura entre pacotes)
+TAMANHO_PEDACO = 1024 * 1024
+# Pedir o corpo sem gzip: Content-Length/Range valem para os bytes gravados
+SEM_CODIFICACAO = {'Accept-Encoding': 'identity'}
+
+PADRAO_TRIMESTRE = re.compile(r'(\d)T(\d{4})', re.IGNORECASE)
+PADRAO_LINK = re.compile(r'href\s*=\s*["\']([^"\'?#]+)["\']', re.IGNORECASE)
+
+
+# ============================================================================
+# LISTAGEM
+# ============================================================================
+
+def listar_diretorio(url, sessao=None):
+    """
+    Retorna as URLs absolutas dos links de uma listagem de diretório HTML
+    (formato do índice do servidor da ANS). Subdiretórios terminam em '/'.
+    """
+    sessao = sessao or requests.Session()
+    resposta = sessao.get(url, timeout=TIMEOUT)
+    resposta.raise_for_status()
+
+    links = []
+    for href in PADRAO_LINK.findall(resposta.text):
+        absoluto = urljoin(url, href)
+        # Ignorar links para o diretório pai, ordenação e outros domínios
+        if absoluto.startswith(url) and absoluto != url:
+            links.append(absoluto)
+    return sorted(set(links))
+
+
+def listar_trimestres_remotos(base_url, quantidade=3, sessao=None):
+    """
+    Percorre demonstracoes_contabeis/<ano>/ e retorna os arquivos dos
+    últimos `quantidade` trimestres como [(ano, trimestre, url), ...],
+    do mais recente para o mais antigo.
+    """
+    sessao = sessao or requests.Session()
+    raiz = urljoin(base_url, DEMONSTRACOES_PATH)
+
+    encontrados = []
+    for diretorio_ano in listar_diretorio(raiz, sessao):
+        nome = unquote(diretorio_ano.rstrip('/').rsplit('/', 1)[-1])
+        if not (diretorio_ano.endswith('/') and nome.isdigit()):
+            continue
+        for url in listar_diretorio(diretorio_ano, sessao):
+            arquivo = unquote(url.rsplit('/', 1)[-1])
+            match = PADRAO_TRIMESTRE.match(arquivo)
+            if match and arquivo.lower().endswith('.zip'):
+                encontrados.append((match.group(2), match.group(1), url))
+
+    trimestres = sorted({(ano, trim) for ano, trim, _ in encontrados}, reverse=True)[:quantidade]
+    return [item for item in sorted(encontrados, reverse=True) if item[:2] in trimestres]
+
+
+# ============================================================================
+# DOWNLOAD
+# ============================================================================
+
+def _caminho_meta(destino):
+    return destino.with_name(destino.name + '.meta.json')
+
+
+def _ler_meta(destino):
+    try:
+        with open(_caminho_meta(destino), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _gravar_meta(destino, meta):
+    with open(_caminho_meta(destino), 'w', encoding='utf-8') as f:
+        json.dump(meta, f, ensure_ascii=False)
+
+
+def _codificada(resposta):
+    """Corpo com Content-Encoding (gzip...): Content-Length não é o tamanho gravado."""
+    return resposta.headers.get('Content-Encoding', 'identity').lower() != 'identity'
+
+
+def _meta_resposta(url, resposta):
+    return {
+        'url': url,
+        'etag': resposta.headers.get('ETag'),
+        'last_modified': resposta.headers.get('Last-Modified'),
+        'tamanho': None if _codificada(resposta) else _tamanho_total(resposta),
+    }
+
+
+def _tamanho_total(resposta):
+    """Tamanho completo do recurso, também para respostas 206."""
+    intervalo = resposta.headers.get('Content-Range', '')
+    if '/' in intervalo and not intervalo.endswith('/*'):
+        return int(intervalo.rsplit('/', 1)[1])
+    tamanho = resposta.headers.get('Content-Length')
+    return int(tamanho) if tamanho is not None else None
+
+
+def _arquivo_completo(url, destino, sessao):
+    """
+    Confere com um HEAD se o arquivo local corresponde ao remoto: ETag
+    igual ao salvo no .meta.json ou, sem ETag, o mesmo tamanho. Sem acesso
+    ao servidor, o arquivo local é mantido.
+    """
+    if not destino.exists():
+        return False
+    meta = _ler_meta(destino)
+    try:
+        resposta = sessao.head(url, headers=SEM_CODIFICACAO, timeout=TIMEOUT, allow_redirects=True)
+        resposta.raise_for_status()
+    except requests.RequestException:
+        return True
+    etag = resposta.headers.get('ETag')
+    if etag and meta.get('etag'):
+        return etag == meta['etag']
+    tamanho = None if _codificada(resposta) else _tamanho_total(resposta)
+    return tamanho is not None and tamanho == destino.stat().st_size
+
+
+def baixar_arquivo(url, destino, sessao=None):
+    """
+    Baixa `url` para `destino` em pedaços, sem manter o corpo em memória.
+    O download vai para `destino.part`; se esse arquivo já existir, pede só
+    o restante com Range/If-Range. Retorna 'existente', 'retomado' ou
+    'baixado'.
+    """
+    sessao = sessao or requests.Session()
+    destino = Path(destino)
+    destino.parent.mkdir(parents=True, exist_ok=True)
+
+    if _arquivo_completo(url, destino, sessao):
+        return 'existente'
+
+    parcial = destino.with_name(destino.name + '.part')
+    meta_parcial = _ler_meta(parcial)
+    cabecalhos = dict(SEM_CODIFICACAO)
+    inicio = parcial.stat().st_size if parcial.exists() else 0
+    if inicio and meta_parcial.get('url') == url:
+        cabecalhos['Range'] = f'bytes={inicio}-'
+        validador = meta_parcial.get('etag') or meta_parcial.get('last_modified')
+        if validador:
+            cabecalhos['If-Range'] = validador
+
+    with sessao.get(url, headers=cabecalhos, stream=True, timeout=TIMEOUT) as resposta:
+        if resposta.status_code == 416:
+            # Range inválido (arquivo remoto mudou de tamanho): recomeçar
+            parcial.unlink(missing_ok=True)
+            return baixar_arquivo(url, destino, sessao)
+        resposta.raise_for_status()
+
+        retomado = resposta.status_code == 206
+        meta = _meta_resposta(url, resposta)
+        if not retomado:
+            _gravar_meta(parcial, meta)
+
+        with open(parcial, 'ab' if retomado else 'wb') as f:
+            for pedaco in resposta.iter_content(chunk_size=TAMANHO_PEDACO):
+                f.write(pedaco)
+
+    if meta['tamanho'] is not None and parcial.stat().st_size != meta['tamanho']:
+        raise IOError(f"download incompleto: {parcial.stat().st_size} de {meta['tamanho']} bytes")
+
+    os.replace(parcial, destino)
+    _gravar_meta(destino, meta)
+    _caminho_meta(parcial).unlink(missing_ok=True)
+    return 'retomado' if retomado else 'baixado'
+
+
+def baixar_arquivos(urls, destino_dir, workers=None):
+    """
+    Baixa as URLs em paralelo (no máximo `workers` ao mesmo tempo) para
+    `destino_dir`. Retorna [(url, caminho, status), ...] na ordem das URLs;
+    falhas aparecem com status 'erro: ...' sem interromper os demais.
+    """
+    workers = workers or WORKERS_DOWNLOAD
+    destino_dir = Path(destino_dir)
+
+    def tarefa(url):
+        caminho = destino_dir / unquote(url.rsplit('/', 1)[-1])
+        with requests.Session() as sessao:
+            try:
+                status = baixar_arquivo(url, caminho, sessao)
+            except (requests.RequestException, OSError) as e:
+                status = f"erro: {str(e)[:60]}"
+        print(f"  ↓ {caminho.name}: {status}")
+        return url, caminho, status
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(tarefa, urls))
+
+
+def baixar_trimestres(base_url, destino_dir, quantidade=3, workers=None):
+    """Lista os últimos trimestres no servidor e baixa seus arquivos."""
+    print("\n" + "="*80)
+    print("PASSO 0: BAIXANDO TRIMESTRES DO SERVIDOR DA ANS")
+    print("="*80)
+
+    with requests.Session() as sessao:
+        trimestres = listar_trimestres_remotos(base_url, quantidade, sessao)
+    print(f"\n✓ {len(trimestres)} arquivos encontrados em {urljoin(base_url, DEMONSTRACOES_PATH)}")
+
+    return baixar_arquivos([url for _, _, url in trimestres], destino_dir, workers)
@@ -4,28 +4,72 @@ Desafio de Estágio - Consolidação de Dados de Despesas com Eventos/Sinistros
 """
 
 import os
+import io
+import contextlib
 import requests
 import zipfile
 import csv
-from pathlib import Path
+import heapq
+import shutil
+import tempfile
+from pathlib import Path, PurePosixPath
 from datetime import datetime
 import json
+import time
+import codecs
+import hashlib
+import zlib
 from collections import defaultdict
 import pandas as pd
+import numpy as np
 from io import BytesIO
 import chardet
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import ans_download
+import esquema_compacto
+import metricas_pipeline
+import saida_colunar
 
 # ============================================================================
 # CONFIGURAÇÕES
 # ============================================================================
 
 BASE_URL = "https://dadosabertos.ans.gov.br/FTP/PDA/"
-TRABALHO_DIR = Path(__file__).parent / "dados_trabalho"
+TRABALHO_DIR = Path(os.getenv('ANS_TRABALHO_DIR', Path(__file__).parent / "dados_trabalho"))
 DOWNLOAD_DIR = TRABALHO_DIR / "downloads"
 EXTRACT_DIR = TRABALHO_DIR / "extraido"
 OUTPUT_DIR = TRABALHO_DIR / "output"
 DADOS_LOCAIS_DIR = TRABALHO_DIR  # Dados já baixados em 1T2025, 2T2025, 3T2025
 
+# Consolidação: 'vetorizado' (colunar) ou 'linha_a_linha' (original, para comparação)
+MODO_CONSOLIDACAO = os.getenv('ANS_MODO_CONSOLIDACAO', 'vetorizado')
+
+# Ingestão: número de processos para ler arquivos em paralelo (1 = sequencial)
+WORKERS_INGESTAO = int(os.getenv('ANS_WORKERS_INGESTAO', '1'))
+
+# Streaming: 'auto' (arquivos CSV/TXT acima do limite), 'sempre' ou 'nunca'
+MODO_STREAMING = os.getenv('ANS_STREAMING', 'auto')
+LIMITE_STREAMING_BYTES = int(os.getenv('ANS_LIMITE_STREAMING_MB', '256')) * 1024 * 1024
+TAMANHO_CHUNK = int(os.getenv('ANS_TAMANHO_CHUNK', '200000'))
+
+# Cache persistente de encoding/separador/mapeamento por layout de cabeçalho
+USAR_CACHE_DIALETOS = os.getenv('ANS_CACHE_DIALETOS', '1') == '1'
+CACHE_DIALETOS_PATH = TRABALHO_DIR / "cache" / "dialetos.json"
+
+# Execução incremental: reprocessa apenas arquivos novos ou alterados
+MODO_INCREMENTAL = os.getenv('ANS_INCREMENTAL', '0') == '1'
+INCREMENTAL_DIR = TRABALHO_DIR / "cache" / "incremental"
+
+# Relatório de inconsistências: amostra de tamanho fixo dos valores inválidos
+# no JSON; a lista completa vai para valores_invalidos.csv
+TAMANHO_AMOSTRA_INVALIDOS = int(os.getenv('ANS_AMOSTRA_INVALIDOS', '1000'))
+SEMENTE_AMOSTRA = int(os.getenv('ANS_SEMENTE_AMOSTRA', '2025'))
+ARQUIVO_VALORES_INVALIDOS = "valores_invalidos.csv"
+
+# Download: baixar os últimos trimestres para DOWNLOAD_DIR antes de processar
+BAIXAR_TRIMESTRES = os.getenv('ANS_BAIXAR', '0') == '1'
+
 # Criar diretórios
 for dir_path in [DOWNLOAD_DIR, EXTRACT_DIR, OUTPUT_DIR]:
     dir_path.mkdir(parents=True, exist_ok=True)
@@ -59,6 +103,13 @@ def listar_trimestres_disponiveis():
                 trimestres.append((ano, trimestre))
                 print(f"✓ Encontrado: {ano}/T{trimestre} ({item.name})")
     
+    # Arquivos ZIP trimestrais baixados (ex.: downloads/1T2025.zip)
+    for item in DOWNLOAD_DIR.glob('*.zip'):
+        match = re.match(r'(\d)T(\d{4})', item.name, re.IGNORECASE)
+        if match and (match.group(2), match.group(1)) not in trimestres:
+            trimestres.append((match.group(2), match.group(1)))
+            print(f"✓ Encontrado: {match.group(2)}/T{match.group(1)} ({item.name})")
+    
     # Se não encontrou com padrão, procurar por arquivos diretamente
     if not trimestres:
         print("⚠ Nenhum diretório TrimestroAno encontrado.")
@@ -116,19 +167,47 @@ def preparar_arquivos_locais(trimestres):
                 print(f"✓ Diretório {ano}/T{trimestre} encontrado: {nome}/")
                 break
         
-        if not diretorio_encontrado:
+        # ZIPs do trimestre baixados em DOWNLOAD_DIR são lidos sem extração
+        arquivos_zip = sorted(DOWNLOAD_DIR.glob(f"{trimestre}[Tt]{ano}*.zip"))
+        
+        if not diretorio_encontrado and not arquivos_zip:
             print(f"⚠ Diretório {ano}/T{trimestre} não encontrado")
             continue
         
-        # Procurar arquivos CSV, TXT, XLSX
-        for extensao in ['*.csv', '*.txt', '*.xlsx', '*.xls']:
-            for arquivo in diretorio_encontrado.glob(extensao):
-                print(f"  ↓ Localizado arquivo: {arquivo.name}")
+        # Um mesmo arquivo pode estar solto (ZIP já extraído) e dentro do ZIP,
+        # ou no ZIP baixado e numa cópia dele na pasta do trimestre: vale a
+        # primeira ocorrência de cada nome, com os arquivos soltos primeiro
+        nomes_localizados = set()
+        
+        if diretorio_encontrado:
+            # Procurar arquivos CSV, TXT, XLSX
+            for extensao in ['*.csv', '*.txt', '*.xlsx', '*.xls']:
+                for arquivo in diretorio_encontrado.glob(extensao):
+                    print(f"  ↓ Localizado arquivo: {arquivo.name}")
+                    nomes_localizados.add(arquivo.name.lower())
+                    arquivos_localizados.append({
+                        'caminho': arquivo,
+                        'ano': ano,
+                        'trimestre': trimestre,
+                        'nome': arquivo.name
+                    })
+            arquivos_zip.extend(sorted(diretorio_encontrado.glob('*.zip')))
+        
+        # Membros de arquivos ZIP entram na lista como arquivos soltos
+        for arquivo_zip in arquivos_zip:
+            for membro in listar_membros_zip(arquivo_zip):
+                nome = PurePosixPath(membro).name
+                if nome.lower() in nomes_localizados:
+                    print(f"  = Ignorado (já localizado): {arquivo_zip.name}/{membro}")
+                    continue
+                nomes_localizados.add(nome.lower())
+                print(f"  ↓ Localizado arquivo: {arquivo_zip.name}/{membro}")
                 arquivos_localizados.append({
-                    'caminho': arquivo,
+                    'caminho': arquivo_zip,
+                    'membro': membro,
                     'ano': ano,
                     'trimestre': trimestre,
-                    'nome': arquivo.name
+                    'nome': nome
                 })
     
     print(f"\n✓ Total de arquivos localizados: {len(arquivos_localizados)}")
@@ -139,10 +218,14 @@ def preparar_arquivos_locais(trimestres):
 # PASSO 3: PROCESSAR ARQUIVOS
 # ============================================================================
 
-def processar_arquivos(arquivos_info):
+def processar_arquivos(arquivos_info, workers=None):
     """
     Processa arquivos em diferentes formatos: CSV, TXT, XLSX.
     Retorna lista de DataFrames normalizados.
+    
+    workers: número de processos para leitura paralela (padrão
+    WORKERS_INGESTAO). Com 1 worker os arquivos são lidos em sequência.
+    Em qualquer modo a lista mantém a ordem de arquivos_info.
     """
     print("\n" + "="*80)
     print("PASSO 3: PROCESSANDO ARQUIVOS (CSV, TXT, XLSX)")
@@ -150,109 +233,420 @@ def processar_arquivos(arquivos_info):
     print("\nDesafio: Identificar automaticamente estrutura de colunas variadas")
     print("Solução: Buscar por padrões de nomes de colunas e normalizar\n")
     
-    dataframes_com_info = []
+    workers = workers or WORKERS_INGESTAO
+    cache = CacheDialetos.carregar() if USAR_CACHE_DIALETOS else None
     
-    for arquivo_info in arquivos_info:
-        caminho = arquivo_info['caminho']
-        print(f"→ Processando {caminho.name}...")
+    if workers <= 1 or len(arquivos_info) <= 1:
+        medicoes = [_processar_e_medir(arquivo_info, cache) for arquivo_info in arquivos_info]
+        resultados = [df for df, _ in medicoes]
+        for _, medicao in medicoes:
+            metricas_pipeline.registrar_arquivo(**medicao)
+    else:
+        print(f"Modo paralelo: {workers} processos\n")
+        resultados = _processar_arquivos_em_paralelo(arquivos_info, workers, cache)
+    
+    dataframes_com_info = [df for df in resultados if df is not None]
+    metricas_pipeline.anotar(
+        linhas_entrada=sum(df.attrs.get('linhas_lidas', len(df)) for df in dataframes_com_info),
+        linhas_saida=sum(len(df) for df in dataframes_com_info),
+        bytes_lidos=sum(filter(None, map(_tamanho_seguro, arquivos_info))),
+    )
+    
+    print(f"\n✓ Total de arquivos processados com sucesso: {len(dataframes_com_info)}")
+    if cache is not None:
+        cache.salvar()
+        print(f"✓ Cache de dialetos: {cache.acertos} acertos, {cache.falhas} falhas")
+    return dataframes_com_info
+
+
+def processar_arquivo(arquivo_info, cache=None):
+    """
+    Lê e normaliza um único arquivo. Retorna o DataFrame normalizado ou
+    None quando o arquivo não pôde ser lido.
+    
+    cache: CacheDialetos opcional; quando o cabeçalho (ou o próprio arquivo)
+    já é conhecido, encoding, separador e mapeamento vêm do cache.
+    """
+    print(f"→ Processando {_rotulo(arquivo_info)}...")
+    
+    try:
+        extensao = _extensao(arquivo_info)
         
-        try:
-            extensao = caminho.suffix.lower()
-            
-            if extensao == '.xlsx' or extensao == '.xls':
-                df = pd.read_excel(caminho)
-                print(f"  ✓ (XLSX: {len(df)} linhas)")
-                
-            elif extensao == '.csv':
-                encoding = detectar_encoding(caminho)
-                
-                # Tentar diferentes delimitadores
-                df = None
-                for sep in [';', ',', '\t', '|']:
-                    try:
-                        df = pd.read_csv(caminho, encoding=encoding, sep=sep, 
-                                       on_bad_lines='skip', nrows=1)
-                        if len(df.columns) > 1 or (len(df.columns) == 1 and sep != ','):
-                            # Encontrou o delimitador correto
-                            df = pd.read_csv(caminho, encoding=encoding, sep=sep, 
-                                           on_bad_lines='skip')
-                            print(f"  ✓ (CSV: {len(df)} linhas, sep='{sep}', {encoding})")
-                            print(f"    Colunas: {len(df.columns)}")
-                            break
-                    except:
-                        continue
-                
-                if df is None or df.empty:
-                    print(f"  ✗ Não foi possível ler o arquivo")
-                    continue
-                
-            elif extensao == '.txt':
-                encoding = detectar_encoding(caminho)
-                df = None
-                for sep in ['\t', ';', ',', '|']:
-                    try:
-                        df = pd.read_csv(caminho, encoding=encoding, sep=sep, 
-                                       on_bad_lines='skip', nrows=1)
-                        if len(df.columns) > 1:
-                            df = pd.read_csv(caminho, encoding=encoding, sep=sep, 
-                                           on_bad_lines='skip')
-                            print(f"  ✓ (TXT: {len(df)} linhas, sep='{sep}', {encoding})")
-                            break
-                    except:
-                        continue
-                
-                if df is None or df.empty:
-                    print(f"  ✗ Não foi possível ler o arquivo")
-                    continue
-            else:
-                print("  ✗ (formato não suportado)")
-                continue
+        if extensao == '.xlsx' or extensao == '.xls':
+            planilha = _fonte_planilha(arquivo_info)
+            cabecalho = pd.read_excel(planilha, nrows=0).columns
+            mapeamento, usecols, dtype = projetar_colunas(cabecalho)
+            df = pd.read_excel(planilha, usecols=usecols, dtype=dtype)
+            print(f"  ✓ (XLSX: {len(df)} linhas)")
             
-            # Normalizar colunas
-            df = normalizar_dataframe(df)
+        elif extensao in ('.csv', '.txt'):
+            dialeto = cache.buscar(arquivo_info) if cache is not None else None
             
-            # Adicionar informações de ano/trimestre
-            if not df.empty and 'ano' not in df.columns:
-                df['ano'] = arquivo_info['ano']
-                df['trimestre'] = arquivo_info['trimestre']
+            df = None
+            if dialeto:
+                encoding = dialeto['encoding']
+                df, sep, mapeamento = _ler_texto(arquivo_info, encoding, [dialeto['sep']],
+                                                 dialeto['mapeamento'], uma_coluna=False)
+                if df is None:
+                    # Entrada obsoleta (ou corrompida): esquecer e detectar de novo
+                    print(f"  ↻ Dialeto do cache não serve para o arquivo; detectando de novo")
+                    cache.descartar(arquivo_info)
+                    dialeto = None
+            if not dialeto:
+                encoding = _detectar_encoding_origem(arquivo_info)
+                df, sep, mapeamento = _ler_texto(arquivo_info, encoding,
+                                                 _separadores_candidatos(arquivo_info, encoding))
             
-            dataframes_com_info.append(df)
+            if df is None or df.empty:
+                print(f"  ✗ Não foi possível ler o arquivo")
+                return None
             
-        except Exception as e:
-            print(f"  ✗ ({str(e)[:60]})")
-            import traceback
-            traceback.print_exc()
+            if cache is not None and not dialeto:
+                cache.registrar(arquivo_info, {'encoding': encoding, 'sep': sep,
+                                               'mapeamento': mapeamento})
+        else:
+            print("  ✗ (formato não suportado)")
+            return None
+        
+        # Normalizar colunas
+        linhas_lidas = len(df)
+        df = normalizar_dataframe(df, mapeamento=mapeamento)
+        
+        # Adicionar informações de ano/trimestre
+        if not df.empty and 'ano' not in df.columns:
+            df['ano'] = arquivo_info['ano']
+            df['trimestre'] = arquivo_info['trimestre']
+        
+        df.attrs['linhas_lidas'] = linhas_lidas
+        return df
+        
+    except Exception as e:
+        print(f"  ✗ ({str(e)[:60]})")
+        import traceback
+        traceback.print_exc()
+        return None
+
+
+def _ler_texto(arquivo_info, encoding, candidatos, mapeamento_cache=None, uma_coluna=True):
+    """
+    Lê o CSV/TXT com o primeiro separador de `candidatos` que funcionar.
+    Retorna (df, sep, mapeamento), ou (None, None, None) se nenhum servir.
+    uma_coluna=False recusa separadores que deixam o cabeçalho com uma
+    coluna só (dialeto vindo do cache que não vale mais para o arquivo).
+    """
+    extensao = _extensao(arquivo_info)
+    for sep in candidatos:
+        try:
+            # Mapeamento resolvido só pelo cabeçalho: lê apenas as colunas usadas
+            with abrir_origem(arquivo_info) as origem:
+                cabecalho = pd.read_csv(origem, encoding=encoding, sep=sep, nrows=0).columns
+            if not uma_coluna and len(cabecalho) < 2:
+                continue
+            mapeamento, usecols, dtype = projetar_colunas(cabecalho, mapeamento_cache)
+            with abrir_origem(arquivo_info) as origem:
+                df = pd.read_csv(origem, encoding=encoding, sep=sep, 
+                               on_bad_lines='skip', usecols=usecols, dtype=dtype)
+        except Exception:
             continue
+        if extensao == '.csv':
+            print(f"  ✓ (CSV: {len(df)} linhas, sep='{sep}', {encoding})")
+            print(f"    Colunas: {len(df.columns)} de {len(cabecalho)}")
+        else:
+            print(f"  ✓ (TXT: {len(df)} linhas, sep='{sep}', {encoding})")
+        return df, sep, mapeamento
+    return None, None, None
+
+
+def _processar_e_medir(arquivo_info, cache=None):
+    """processar_arquivo com a medição do arquivo (para metricas_pipeline)."""
+    inicio = time.perf_counter()
+    df = processar_arquivo(arquivo_info, cache)
+    medicao = {
+        'nome': _rotulo(arquivo_info),
+        'segundos': time.perf_counter() - inicio,
+        'linhas_entrada': df.attrs.get('linhas_lidas') if df is not None else 0,
+        'linhas_saida': len(df) if df is not None else 0,
+        'bytes_lidos': _tamanho_seguro(arquivo_info),
+    }
+    return df, medicao
+
+
+def _tamanho_seguro(arquivo_info):
+    try:
+        return _tamanho_origem(arquivo_info)
+    except (OSError, KeyError, zipfile.BadZipFile):
+        return None
+
+
+def _processar_arquivo_isolado(arquivo_info, dados_cache=None):
+    """
+    Executa processar_arquivo em um processo worker, capturando a saída
+    para que o processo principal a imprima na ordem dos arquivos.
+    O worker recebe uma cópia do cache de dialetos e devolve só o que
+    aprendeu, para o processo principal mesclar, junto com a medição do
+    arquivo.
+    """
+    cache = CacheDialetos(dados_cache) if dados_cache is not None else None
+    saida = io.StringIO()
+    with contextlib.redirect_stdout(saida), contextlib.redirect_stderr(saida):
+        df, medicao = _processar_e_medir(arquivo_info, cache)
+    return df, saida.getvalue(), cache.delta() if cache is not None else None, medicao
+
+
+def _processar_arquivos_em_paralelo(arquivos_info, workers, cache=None):
+    """
+    Distribui os arquivos entre processos. Erros de leitura já são tratados
+    dentro de processar_arquivo; se um worker morrer (ex.: falta de memória),
+    os arquivos afetados são refeitos um a um em processos isolados, para que
+    apenas o arquivo problemático seja descartado.
+    """
+    resultados = [None] * len(arquivos_info)
+    saidas = [''] * len(arquivos_info)
+    deltas = [None] * len(arquivos_info)
+    medicoes = [None] * len(arquivos_info)
+    falhas = []
+    dados_cache = cache.dados if cache is not None else None
     
-    print(f"\n✓ Total de arquivos processados com sucesso: {len(dataframes_com_info)}")
-    return dataframes_com_info
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futuros = {
+            executor.submit(_processar_arquivo_isolado, arquivo_info, dados_cache): posicao
+            for posicao, arquivo_info in enumerate(arquivos_info)
+        }
+        for futuro in as_completed(futuros):
+            posicao = futuros[futuro]
+            try:
+                resultados[posicao], saidas[posicao], deltas[posicao], medicoes[posicao] = futuro.result()
+            except Exception:
+                falhas.append(posicao)
+    
+    for posicao in sorted(falhas):
+        try:
+            with ProcessPoolExecutor(max_workers=1) as executor:
+                resultados[posicao], saidas[posicao], deltas[posicao], medicoes[posicao] = executor.submit(
+                    _processar_arquivo_isolado, arquivos_info[posicao], dados_cache).result()
+        except Exception as e:
+            saidas[posicao] = (f"→ Processando {_rotulo(arquivos_info[posicao])}...\n"
+                               f"  ✗ (worker interrompido: {str(e)[:60]})\n")
+    
+    for saida in saidas:
+        print(saida, end='')
+    
+    for medicao in medicoes:
+        if medicao:
+            metricas_pipeline.registrar_arquivo(**medicao)
+    
+    if cache is not None:
+        for delta in deltas:
+            if delta:
+                cache.aplicar(delta)
+    
+    return resultados
 
 
 # ============================================================================
 # FUNÇÕES AUXILIARES
 # ============================================================================
 
+EXTENSOES_SUPORTADAS = ('.csv', '.txt', '.xlsx', '.xls')
+
+
+def listar_membros_zip(arquivo_zip):
+    """Membros CSV/TXT/XLSX de um arquivo ZIP, na ordem do arquivo."""
+    try:
+        with zipfile.ZipFile(arquivo_zip) as zf:
+            return [
+                info.filename for info in zf.infolist()
+                if not info.is_dir()
+                and not info.filename.startswith('__MACOSX/')
+                and PurePosixPath(info.filename).suffix.lower() in EXTENSOES_SUPORTADAS
+            ]
+    except zipfile.BadZipFile:
+        print(f"  ✗ ZIP inválido: {arquivo_zip.name}")
+        return []
+
+
+@contextlib.contextmanager
+def abrir_origem(arquivo_info):
+    """
+    Abre o arquivo em modo binário. Para membros de ZIP ('membro' em
+    arquivo_info) o conteúdo é descompactado em fluxo, sem extração.
+    """
+    membro = arquivo_info.get('membro')
+    if membro is None:
+        with open(arquivo_info['caminho'], 'rb') as f:
+            yield f
+    else:
+        with zipfile.ZipFile(arquivo_info['caminho']) as zf, zf.open(membro) as f:
+            yield f
+
+
+def _info_membro(arquivo_info):
+    with zipfile.ZipFile(arquivo_info['caminho']) as zf:
+        return zf.getinfo(arquivo_info['membro'])
+
+
+def _extensao(arquivo_info):
+    return PurePosixPath(arquivo_info.get('membro') or arquivo_info['caminho'].name).suffix.lower()
+
+
+def _rotulo(arquivo_info):
+    if arquivo_info.get('membro'):
+        return f"{arquivo_info['caminho'].name}/{arquivo_info['membro']}"
+    return arquivo_info['caminho'].name
+
+
+def _tamanho_origem(arquivo_info):
+    """Tamanho em bytes do conteúdo (descompactado, no caso de membros de ZIP)."""
+    if arquivo_info.get('membro'):
+        return _info_membro(arquivo_info).file_size
+    return arquivo_info['caminho'].stat().st_size
+
+
+def _fonte_planilha(arquivo_info):
+    """Planilhas precisam de acesso aleatório: membros de ZIP vão para memória."""
+    if arquivo_info.get('membro'):
+        with abrir_origem(arquivo_info) as origem:
+            return BytesIO(origem.read())
+    return arquivo_info['caminho']
+
+
+def _separadores_candidatos(arquivo_info, encoding):
+    """
+    Gera, em ordem de preferência, os delimitadores que produzem um
+    cabeçalho plausível (lido com nrows=1) para o arquivo CSV/TXT. Os que
+    dão uma única coluna (aceitos para .csv) só vêm depois de todos os que
+    dividem o cabeçalho: senão um CSV com ',' seria lido com ';' como uma
+    coluna só e perderia todas as linhas.
+    """
+    extensao = _extensao(arquivo_info)
+    if extensao == '.txt':
+        separadores = ['\t', ';', ',', '|']
+    else:
+        separadores = [';', ',', '\t', '|']
+    
+    uma_coluna = []
+    for sep in separadores:
+        try:
+            with abrir_origem(arquivo_info) as origem:
+                df = pd.read_csv(origem, encoding=encoding, sep=sep, 
+                               on_bad_lines='skip', nrows=1)
+        except:
+            continue
+        if len(df.columns) > 1:
+            yield sep
+        elif len(df.columns) == 1 and sep != ',' and extensao == '.csv':
+            uma_coluna.append(sep)
+    yield from uma_coluna
+
+
 def detectar_encoding(caminho_arquivo):
     """Detecta encoding de arquivo de texto."""
     try:
         with open(caminho_arquivo, 'rb') as f:
-            resultado = chardet.detect(f.read(10000))
-            return resultado.get('encoding', 'utf-8') or 'utf-8'
+            return _detectar_encoding_amostra(f.read(10000))
     except:
         return 'utf-8'
 
 
-def normalizar_dataframe(df):
+def _detectar_encoding_origem(arquivo_info):
+    """detectar_encoding para arquivos soltos ou membros de ZIP."""
+    try:
+        with abrir_origem(arquivo_info) as origem:
+            return _detectar_encoding_amostra(origem.read(10000))
+    except:
+        return 'utf-8'
+
+
+def _detectar_encoding_amostra(amostra):
+    resultado = chardet.detect(amostra)
+    return resultado.get('encoding', 'utf-8') or 'utf-8'
+
+
+def normalizar_dataframe(df, verbose=True, mapeamento=None):
     """
     Normaliza DataFrame procurando por colunas esperadas:
     CNPJ, Razão Social, Trimestre, Ano, Valor Despesas
+    
+    mapeamento: {coluna padrão: coluna do arquivo} já resolvido (ex.: vindo
+    do cache de dialetos); se ausente, é resolvido a partir das colunas.
     """
     # Converter todos os nomes de coluna para string lowercase
-    df.columns = df.columns.astype(str).str.lower().str.strip()
+    df.columns = _nomes_colunas_normalizados(df.columns)
     
     # Mostrar colunas encontradas no arquivo
-    print(f"  Colunas encontradas ({len(df.columns)}): {list(df.columns)[:10]}")
+    if verbose:
+        print(f"  Colunas encontradas ({len(df.columns)}): {list(df.columns)[:10]}")
+    
+    if mapeamento is None or any(col not in df.columns for col in mapeamento.values()):
+        mapeamento = resolver_mapeamento(df.columns)
+    
+    df_normalizado = pd.DataFrame()
     
+    for col_padrão, col_encontrada in mapeamento.items():
+        df_normalizado[col_padrão] = df[col_encontrada]
+        if verbose:
+            print(f"    → Mapeado '{col_padrão}' ← '{col_encontrada}'")
+    
+    if 'valor' in df_normalizado.columns:
+        df_normalizado['valor'] = _virgula_decimal(df_normalizado['valor'])
+    
+    return df_normalizado
+
+
+def _virgula_decimal(valores):
+    """
+    '1234,56' → '1234.56': valores com vírgula decimal (layout das
+    demonstrações contábeis da ANS) passam a ser conversíveis por float().
+    Só o formato inequívoco (dígitos, vírgula, dígitos, sem separador de
+    milhar) é convertido; o resto fica como está.
+    """
+    if pd.api.types.is_numeric_dtype(valores):
+        return valores
+    candidatos = valores.str.contains(',', regex=False, na=False)
+    if not candidatos.any():
+        return valores
+    virgula = candidatos & valores.str.fullmatch(r'\s*-?\d+,\d+\s*', na=False)
+    valores = valores.copy()
+    valores[virgula] = valores[virgula].str.replace(',', '.', regex=False)
+    return valores
+
+
+def _nomes_colunas_normalizados(colunas):
+    return pd.Index(colunas).astype(str).str.lower().str.strip()
+
+
+# Colunas lidas como texto já na leitura (a consolidação aplica str() nelas).
+# cnpj e valor mantêm a inferência numérica do pandas para não alterar o
+# formato dos CNPJs nem a conversão de valores do consolidado.
+COLUNAS_TEXTO = ('razao_social', 'trimestre', 'ano')
+
+
+def projetar_colunas(cabecalho, mapeamento=None):
+    """
+    Resolve o mapeamento só pelo cabeçalho e retorna (mapeamento, usecols,
+    dtype) para ler do arquivo apenas as colunas que normalizar_dataframe
+    vai usar, com os tipos definidos antecipadamente.
+    """
+    normalizadas = _nomes_colunas_normalizados(cabecalho)
+    if mapeamento is None or any(col not in normalizadas for col in mapeamento.values()):
+        mapeamento = resolver_mapeamento(normalizadas)
+    
+    usadas = set(mapeamento.values())
+    texto = {mapeamento[col] for col in COLUNAS_TEXTO if col in mapeamento}
+    dtype = {original: str for original, normalizada in zip(cabecalho, normalizadas)
+             if normalizada in texto}
+    
+    def usecols(coluna):
+        return str(coluna).lower().strip() in usadas
+    
+    return mapeamento, usecols, dtype
+
+
+def resolver_mapeamento(colunas):
+    """
+    Resolve {coluna padrão: coluna do arquivo} a partir dos nomes de coluna
+    (já normalizados para minúsculas).
+    """
     # Mapping de possíveis nomes de colunas
     mapeamento = {
         'cnpj': ['cnpj', 'cnpj_empresa', 'cnpj_operadora', 'cod_operadora', 'codigo', 'reg_ans'],
@@ -264,13 +658,13 @@ def normalizar_dataframe(df):
         'ano': ['ano', 'year']
     }
     
-    df_normalizado = pd.DataFrame()
+    resolvido = {}
     
     # Mapear colunas encontradas
     for col_padrão, possiveis_nomes in mapeamento.items():
         col_encontrada = None
         
-        for col_existente in df.columns:
+        for col_existente in colunas:
             for possivel in possiveis_nomes:
                 if possivel in col_existente or col_existente in possivel:
                     col_encontrada = col_existente
@@ -279,17 +673,165 @@ def normalizar_dataframe(df):
                 break
         
         if col_encontrada:
-            df_normalizado[col_padrão] = df[col_encontrada]
-            print(f"    → Mapeado '{col_padrão}' ← '{col_encontrada}'")
+            resolvido[col_padrão] = col_encontrada
     
-    return df_normalizado
+    return resolvido
+
+
+# ============================================================================
+# CACHE DE DIALETOS (ENCODING, SEPARADOR E MAPEAMENTO DE COLUNAS)
+# ============================================================================
+
+class CacheDialetos:
+    """
+    Cache persistente do "dialeto" de arquivos CSV/TXT: encoding, separador
+    e mapeamento de colunas já resolvido.
+    
+    Duas chaves levam ao mesmo dialeto:
+    - impressão digital do arquivo (caminho, tamanho, mtime): o arquivo já
+      foi visto e nem o cabeçalho precisa ser lido;
+    - assinatura do cabeçalho (hash da primeira linha em bytes): arquivos de
+      trimestres diferentes com o mesmo layout reaproveitam a detecção.
+    """
+    
+    def __init__(self, dados=None, caminho=None):
+        self.dados = dados or {'assinaturas': {}, 'arquivos': {}}
+        self.caminho = caminho
+        self.acertos = 0
+        self.falhas = 0
+        self._novos = {'assinaturas': {}, 'arquivos': {}}
+        self._descartados = []  # (impressão digital, assinatura)
+    
+    @classmethod
+    def carregar(cls, caminho=None):
+        caminho = Path(caminho or CACHE_DIALETOS_PATH)
+        dados = None
+        if caminho.exists():
+            try:
+                with open(caminho, 'r', encoding='utf-8') as f:
+                    dados = json.load(f)
+            except (OSError, ValueError):
+                dados = None
+        return cls(dados, caminho)
+    
+    def buscar(self, arquivo_info):
+        """Retorna o dialeto conhecido do arquivo, ou None (falha de cache)."""
+        impressao = _impressao_digital(arquivo_info)
+        assinatura = self.dados['arquivos'].get(impressao)
+        
+        if assinatura is None:
+            assinatura = _assinatura_cabecalho(arquivo_info)
+            dialeto = self.dados['assinaturas'].get(assinatura)
+            # Mesmo cabeçalho não garante o mesmo encoding no corpo do arquivo
+            if dialeto and not _encoding_compativel(arquivo_info, dialeto['encoding']):
+                dialeto = None
+            if dialeto:
+                self._guardar('arquivos', impressao, assinatura)
+        else:
+            dialeto = self.dados['assinaturas'].get(assinatura)
+        
+        if dialeto:
+            self.acertos += 1
+        else:
+            self.falhas += 1
+        return dialeto
+    
+    def registrar(self, arquivo_info, dialeto):
+        assinatura = _assinatura_cabecalho(arquivo_info)
+        self._guardar('assinaturas', assinatura, dialeto)
+        self._guardar('arquivos', _impressao_digital(arquivo_info), assinatura)
+    
+    def descartar(self, arquivo_info):
+        """
+        Esquece o dialeto do arquivo (e do seu cabeçalho) depois que a
+        leitura com ele falhou; a busca conta como falha de cache.
+        """
+        impressao = _impressao_digital(arquivo_info)
+        assinatura = self.dados['arquivos'].get(impressao) or _assinatura_cabecalho(arquivo_info)
+        self._remover(impressao, assinatura)
+        self._descartados.append((impressao, assinatura))
+        self.acertos -= 1
+        self.falhas += 1
+    
+    def _remover(self, impressao, assinatura):
+        for tabela, chave in (('arquivos', impressao), ('assinaturas', assinatura)):
+            self.dados[tabela].pop(chave, None)
+            self._novos[tabela].pop(chave, None)
+    
+    def _guardar(self, tabela, chave, valor):
+        self.dados[tabela][chave] = valor
+        self._novos[tabela][chave] = valor
+    
+    def delta(self):
+        """Entradas novas e contadores desta instância (usado pelos workers)."""
+        return dict(self._novos, descartados=self._descartados,
+                    acertos=self.acertos, falhas=self.falhas)
+    
+    def aplicar(self, delta):
+        # Descartes antes das entradas novas: o worker pode ter descartado
+        # um dialeto e registrado o detectado de novo para o mesmo arquivo
+        for impressao, assinatura in delta['descartados']:
+            self._remover(impressao, assinatura)
+            self._descartados.append((impressao, assinatura))
+        for tabela in ('assinaturas', 'arquivos'):
+            for chave, valor in delta[tabela].items():
+                self._guardar(tabela, chave, valor)
+        self.acertos += delta['acertos']
+        self.falhas += delta['falhas']
+    
+    def salvar(self):
+        if self.caminho is None:
+            return
+        self.caminho.parent.mkdir(parents=True, exist_ok=True)
+        temporario = self.caminho.with_suffix('.tmp')
+        with open(temporario, 'w', encoding='utf-8') as f:
+            json.dump(self.dados, f, ensure_ascii=False)
+        os.replace(temporario, self.caminho)
+
+
+def _impressao_digital(arquivo_info):
+    caminho = arquivo_info['caminho']
+    if arquivo_info.get('membro'):
+        # O CRC do membro identifica o conteúdo sem precisar descompactá-lo
+        info = _info_membro(arquivo_info)
+        return f"{caminho.resolve()}!{info.filename}|{info.file_size}|{info.CRC:08x}"
+    stat = caminho.stat()
+    return f"{caminho.resolve()}|{stat.st_size}|{stat.st_mtime_ns}"
+
+
+def _assinatura_cabecalho(arquivo_info):
+    """Hash da primeira linha (bytes crus) e da extensão do arquivo."""
+    with abrir_origem(arquivo_info) as origem:
+        cabecalho = origem.read(65536).split(b'\n', 1)[0]
+    return hashlib.sha1(_extensao(arquivo_info).encode() + b'\0' + cabecalho).hexdigest()
+
+
+def _encoding_compativel(arquivo_info, encoding):
+    """
+    Confere, na mesma amostra usada por detectar_encoding, se o encoding do
+    cache decodifica o arquivo; amostras que são UTF-8 válido com acentos
+    não aceitam um encoding de 8 bits vindo do cache.
+    """
+    with abrir_origem(arquivo_info) as origem:
+        amostra = origem.read(10000)
+    try:
+        codecs.getincrementaldecoder(encoding)().decode(amostra, final=False)
+    except (UnicodeDecodeError, LookupError):
+        return False
+    if amostra.isascii() or 'utf' in codecs.lookup(encoding).name:
+        return True
+    try:
+        codecs.getincrementaldecoder('utf-8')().decode(amostra, final=False)
+    except UnicodeDecodeError:
+        return True
+    return False
 
 
 # ============================================================================
 # PASSO 4: CONSOLIDAÇÃO E TRATAMENTO DE INCONSISTÊNCIAS
 # ============================================================================
 
-def consolidar_e_tratar_inconsistencias(arquivos_dataframes):
+def consolidar_e_tratar_inconsistencias(arquivos_dataframes, modo=None, destino_invalidos=None):
     """
     Consolida dados de múltiplos arquivos tratando inconsistências.
     
@@ -297,18 +839,185 @@ def consolidar_e_tratar_inconsistencias(arquivos_dataframes):
     1. CNPJs duplicados com razões sociais diferentes → MARCADO COMO SUSPEITO
     2. Valores zerados ou negativos → REMOVIDO COM LOG
     3. Trimestres com formatos inconsistentes → NORMALIZADO
+    
+    modo: 'vetorizado' (padrão, aplica as regras sobre colunas inteiras) ou
+    'linha_a_linha' (implementação original com iterrows, mantida para
+    comparação dos resultados).
     """
     print("\n" + "="*80)
     print("PASSO 4: CONSOLIDAÇÃO E TRATAMENTO DE INCONSISTÊNCIAS")
     print("="*80)
     
-    relatorio_inconsistencias = {
+    modo = modo or MODO_CONSOLIDACAO
+    if modo == 'linha_a_linha':
+        df_consolidado, relatorio_inconsistencias = _consolidar_linha_a_linha(
+            arquivos_dataframes, destino_invalidos)
+    elif modo == 'vetorizado':
+        df_consolidado, relatorio_inconsistencias = _consolidar_vetorizado(
+            arquivos_dataframes, destino_invalidos)
+    else:
+        raise ValueError(f"Modo de consolidação desconhecido: {modo}")
+    
+    _finalizar_relatorio(relatorio_inconsistencias)
+    _imprimir_relatorio_inconsistencias(relatorio_inconsistencias)
+    
+    return df_consolidado, relatorio_inconsistencias
+
+
+def _novo_relatorio_inconsistencias(destino_invalidos=None, semente=None):
+    """
+    Relatório vazio. Durante a consolidação 'valores_invalidos' é um
+    ValoresInvalidos; _finalizar_relatorio troca-o pelo resumo em JSON.
+    """
+    return {
         'cnpj_duplicados_suspeitos': [],
-        'valores_invalidos': [],
+        'valores_invalidos': ValoresInvalidos(destino_invalidos, semente=semente),
         'linhas_removidas': 0,
         'linhas_processadas': 0,
         'linhas_finais': 0
     }
+
+
+CONTADORES_RELATORIO = ('linhas_removidas', 'linhas_processadas', 'linhas_finais')
+
+
+def _finalizar_relatorio(relatorio_inconsistencias):
+    """Fecha o arquivo de valores inválidos e deixa o relatório serializável."""
+    relatorio_inconsistencias['valores_invalidos'] = relatorio_inconsistencias['valores_invalidos'].finalizar()
+    return relatorio_inconsistencias
+
+
+class ValoresInvalidos:
+    """
+    Valores zerados/negativos encontrados na consolidação, com memória
+    constante: contadores por tipo, uma amostra aleatória de tamanho fixo e,
+    se houver `destino`, a lista completa gravada em CSV (cnpj;tipo;valor)
+    à medida que as linhas chegam.
+    
+    A amostra é bottom-k: cada ocorrência recebe uma chave uniforme e ficam
+    as k menores. Assim amostras de execuções parciais podem ser mescladas
+    (ver mesclar) e o resultado continua uniforme.
+    """
+    
+    CAMPOS = ['cnpj', 'tipo', 'valor']
+    
+    def __init__(self, destino=None, tamanho_amostra=None, semente=None):
+        self.destino = Path(destino) if destino else None
+        self.tamanho_amostra = (TAMANHO_AMOSTRA_INVALIDOS if tamanho_amostra is None
+                                else tamanho_amostra)
+        self.por_tipo = {'NEGATIVO': 0, 'ZERADO': 0}
+        self.total = 0
+        self._rng = np.random.default_rng(SEMENTE_AMOSTRA if semente is None else semente)
+        self._amostra = []  # [(chave, ordem, item)], ordenada pela chave
+        self._arquivo = None
+        self._escritor = None
+    
+    def adicionar(self, cnpjs, tipos, valores):
+        """Registra ocorrências (listas paralelas, na ordem das linhas)."""
+        quantidade = len(cnpjs)
+        if not quantidade:
+            return
+        
+        nomes, contagens = np.unique(np.asarray(tipos, dtype=object), return_counts=True)
+        for tipo, contagem in zip(nomes.tolist(), contagens.tolist()):
+            self.por_tipo[tipo] = self.por_tipo.get(tipo, 0) + contagem
+        
+        if self.tamanho_amostra > 0:
+            chaves = self._rng.random(quantidade)
+            cheia = len(self._amostra) >= self.tamanho_amostra
+            candidatos = np.flatnonzero(chaves < self._amostra[-1][0]) if cheia else np.arange(quantidade)
+            if len(candidatos) > self.tamanho_amostra:
+                menores = np.argpartition(chaves[candidatos], self.tamanho_amostra - 1)
+                candidatos = np.sort(candidatos[menores[:self.tamanho_amostra]])
+            if len(candidatos):
+                self._juntar_amostra(
+                    (float(chaves[i]), self.total + int(i),
+                     {'cnpj': cnpjs[i], 'tipo': tipos[i], 'valor': valores[i]})
+                    for i in candidatos.tolist()
+                )
+        
+        if self.destino is not None:
+            self._abrir().writerows(zip(cnpjs, tipos, valores))
+        self.total += quantidade
+    
+    def _juntar_amostra(self, novos):
+        self._amostra = heapq.nsmallest(
+            self.tamanho_amostra, heapq.merge(self._amostra, sorted(novos)))
+    
+    def _abrir(self):
+        if self._escritor is None:
+            self.destino.parent.mkdir(parents=True, exist_ok=True)
+            self._arquivo = open(self.destino, 'w', newline='', encoding='utf-8')
+            self._escritor = csv.writer(self._arquivo, delimiter=';')
+            self._escritor.writerow(self.CAMPOS)
+        return self._escritor
+    
+    def ponto_de_restauracao(self):
+        """Estado atual, para desfazer com restaurar() o que vier depois."""
+        posicao = None
+        if self._arquivo is not None:
+            self._arquivo.flush()
+            posicao = self._arquivo.tell()
+        return (self.total, dict(self.por_tipo), list(self._amostra),
+                self._rng.bit_generator.state, posicao)
+    
+    def restaurar(self, ponto):
+        """Volta ao ponto_de_restauracao(), truncando o CSV de valores inválidos."""
+        self.total, self.por_tipo, self._amostra, estado_rng, posicao = ponto
+        self._rng.bit_generator.state = estado_rng
+        if self._arquivo is not None:
+            self._arquivo.flush()
+            self._arquivo.seek(posicao or 0)
+            self._arquivo.truncate()
+            if posicao is None:
+                self._escritor.writerow(self.CAMPOS)
+    
+    def mesclar(self, estado, arquivo=None):
+        """
+        Acrescenta o estado salvo de um resultado parcial (ver estado()) e,
+        se informado, o CSV completo correspondente.
+        """
+        for tipo, contagem in estado['por_tipo'].items():
+            self.por_tipo[tipo] = self.por_tipo.get(tipo, 0) + contagem
+        if self.tamanho_amostra > 0:
+            self._juntar_amostra(
+                (item['chave'], self.total + item['ordem'],
+                 {campo: item[campo] for campo in self.CAMPOS})
+                for item in estado['amostra']
+            )
+        if self.destino is not None and arquivo is not None and Path(arquivo).exists():
+            self._abrir()
+            self._arquivo.flush()
+            with open(arquivo, 'r', newline='', encoding='utf-8') as origem:
+                origem.readline()  # cabeçalho
+                shutil.copyfileobj(origem, self._arquivo)
+        self.total += estado['total']
+    
+    def estado(self):
+        """Contadores e amostra com chaves/ordem, para mesclar depois."""
+        return {
+            'total': self.total,
+            'por_tipo': dict(self.por_tipo),
+            'amostra': [dict(item, chave=chave, ordem=ordem)
+                        for chave, ordem, item in sorted(self._amostra, key=lambda e: e[1])],
+        }
+    
+    def finalizar(self):
+        """Fecha o CSV (criado vazio se não houve ocorrências) e retorna o resumo."""
+        if self.destino is not None:
+            self._abrir()
+            self._arquivo.close()
+        return {
+            'total': self.total,
+            'por_tipo': dict(self.por_tipo),
+            'amostra': [item for _, _, item in sorted(self._amostra, key=lambda e: e[1])],
+            'arquivo': self.destino.name if self.destino is not None else None,
+        }
+
+
+def _consolidar_linha_a_linha(arquivos_dataframes, destino_invalidos=None):
+    """Consolidação original, linha a linha (referência para o modo vetorizado)."""
+    relatorio_inconsistencias = _novo_relatorio_inconsistencias(destino_invalidos)
     
     dados_consolidados = []
     
@@ -344,21 +1053,15 @@ def consolidar_e_tratar_inconsistencias(arquivos_dataframes):
                     valor = 0
                 
                 if valor < 0:
-                    relatorio_inconsistencias['valores_invalidos'].append({
-                        'cnpj': cnpj,
-                        'tipo': 'NEGATIVO',
-                        'valor': valor
-                    })
+                    relatorio_inconsistencias['valores_invalidos'].adicionar(
+                        [cnpj], ['NEGATIVO'], [valor])
                     relatorio_inconsistencias['linhas_removidas'] += 1
                     linha_processada = False
                     continue
                 
                 if valor == 0:
-                    relatorio_inconsistencias['valores_invalidos'].append({
-                        'cnpj': cnpj,
-                        'tipo': 'ZERADO',
-                        'valor': valor
-                    })
+                    relatorio_inconsistencias['valores_invalidos'].adicionar(
+                        [cnpj], ['ZERADO'], [valor])
                     # Manter mas marcar como suspeito
                     linha_processada = True
                 
@@ -405,6 +1108,184 @@ def consolidar_e_tratar_inconsistencias(arquivos_dataframes):
     if not df_consolidado.empty:
         df_consolidado = df_consolidado.sort_values(['Ano', 'Trimestre', 'CNPJ'])
     
+    return df_consolidado, relatorio_inconsistencias
+
+
+def _consolidar_vetorizado(arquivos_dataframes, destino_invalidos=None):
+    """
+    Consolidação colunar: aplica as mesmas regras do modo linha a linha
+    sobre colunas inteiras de cada DataFrame.
+    """
+    relatorio_inconsistencias = _novo_relatorio_inconsistencias(destino_invalidos)
+    
+    compacto = esquema_compacto.USAR_ESQUEMA_COMPACTO
+    memoria_texto = 0
+    
+    blocos = []
+    for df in arquivos_dataframes:
+        if df is None or df.empty:
+            continue
+        bloco = _consolidar_bloco(df, relatorio_inconsistencias)
+        if not bloco.empty:
+            if compacto:
+                # Cada bloco é compactado assim que sai da consolidação, para
+                # que as versões em texto não fiquem todas em memória juntas
+                memoria_texto += esquema_compacto.memoria_bytes(bloco)
+                bloco = esquema_compacto.compactar(bloco)
+            blocos.append(bloco)
+    
+    if not blocos:
+        return pd.DataFrame(), relatorio_inconsistencias
+    
+    if compacto:
+        df_consolidado = esquema_compacto.concatenar(blocos)
+        _reportar_memoria_compacta(memoria_texto, esquema_compacto.memoria_bytes(df_consolidado))
+    else:
+        df_consolidado = pd.concat(blocos, ignore_index=True)
+    
+    pares = esquema_compacto.expandir(df_consolidado[['CNPJ', 'RazaoSocial']].drop_duplicates())
+    relatorio_inconsistencias['cnpj_duplicados_suspeitos'] = _cnpjs_suspeitos(pares)
+    
+    df_consolidado = df_consolidado.sort_values(['Ano', 'Trimestre', 'CNPJ'])
+    
+    return df_consolidado, relatorio_inconsistencias
+
+
+def _reportar_memoria_compacta(memoria_texto, memoria_compacta):
+    """Mostra e registra nas métricas a memória economizada pelo esquema compacto."""
+    economia = 1 - memoria_compacta / memoria_texto if memoria_texto else 0
+    print(f"✓ Esquema compacto: {memoria_texto / 1024 / 1024:,.1f} MB → "
+          f"{memoria_compacta / 1024 / 1024:,.1f} MB ({economia:.0%} menos memória)")
+    metricas_pipeline.anotar(memoria_texto_bytes=memoria_texto,
+                             memoria_compacta_bytes=memoria_compacta)
+
+
+def _consolidar_bloco(df, relatorio_inconsistencias):
+    """
+    Aplica as regras de consolidação a um DataFrame normalizado inteiro.
+    Atualiza os contadores e os valores inválidos do relatório e
+    retorna as linhas mantidas já no formato final (CNPJ, RazaoSocial, ...).
+    """
+    relatorio_inconsistencias['linhas_processadas'] += len(df)
+    df = df.reset_index(drop=True)
+    
+    cnpj = _coluna_como_texto(df, 'cnpj')
+    razao_social = _coluna_como_texto(df, 'razao_social')
+    trimestre = _coluna_como_texto(df, 'trimestre')
+    ano = _coluna_como_texto(df, 'ano')
+    valor, valor_convertido = _coluna_valor(df)
+    
+    # Validação 1: CNPJ preenchido e valor conversível para número
+    valido = valor_convertido & (cnpj != '') & (cnpj != 'nan')
+    
+    # Validação 2: valores negativos são removidos, zerados mantidos com log
+    negativo = valido & (valor < 0)
+    zerado = valido & (valor == 0)
+    invalidos = negativo | zerado
+    if invalidos.any():
+        tipos = np.where(negativo[invalidos], 'NEGATIVO', 'ZERADO')
+        relatorio_inconsistencias['valores_invalidos'].adicionar(
+            cnpj[invalidos].tolist(), tipos.tolist(), valor[invalidos].tolist())
+    
+    mantidos = valido & ~negativo
+    
+    # Normalizar trimestre (Qn → n, depois 0n)
+    trimestre = trimestre[mantidos]
+    trimestre_upper = trimestre.str.upper()
+    trimestre = trimestre.where(~trimestre_upper.str.startswith('Q'),
+                                trimestre_upper.str.replace('Q', '', regex=False))
+    trimestre = trimestre.str.zfill(2)
+    
+    # Normalizar ano (XX → 20XX); anos curtos não numéricos descartam a linha
+    ano = ano[mantidos]
+    curtos = ano.str.len() < 4
+    if curtos.any():
+        expansao = {valor_ano: _expandir_ano(valor_ano) for valor_ano in ano[curtos].unique()}
+        ano = ano.copy()
+        ano[curtos] = ano[curtos].map(expansao)
+    ano_valido = ano.notna()
+    
+    relatorio_inconsistencias['linhas_removidas'] += int(
+        (~valido).sum() + negativo.sum() + (~ano_valido).sum()
+    )
+    
+    finais = mantidos.copy()
+    finais[mantidos] = ano_valido
+    valor_final = valor[finais]
+    razao_final = razao_social[finais]
+    
+    bloco = pd.DataFrame({
+        'CNPJ': cnpj[finais].to_numpy(dtype=object),
+        'RazaoSocial': razao_final.where(razao_final != '', 'N/A').to_numpy(dtype=object),
+        'Trimestre': trimestre[ano_valido].to_numpy(dtype=object),
+        'Ano': ano[ano_valido].to_numpy(dtype=object),
+        'ValorDespesas': valor_final.to_numpy(dtype='float64'),
+        'status': np.where(valor_final.to_numpy() > 0, 'OK', 'ZERADO').astype(object),
+    })
+    relatorio_inconsistencias['linhas_finais'] += len(bloco)
+    
+    return bloco
+
+
+def _coluna_como_texto(df, coluna):
+    """Equivalente colunar de str(valor).strip(); '' quando a coluna não existe."""
+    if coluna not in df.columns:
+        return pd.Series('', index=df.index, dtype=object)
+    serie = df[coluna]
+    texto = serie.astype(str).astype(object)
+    # astype(str) preserva ausentes; str() do valor original dá 'nan', 'None', ...
+    nulos = serie.isna()
+    if nulos.any():
+        texto[nulos] = serie[nulos].map(str)
+    return texto.str.strip()
+
+
+def _coluna_valor(df):
+    """
+    Equivalente colunar de float(valor) com ausentes → 0.
+    Retorna (valores float64, máscara de valores conversíveis).
+    """
+    if 'valor' not in df.columns:
+        return pd.Series(0.0, index=df.index), pd.Series(True, index=df.index)
+    serie = df['valor']
+    if pd.api.types.is_numeric_dtype(serie):
+        valores = pd.Series(serie.to_numpy(dtype='float64', na_value=np.nan), index=df.index)
+        return valores.fillna(0.0), pd.Series(True, index=df.index)
+    
+    valores = pd.to_numeric(serie, errors='coerce').astype('float64')
+    convertido = pd.Series(True, index=df.index)
+    # O que to_numeric não reconheceu passa pelo float() do Python (ex.: '1_000', '')
+    pendentes = valores.isna() & serie.notna()
+    for idx, bruto in serie[pendentes].items():
+        try:
+            valores[idx] = float(bruto)
+        except (TypeError, ValueError):
+            convertido[idx] = False
+    return valores.fillna(0.0), convertido
+
+
+def _expandir_ano(ano):
+    """'25' → '2025'; None quando o ano curto não é numérico."""
+    try:
+        return f"20{ano}" if int(ano) < 100 else ano
+    except ValueError:
+        return None
+
+
+def _cnpjs_suspeitos(pares):
+    """
+    Recebe pares únicos (CNPJ, RazaoSocial) e retorna os CNPJs com mais de
+    uma razão social, no formato do relatório de inconsistências.
+    """
+    quantidade = pares.groupby('CNPJ', sort=False)['RazaoSocial'].transform('size')
+    suspeitos = pares[quantidade > 1].groupby('CNPJ', sort=False)['RazaoSocial'].agg(list)
+    return [
+        {'cnpj': cnpj, 'razoes_sociais': razoes}
+        for cnpj, razoes in suspeitos.items()
+    ]
+
+
+def _imprimir_relatorio_inconsistencias(relatorio_inconsistencias):
     print("\n" + "-"*80)
     print("RELATÓRIO DE INCONSISTÊNCIAS ENCONTRADAS:")
     print("-"*80)
@@ -413,10 +1294,14 @@ def consolidar_e_tratar_inconsistencias(arquivos_dataframes):
     print(f"✓ Linhas removidas: {relatorio_inconsistencias['linhas_removidas']}")
     print(f"✓ CNPJs com duplicação suspeita: {len(relatorio_inconsistencias['cnpj_duplicados_suspeitos'])}")
     
-    if relatorio_inconsistencias['valores_invalidos']:
-        print(f"✓ Valores inválidos encontrados: {len(relatorio_inconsistencias['valores_invalidos'])}")
-        print("  Primeiros exemplos:")
-        for exemplo in relatorio_inconsistencias['valores_invalidos'][:5]:
+    valores_invalidos = relatorio_inconsistencias['valores_invalidos']
+    if valores_invalidos['total']:
+        por_tipo = ', '.join(f"{tipo}: {quantidade}" for tipo, quantidade in valores_invalidos['por_tipo'].items())
+        print(f"✓ Valores inválidos encontrados: {valores_invalidos['total']} ({por_tipo})")
+        if valores_invalidos['arquivo']:
+            print(f"  Lista completa: {valores_invalidos['arquivo']}")
+        print("  Exemplos da amostra:")
+        for exemplo in valores_invalidos['amostra'][:5]:
             print(f"    - CNPJ {exemplo['cnpj']}: {exemplo['tipo']} (R$ {exemplo['valor']})")
     
     if relatorio_inconsistencias['cnpj_duplicados_suspeitos']:
@@ -436,8 +1321,6 @@ def consolidar_e_tratar_inconsistencias(arquivos_dataframes):
     print("   (Motivo: Deveriam ser créditos/devoluções, não despesas)")
     print("4. Trimestres → NORMALIZADOS PARA FORMATO QQ (01-04)")
     print("5. Anos → COMPLETADOS COM SÉCULO (XX → 20XX)")
-    
-    return df_consolidado, relatorio_inconsistencias
 
 
 # ============================================================================
@@ -452,10 +1335,26 @@ def salvar_resultado_final(df_consolidado, relatorio):
     
     # Salvar CSV
     csv_path = OUTPUT_DIR / "consolidado_despesas.csv"
-    df_consolidado.to_csv(csv_path, index=False, encoding='utf-8-sig')
+    if esquema_compacto.USAR_ESQUEMA_COMPACTO and len(df_consolidado):
+        # Expandir para texto em fatias, sem recriar o consolidado inteiro
+        with open(csv_path, 'w', encoding='utf-8-sig', newline='') as f:
+            for i, fatia in enumerate(esquema_compacto.em_blocos(df_consolidado, TAMANHO_CHUNK)):
+                fatia.to_csv(f, index=False, header=(i == 0))
+    else:
+        df_consolidado.to_csv(csv_path, index=False, encoding='utf-8-sig')
+    
+    return _finalizar_saida(csv_path, len(df_consolidado), df_consolidado.columns, relatorio,
+                            df_consolidado=df_consolidado)
+
+
+def _finalizar_saida(csv_path, total_linhas, colunas, relatorio, df_consolidado=None):
+    """Salva o relatório de inconsistências e compacta CSV + relatório em ZIP."""
     print(f"\n✓ CSV consolidado salvo: {csv_path}")
-    print(f"  Linhas: {len(df_consolidado)}")
-    print(f"  Colunas: {', '.join(df_consolidado.columns)}")
+    print(f"  Linhas: {total_linhas}")
+    print(f"  Colunas: {', '.join(colunas)}")
+    
+    if saida_colunar.GERAR_PARQUET:
+        salvar_parquet_consolidado(csv_path, df_consolidado)
     
     # Salvar relatório de inconsistências
     relatorio_path = OUTPUT_DIR / "relatorio_inconsistencias.json"
@@ -468,6 +1367,9 @@ def salvar_resultado_final(df_consolidado, relatorio):
     with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_DEFLATED) as zipf:
         zipf.write(csv_path, arcname="consolidado_despesas.csv")
         zipf.write(relatorio_path, arcname="relatorio_inconsistencias.json")
+        arquivo_invalidos = relatorio['valores_invalidos'].get('arquivo')
+        if arquivo_invalidos and (OUTPUT_DIR / arquivo_invalidos).exists():
+            zipf.write(OUTPUT_DIR / arquivo_invalidos, arcname=arquivo_invalidos)
     
     print(f"✓ Arquivo final compactado: {zip_path}")
     
@@ -475,7 +1377,7 @@ def salvar_resultado_final(df_consolidado, relatorio):
     print("\n" + "-"*80)
     print("RESUMO FINAL:")
     print("-"*80)
-    print(f"📊 Total de registros consolidados: {len(df_consolidado)}")
+    print(f"📊 Total de registros consolidados: {total_linhas}")
     print(f"💾 Tamanho do CSV: {csv_path.stat().st_size / 1024:.2f} KB")
     print(f"📦 Tamanho do ZIP: {zip_path.stat().st_size / 1024:.2f} KB")
     print(f"📁 Localização: {OUTPUT_DIR}")
@@ -483,52 +1385,599 @@ def salvar_resultado_final(df_consolidado, relatorio):
     return zip_path
 
 
+def salvar_parquet_consolidado(csv_path, df_consolidado=None):
+    """
+    Grava consolidado_despesas.parquet/ (particionado por Ano/Trimestre) a
+    partir do DataFrame em memória ou, nos modos streaming/incremental,
+    relendo o CSV consolidado em blocos.
+    """
+    parquet_path = OUTPUT_DIR / "consolidado_despesas.parquet"
+    if df_consolidado is not None and esquema_compacto.USAR_ESQUEMA_COMPACTO:
+        blocos = esquema_compacto.em_blocos(df_consolidado, TAMANHO_CHUNK)
+    elif df_consolidado is not None:
+        blocos = [df_consolidado]
+    else:
+        tipos_texto = {c: str for c in COLUNAS_CONSOLIDADO if c != 'ValorDespesas'}
+        blocos = pd.read_csv(csv_path, encoding='utf-8-sig', dtype=tipos_texto,
+                             chunksize=TAMANHO_CHUNK)
+    linhas = saida_colunar.gravar_parquet(blocos, parquet_path, saida_colunar.TIPOS_CONSOLIDADO)
+    if linhas is not None:
+        print(f"✓ Parquet consolidado salvo: {parquet_path} ({linhas} linhas)")
+    return parquet_path
+
+
+# ============================================================================
+# PASSOS 3-5 EM STREAMING (ARQUIVOS GRANDES)
+# ============================================================================
+
+COLUNAS_CONSOLIDADO = ['CNPJ', 'RazaoSocial', 'Trimestre', 'Ano', 'ValorDespesas', 'status']
+COLUNAS_ORDENACAO = ['Ano', 'Trimestre', 'CNPJ']
+
+
+def usar_streaming(arquivos_info):
+    """Decide se a execução usa o modo streaming (ver MODO_STREAMING)."""
+    if MODO_STREAMING == 'sempre':
+        return True
+    if MODO_STREAMING == 'nunca':
+        return False
+    return any(_arquivo_grande(arquivo_info) for arquivo_info in arquivos_info)
+
+
+def _arquivo_grande(arquivo_info):
+    return (_extensao(arquivo_info) in ('.csv', '.txt')
+            and _tamanho_origem(arquivo_info) > LIMITE_STREAMING_BYTES)
+
+
+def _separador_divide_cabecalho(arquivo_info, encoding, sep):
+    try:
+        with abrir_origem(arquivo_info) as origem:
+            return len(pd.read_csv(origem, encoding=encoding, sep=sep, nrows=0).columns) > 1
+    except Exception:
+        return False
+
+
+class LeituraInterrompida(Exception):
+    """A leitura em blocos de um arquivo falhou depois de começar."""
+
+
+def ler_arquivo_em_blocos(arquivo_info, tamanho_chunk=None, cache=None):
+    """
+    Lê um CSV/TXT em blocos de tamanho_chunk linhas, normalizando cada bloco.
+    Gera DataFrames no mesmo formato de processar_arquivo; a memória usada
+    depende do tamanho do bloco, não do tamanho do arquivo.
+    """
+    tamanho_chunk = tamanho_chunk or TAMANHO_CHUNK
+    print(f"→ Processando {_rotulo(arquivo_info)} em blocos de {tamanho_chunk} linhas...")
+    
+    dialeto = cache.buscar(arquivo_info) if cache is not None else None
+    if dialeto:
+        encoding, sep, mapeamento = dialeto['encoding'], dialeto['sep'], dialeto['mapeamento']
+        if not _separador_divide_cabecalho(arquivo_info, encoding, sep):
+            # Entrada obsoleta (ou corrompida): esquecer e detectar de novo
+            print(f"  ↻ Dialeto do cache não serve para o arquivo; detectando de novo")
+            cache.descartar(arquivo_info)
+            dialeto = None
+    if not dialeto:
+        encoding = _detectar_encoding_origem(arquivo_info)
+        sep = next(_separadores_candidatos(arquivo_info, encoding), None)
+        mapeamento = None
+    if sep is None:
+        print(f"  ✗ Não foi possível ler o arquivo")
+        return
+    
+    total = 0
+    try:
+        with abrir_origem(arquivo_info) as origem:
+            cabecalho = pd.read_csv(origem, encoding=encoding, sep=sep, nrows=0).columns
+        mapeamento, usecols, dtype = projetar_colunas(cabecalho, mapeamento)
+        if cache is not None and not dialeto:
+            cache.registrar(arquivo_info, {'encoding': encoding, 'sep': sep,
+                                           'mapeamento': mapeamento})
+        with abrir_origem(arquivo_info) as origem:
+            leitor = pd.read_csv(origem, encoding=encoding, sep=sep, on_bad_lines='skip',
+                                 usecols=usecols, dtype=dtype, chunksize=tamanho_chunk)
+            for numero, bloco in enumerate(leitor):
+                df = normalizar_dataframe(bloco, verbose=(numero == 0), mapeamento=mapeamento)
+                if df.empty:
+                    continue
+                if 'ano' not in df.columns:
+                    df['ano'] = arquivo_info['ano']
+                    df['trimestre'] = arquivo_info['trimestre']
+                total += len(df)
+                yield df
+    except Exception as e:
+        print(f"  ✗ ({str(e)[:60]})")
+        # Blocos já entregues não podem ser "desentregues": quem consome
+        # descarta o arquivo inteiro, como processar_arquivo faria
+        raise LeituraInterrompida(f"{_rotulo(arquivo_info)}: {e}") from e
+    
+    print(f"  ✓ ({total} linhas em blocos, sep='{sep}', {encoding})")
+
+
+class EscritorConsolidadoOrdenado:
+    """
+    Grava blocos consolidados como "runs" ordenados em disco e, no final,
+    intercala os runs (merge k-way) no CSV consolidado. O resultado tem a
+    mesma ordenação (Ano, Trimestre, CNPJ) do modo em memória, sem nunca
+    manter o conjunto inteiro em memória.
+    
+    temporario=False grava os runs diretamente em `diretorio` e os mantém
+    após finalizar (usado pelos resultados parciais do modo incremental).
+    """
+    
+    def __init__(self, diretorio, temporario=True):
+        self.temporario = temporario
+        if temporario:
+            self.diretorio = Path(tempfile.mkdtemp(prefix='runs_', dir=diretorio))
+        else:
+            self.diretorio = Path(diretorio)
+            self.diretorio.mkdir(parents=True, exist_ok=True)
+        self.runs = []
+        self.total_linhas = 0
+    
+    def adicionar(self, bloco):
+        if bloco.empty:
+            return
+        bloco = bloco[COLUNAS_CONSOLIDADO].sort_values(COLUNAS_ORDENACAO, kind='mergesort')
+        run_path = self.diretorio / f"run_{len(self.runs):05d}.csv"
+        bloco.to_csv(run_path, index=False, header=False, encoding='utf-8')
+        self.runs.append(run_path)
+        self.total_linhas += len(bloco)
+    
+    def descartar_desde(self, quantidade_runs, total_linhas):
+        """Remove os runs gravados depois dos primeiros `quantidade_runs`."""
+        for run in self.runs[quantidade_runs:]:
+            run.unlink(missing_ok=True)
+        del self.runs[quantidade_runs:]
+        self.total_linhas = total_linhas
+    
+    def finalizar(self, destino):
+        try:
+            intercalar_runs(self.runs, destino)
+        finally:
+            if self.temporario:
+                shutil.rmtree(self.diretorio, ignore_errors=True)
+        return destino
+
+
+def intercalar_runs(runs, destino):
+    """
+    Merge k-way de runs já ordenados no CSV final. heapq.merge é estável na
+    ordem dos runs, então empates mantêm a ordem de chegada dos blocos.
+    """
+    indices = [COLUNAS_CONSOLIDADO.index(coluna) for coluna in COLUNAS_ORDENACAO]
+    
+    def chave(linha):
+        return tuple(linha[i] for i in indices)
+    
+    arquivos = [open(run, 'r', encoding='utf-8', newline='') for run in runs]
+    try:
+        with open(destino, 'w', encoding='utf-8-sig', newline='') as saida:
+            writer = csv.writer(saida, lineterminator=os.linesep)
+            writer.writerow(COLUNAS_CONSOLIDADO)
+            leitores = [csv.reader(arquivo) for arquivo in arquivos]
+            writer.writerows(heapq.merge(*leitores, key=chave))
+    finally:
+        for arquivo in arquivos:
+            arquivo.close()
+    return destino
+
+
+def _blocos_do_arquivo(arquivo_info, tamanho_chunk=None, cache=None):
+    """Blocos normalizados de um arquivo: em chunks se for grande, senão inteiro."""
+    if _arquivo_grande(arquivo_info) or MODO_STREAMING == 'sempre':
+        return ler_arquivo_em_blocos(arquivo_info, tamanho_chunk, cache)
+    return [processar_arquivo(arquivo_info, cache)]
+
+
+def processar_em_streaming(arquivos_info, tamanho_chunk=None):
+    """
+    PASSOS 3 a 5 encadeados bloco a bloco: cada bloco lido é normalizado,
+    consolidado e enviado ao escritor ordenado. Arquivos pequenos (abaixo de
+    LIMITE_STREAMING_BYTES) e planilhas são lidos inteiros, como no modo
+    padrão.
+    """
+    print("\n" + "="*80)
+    print("PASSOS 3-5: PROCESSAMENTO EM STREAMING")
+    print("="*80)
+    
+    relatorio = _novo_relatorio_inconsistencias(OUTPUT_DIR / ARQUIVO_VALORES_INVALIDOS)
+    # Pares únicos (CNPJ, RazaoSocial) na ordem de chegada: crescem com a
+    # cardinalidade, não com as linhas
+    pares = {}
+    escritor = EscritorConsolidadoOrdenado(OUTPUT_DIR)
+    cache = CacheDialetos.carregar() if USAR_CACHE_DIALETOS else None
+    
+    for arquivo_info in arquivos_info:
+        inicio = time.perf_counter()
+        linhas_entrada = linhas_saida = 0
+        # Um arquivo entra inteiro ou não entra: se a leitura falhar no meio,
+        # runs, contadores e valores inválidos voltam ao estado anterior
+        runs_antes, linhas_antes = len(escritor.runs), escritor.total_linhas
+        contadores_antes = {chave: relatorio[chave] for chave in CONTADORES_RELATORIO}
+        invalidos_antes = relatorio['valores_invalidos'].ponto_de_restauracao()
+        pares_arquivo = {}
+        try:
+            for df in _blocos_do_arquivo(arquivo_info, tamanho_chunk, cache):
+                if df is None or df.empty:
+                    continue
+                bloco = _consolidar_bloco(df, relatorio)
+                escritor.adicionar(bloco)
+                pares_arquivo.update(dict.fromkeys(zip(bloco['CNPJ'], bloco['RazaoSocial'])))
+                linhas_entrada += len(df)
+                linhas_saida += len(bloco)
+        except LeituraInterrompida:
+            escritor.descartar_desde(runs_antes, linhas_antes)
+            relatorio.update(contadores_antes)
+            relatorio['valores_invalidos'].restaurar(invalidos_antes)
+            linhas_entrada = linhas_saida = 0
+            print(f"  ✗ {_rotulo(arquivo_info)} descartado: leitura interrompida")
+        else:
+            pares.update(pares_arquivo)
+        metricas_pipeline.registrar_arquivo(
+            _rotulo(arquivo_info), time.perf_counter() - inicio, linhas_entrada=linhas_entrada,
+            linhas_saida=linhas_saida, bytes_lidos=_tamanho_seguro(arquivo_info))
+    
+    if cache is not None:
+        cache.salvar()
+        print(f"\n✓ Cache de dialetos: {cache.acertos} acertos, {cache.falhas} falhas")
+    
+    if pares:
+        relatorio['cnpj_duplicados_suspeitos'] = _cnpjs_suspeitos(
+            pd.DataFrame(list(pares), columns=['CNPJ', 'RazaoSocial']))
+    _finalizar_relatorio(relatorio)
+    _imprimir_relatorio_inconsistencias(relatorio)
+    
+    csv_path = escritor.finalizar(OUTPUT_DIR / "consolidado_despesas.csv")
+    metricas_pipeline.anotar(
+        linhas_entrada=relatorio['linhas_processadas'], linhas_saida=escritor.total_linhas,
+        bytes_lidos=sum(filter(None, map(_tamanho_seguro, arquivos_info))))
+    return _finalizar_saida(csv_path, escritor.total_linhas, COLUNAS_CONSOLIDADO, relatorio)
+
+
+# ============================================================================
+# EXECUÇÃO INCREMENTAL (MANIFESTO DE ARQUIVOS JÁ PROCESSADOS)
+# ============================================================================
+
+class ManifestoIncremental:
+    """
+    Manifesto dos arquivos de origem já processados: caminho, tamanho, mtime
+    e hash do conteúdo, mais o diretório com o resultado parcial de cada um
+    (runs ordenados + contadores do relatório). Também guarda qual conjunto
+    de arquivos gerou a saída atual, para pular execuções sem mudanças.
+    """
+    
+    def __init__(self, diretorio=None):
+        self.diretorio = Path(diretorio or INCREMENTAL_DIR)
+        self.caminho = self.diretorio / "manifesto.json"
+        self.dados = {'arquivos': {}, 'saida': None}
+        if self.caminho.exists():
+            try:
+                with open(self.caminho, 'r', encoding='utf-8') as f:
+                    self.dados = json.load(f)
+            except (OSError, ValueError):
+                pass
+    
+    @staticmethod
+    def chave(arquivo_info):
+        chave = str(arquivo_info['caminho'].resolve())
+        if arquivo_info.get('membro'):
+            chave += '!' + arquivo_info['membro']
+        return chave
+    
+    def diretorio_parcial(self, arquivo_info):
+        return self._diretorio_parcial(self.chave(arquivo_info))
+    
+    def _diretorio_parcial(self, chave):
+        nome = hashlib.sha1(chave.encode('utf-8')).hexdigest()[:16]
+        return self.diretorio / "parciais" / nome
+    
+    def inalterado(self, arquivo_info):
+        """
+        Tamanho e mtime iguais bastam; se só o mtime mudou, o hash do
+        conteúdo decide (ex.: arquivo copiado de novo sem alterações).
+        """
+        entrada = self.dados['arquivos'].get(self.chave(arquivo_info))
+        if entrada is None or not (self.diretorio_parcial(arquivo_info) / "parcial.json").exists():
+            return False
+        tamanho = _tamanho_origem(arquivo_info)
+        mtime_ns = arquivo_info['caminho'].stat().st_mtime_ns
+        if tamanho != entrada['tamanho']:
+            return False
+        if mtime_ns == entrada['mtime_ns']:
+            return True
+        if _hash_conteudo(arquivo_info) == entrada['sha256']:
+            entrada['mtime_ns'] = mtime_ns
+            return True
+        return False
+    
+    def registrar(self, arquivo_info):
+        self.dados['arquivos'][self.chave(arquivo_info)] = {
+            'tamanho': _tamanho_origem(arquivo_info),
+            'mtime_ns': arquivo_info['caminho'].stat().st_mtime_ns,
+            'sha256': _hash_conteudo(arquivo_info),
+        }
+    
+    def podar(self, arquivos_info):
+        """Remove entradas e parciais de arquivos que saíram da seleção."""
+        atuais = {self.chave(info) for info in arquivos_info}
+        for chave in list(self.dados['arquivos']):
+            if chave not in atuais:
+                del self.dados['arquivos'][chave]
+                shutil.rmtree(self._diretorio_parcial(chave), ignore_errors=True)
+    
+    def _assinatura_saida(self, arquivos_info, csv_path):
+        return {
+            'arquivos': [[self.chave(info), self.dados['arquivos'][self.chave(info)]['sha256']]
+                         for info in arquivos_info],
+            'csv_tamanho': csv_path.stat().st_size,
+            'csv_mtime_ns': csv_path.stat().st_mtime_ns,
+        }
+    
+    def saida_atualizada(self, arquivos_info, csv_path, zip_path):
+        if not self.dados.get('saida') or not csv_path.exists() or not zip_path.exists():
+            return False
+        if any(self.chave(info) not in self.dados['arquivos'] for info in arquivos_info):
+            return False
+        return self._assinatura_saida(arquivos_info, csv_path) == self.dados['saida']
+    
+    def registrar_saida(self, arquivos_info, csv_path):
+        self.dados['saida'] = self._assinatura_saida(arquivos_info, csv_path)
+    
+    def salvar(self):
+        self.diretorio.mkdir(parents=True, exist_ok=True)
+        temporario = self.caminho.with_suffix('.tmp')
+        with open(temporario, 'w', encoding='utf-8') as f:
+            json.dump(self.dados, f, ensure_ascii=False)
+        os.replace(temporario, self.caminho)
+
+
+def _hash_conteudo(arquivo_info):
+    """sha256 do arquivo; para membros de ZIP, o CRC-32 já gravado no ZIP."""
+    if arquivo_info.get('membro'):
+        return f"crc32:{_info_membro(arquivo_info).CRC:08x}"
+    sha = hashlib.sha256()
+    with open(arquivo_info['caminho'], 'rb') as f:
+        for pedaco in iter(lambda: f.read(1024 * 1024), b''):
+            sha.update(pedaco)
+    return sha.hexdigest()
+
+
+VERSAO_PARCIAL = 2
+
+
+def _parcial_atual(diretorio):
+    """parcial.json existe e está no formato desta versão."""
+    try:
+        with open(diretorio / "parcial.json", 'r', encoding='utf-8') as f:
+            return json.load(f).get('versao') == VERSAO_PARCIAL
+    except (OSError, ValueError):
+        return False
+
+
+def _processar_parcial(arquivo_info, diretorio, tamanho_chunk=None, cache=None):
+    """
+    Consolida um único arquivo em `diretorio`: runs ordenados do resultado
+    e parcial.json com os contadores do relatório, a amostra de valores
+    inválidos e os pares (CNPJ, RazaoSocial) usados na detecção de
+    duplicados; a lista completa de valores inválidos fica em CSV ao lado.
+    Retorna (completo, linhas_entrada, linhas_saida); com a leitura
+    interrompida o parcial fica vazio e as contagens são zero.
+    """
+    shutil.rmtree(diretorio, ignore_errors=True)
+    escritor = EscritorConsolidadoOrdenado(diretorio, temporario=False)
+    # Semente por arquivo: chaves da amostra independentes entre parciais
+    semente = SEMENTE_AMOSTRA + zlib.crc32(ManifestoIncremental.chave(arquivo_info).encode())
+    relatorio = _novo_relatorio_inconsistencias(diretorio / ARQUIVO_VALORES_INVALIDOS, semente)
+    invalidos_antes = relatorio['valores_invalidos'].ponto_de_restauracao()
+    pares = {}
+    completo = True
+    linhas_entrada = linhas_saida = 0
+    
+    try:
+        for df in _blocos_do_arquivo(arquivo_info, tamanho_chunk, cache):
+            if df is None or df.empty:
+                continue
+            bloco = _consolidar_bloco(df, relatorio)
+            escritor.adicionar(bloco)
+            pares.update(dict.fromkeys(zip(bloco['CNPJ'], bloco['RazaoSocial'])))
+            linhas_entrada += len(df)
+            linhas_saida += len(bloco)
+    except LeituraInterrompida:
+        # Parcial vazio: o arquivo fica fora da saída, como no modo completo
+        escritor.descartar_desde(0, 0)
+        relatorio.update(dict.fromkeys(CONTADORES_RELATORIO, 0))
+        relatorio['valores_invalidos'].restaurar(invalidos_antes)
+        pares = {}
+        completo = False
+        linhas_entrada = linhas_saida = 0
+    
+    valores_invalidos = relatorio['valores_invalidos']
+    valores_invalidos.finalizar()
+    relatorio['valores_invalidos'] = valores_invalidos.estado()
+    
+    parcial = {
+        'versao': VERSAO_PARCIAL,
+        'relatorio': relatorio,
+        'pares': [list(par) for par in pares],
+        'runs': [run.name for run in escritor.runs],
+        'total_linhas': escritor.total_linhas,
+    }
+    with open(diretorio / "parcial.json", 'w', encoding='utf-8') as f:
+        json.dump(parcial, f, ensure_ascii=False)
+    return completo, linhas_entrada, linhas_saida
+
+
+def processar_incremental(arquivos_info, tamanho_chunk=None):
+    """
+    PASSOS 3 a 5 reaproveitando resultados parciais: só arquivos novos ou
+    alterados são lidos e consolidados; os demais vêm do manifesto. A saída
+    é a mesma de uma execução completa, e uma reexecução sem mudanças
+    termina sem reescrever o CSV nem o ZIP.
+    """
+    print("\n" + "="*80)
+    print("PASSOS 3-5: PROCESSAMENTO INCREMENTAL")
+    print("="*80)
+    
+    manifesto = ManifestoIncremental()
+    csv_path = OUTPUT_DIR / "consolidado_despesas.csv"
+    zip_path = OUTPUT_DIR / "consolidado_despesas.zip"
+    
+    alterados = [info for info in arquivos_info
+                 if not manifesto.inalterado(info)
+                 or not _parcial_atual(manifesto.diretorio_parcial(info))]
+    print(f"\n✓ Arquivos sem alteração: {len(arquivos_info) - len(alterados)}")
+    print(f"✓ Arquivos novos ou alterados: {len(alterados)}")
+    
+    if not alterados and manifesto.saida_atualizada(arquivos_info, csv_path, zip_path):
+        manifesto.salvar()
+        print("\n✓ Nenhuma alteração desde a última execução; saída mantida:")
+        print(f"  {zip_path}")
+        return zip_path
+    
+    cache = CacheDialetos.carregar() if USAR_CACHE_DIALETOS else None
+    for arquivo_info in alterados:
+        inicio = time.perf_counter()
+        completo, linhas_entrada, linhas_saida = _processar_parcial(
+            arquivo_info, manifesto.diretorio_parcial(arquivo_info), tamanho_chunk, cache)
+        metricas_pipeline.registrar_arquivo(
+            _rotulo(arquivo_info), time.perf_counter() - inicio, linhas_entrada=linhas_entrada,
+            linhas_saida=linhas_saida, bytes_lidos=_tamanho_seguro(arquivo_info))
+        # Arquivo com leitura interrompida: fora do manifesto, é relido na próxima execução
+        if completo:
+            manifesto.registrar(arquivo_info)
+    if cache is not None:
+        cache.salvar()
+        print(f"\n✓ Cache de dialetos: {cache.acertos} acertos, {cache.falhas} falhas")
+    manifesto.podar(arquivos_info)
+    
+    # Mesclar parciais na ordem dos arquivos (mesma ordem da execução completa)
+    relatorio = _novo_relatorio_inconsistencias(OUTPUT_DIR / ARQUIVO_VALORES_INVALIDOS)
+    pares = []
+    runs = []
+    total_linhas = 0
+    for arquivo_info in arquivos_info:
+        diretorio = manifesto.diretorio_parcial(arquivo_info)
+        with open(diretorio / "parcial.json", 'r', encoding='utf-8') as f:
+            parcial = json.load(f)
+        for chave in CONTADORES_RELATORIO:
+            relatorio[chave] += parcial['relatorio'][chave]
+        relatorio['valores_invalidos'].mesclar(parcial['relatorio']['valores_invalidos'],
+                                               diretorio / ARQUIVO_VALORES_INVALIDOS)
+        pares.extend(parcial['pares'])
+        runs.extend(diretorio / run for run in parcial['runs'])
+        total_linhas += parcial['total_linhas']
+    
+    pares = pd.DataFrame(pares, columns=['CNPJ', 'RazaoSocial']).drop_duplicates()
+    relatorio['cnpj_duplicados_suspeitos'] = _cnpjs_suspeitos(pares)
+    _finalizar_relatorio(relatorio)
+    _imprimir_relatorio_inconsistencias(relatorio)
+    
+    intercalar_runs(runs, csv_path)
+    metricas_pipeline.anotar(
+        linhas_entrada=relatorio['linhas_processadas'], linhas_saida=total_linhas,
+        bytes_lidos=sum(filter(None, map(_tamanho_seguro, alterados))))
+    zip_path = _finalizar_saida(csv_path, total_linhas, COLUNAS_CONSOLIDADO, relatorio)
+    
+    manifesto.registrar_saida(arquivos_info, csv_path)
+    manifesto.salvar()
+    return zip_path
+
+
 # ============================================================================
 # EXECUÇÃO PRINCIPAL
 # ============================================================================
 
+ARQUIVO_METRICAS = "metricas_execucao.json"
+
+
 def main():
     print("=" * 80)
     print("TESTE DE INTEGRACAO COM API PUBLICA ANS")
     print("Consolidacao de Despesas com Eventos/Sinistros - Ultimos 3 Trimestres")
     print("=" * 80)
     
+    metricas_pipeline.iniciar('ans_integration')
     try:
-        # PASSO 1: Descobrir trimestres locais
-        trimestres = listar_trimestres_disponiveis()
-        
-        if not trimestres:
-            print("\nX Nenhum trimestre foi encontrado nos dados locais.")
-            return
-        
-        # PASSO 2: Localizar arquivos
-        arquivos_info = preparar_arquivos_locais(trimestres)
-        
-        if not arquivos_info:
-            print("\nX Nenhum arquivo foi localizado.")
-            return
-        
-        # PASSO 3: Processar diferentes formatos
-        dataframes = processar_arquivos(arquivos_info)
-        
-        if not dataframes:
-            print("\nX Nenhum arquivo foi processado com sucesso.")
-            return
-        
-        # PASSO 4: Consolidar e tratar inconsistências
-        df_final, relatorio = consolidar_e_tratar_inconsistencias(dataframes)
-        
-        # PASSO 5: Salvar e compactar
-        salvar_resultado_final(df_final, relatorio)
-        
-        print("\n" + "="*80)
-        print("PROCESSO FINALIZADO COM SUCESSO!")
-        print("="*80 + "\n")
+        with metricas_pipeline.perfilar(OUTPUT_DIR, 'ans_integration'):
+            _executar_passos()
         
     except Exception as e:
         print(f"\nX Erro durante execucao: {e}")
         import traceback
         traceback.print_exc()
+        metricas_pipeline.registrar_erro(e)
+    
+    finally:
+        metricas_pipeline.finalizar(OUTPUT_DIR / ARQUIVO_METRICAS)
+
+
+def _executar_passos():
+    """PASSOS 0 a 5, cada um medido como uma etapa em metricas_pipeline."""
+    # PASSO 0 (opcional): Baixar arquivos do servidor da ANS
+    if BAIXAR_TRIMESTRES:
+        with metricas_pipeline.etapa('passo_0_download'):
+            ans_download.baixar_trimestres(BASE_URL, DOWNLOAD_DIR)
+    
+    # PASSO 1: Descobrir trimestres locais
+    with metricas_pipeline.etapa('passo_1_trimestres') as etapa:
+        trimestres = listar_trimestres_disponiveis()
+        etapa['linhas_saida'] = len(trimestres)
+    
+    if not trimestres:
+        print("\nX Nenhum trimestre foi encontrado nos dados locais.")
+        return
+    
+    # PASSO 2: Localizar arquivos
+    with metricas_pipeline.etapa('passo_2_localizar_arquivos') as etapa:
+        arquivos_info = preparar_arquivos_locais(trimestres)
+        etapa['linhas_saida'] = len(arquivos_info)
+    
+    if not arquivos_info:
+        print("\nX Nenhum arquivo foi localizado.")
+        return
+    
+    # PASSOS 3-5 reaproveitando resultados de execuções anteriores
+    if MODO_INCREMENTAL:
+        with metricas_pipeline.etapa('passos_3_5_incremental'):
+            processar_incremental(arquivos_info)
+        print("\n" + "="*80)
+        print("PROCESSO FINALIZADO COM SUCESSO!")
+        print("="*80 + "\n")
+        return
+    
+    # PASSOS 3-5 bloco a bloco quando há arquivos grandes
+    if usar_streaming(arquivos_info):
+        with metricas_pipeline.etapa('passos_3_5_streaming'):
+            processar_em_streaming(arquivos_info)
+        print("\n" + "="*80)
+        print("PROCESSO FINALIZADO COM SUCESSO!")
+        print("="*80 + "\n")
+        return
+    
+    # PASSO 3: Processar diferentes formatos
+    with metricas_pipeline.etapa('passo_3_processar_arquivos'):
+        dataframes = processar_arquivos(arquivos_info)
+    
+    if not dataframes:
+        print("\nX Nenhum arquivo foi processado com sucesso.")
+        return
+    
+    # PASSO 4: Consolidar e tratar inconsistências
+    with metricas_pipeline.etapa('passo_4_consolidar') as etapa:
+        df_final, relatorio = consolidar_e_tratar_inconsistencias(
+            dataframes, destino_invalidos=OUTPUT_DIR / ARQUIVO_VALORES_INVALIDOS)
+        etapa['linhas_entrada'] = relatorio['linhas_processadas']
+        etapa['linhas_saida'] = len(df_final)
+    
+    # PASSO 5: Salvar e compactar
+    with metricas_pipeline.etapa('passo_5_salvar') as etapa:
+        salvar_resultado_final(df_final, relatorio)
+        etapa['linhas_entrada'] = len(df_final)
+    
+    print("\n" + "="*80)
+    print("PROCESSO FINALIZADO COM SUCESSO!")
+    print("="*80 + "\n")
 
 
 if __name__ == "__main__":
@@ -1,17 +1,45 @@
 """FastAPI backend for operadoras and despesas (minimal implementation).
 Run with: uvicorn backend.main:app --reload
 Configure DB via env vars: DB_HOST, DB_PORT, DB_NAME, DB_USER, DB_PASS
+Connection pool: DB_POOL_MIN, DB_POOL_MAX, DB_POOL_TIMEOUT, DB_POOL_MAX_LIFETIME,
+DB_POOL_HEALTH_CHECK (see backend/pool.py)
+Driver: DB_DRIVER=asyncpg|psycopg2 (see backend/repository.py)
 """
-from fastapi import FastAPI, HTTPException, Query
+import asyncio
+import base64
+import json
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, HTTPException, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse
 from pydantic import BaseModel
+import logging
 import os
-import psycopg2
-from psycopg2.extras import RealDictCursor
+import threading
 from typing import List, Optional
 import time
 
-app = FastAPI(title="Operadoras API")
+from backend.pool import PoolTimeout
+from backend import repository
+
+logger = logging.getLogger(__name__)
+
+
+@asynccontextmanager
+async def lifespan(app):
+    # Open the pool with the app and close its connections on shutdown
+    repo = get_repository()
+    try:
+        await repo.open()
+    except Exception as e:
+        # Database not reachable yet: connections are created on demand
+        logger.warning("could not pre-open database connections: %s", e)
+    yield
+    await repo.close()
+    close_repository()
+
+
+app = FastAPI(title="Operadoras API", lifespan=lifespan)
 
 # Allow CORS for frontend development
 app.add_middleware(
@@ -30,8 +58,43 @@ DB_PARAMS = dict(
     password=os.getenv('DB_PASS', ''),
 )
 
-def get_conn():
-    return psycopg2.connect(cursor_factory=RealDictCursor, **DB_PARAMS)
+POOL_SETTINGS = dict(
+    min_size=int(os.getenv('DB_POOL_MIN', 1)),
+    max_size=int(os.getenv('DB_POOL_MAX', 10)),
+    acquire_timeout=float(os.getenv('DB_POOL_TIMEOUT', 5)),
+    max_lifetime=float(os.getenv('DB_POOL_MAX_LIFETIME', 1800)),
+    health_check_after=float(os.getenv('DB_POOL_HEALTH_CHECK', 30)),
+)
+
+# Non-blocking asyncpg when installed; psycopg2 in worker threads otherwise
+DB_DRIVER = os.getenv('DB_DRIVER', 'asyncpg' if repository.asyncpg is not None else 'psycopg2')
+
+_repository = None
+_repository_lock = threading.Lock()
+
+
+def get_repository() -> repository.Repository:
+    global _repository
+    with _repository_lock:
+        if _repository is None:
+            if DB_DRIVER == 'asyncpg':
+                _repository = repository.AsyncpgRepository(DB_PARAMS, **POOL_SETTINGS)
+            elif DB_DRIVER == 'psycopg2':
+                _repository = repository.Psycopg2Repository(DB_PARAMS, **POOL_SETTINGS)
+            else:
+                raise ValueError(f"Unknown DB_DRIVER: {DB_DRIVER}")
+        return _repository
+
+
+def close_repository():
+    global _repository
+    with _repository_lock:
+        _repository = None
+
+
+@app.exception_handler(PoolTimeout)
+def pool_timeout_handler(request: Request, exc: PoolTimeout):
+    return JSONResponse(status_code=503, content={"detail": str(exc)}, headers={"Retry-After": "1"})
 
 
 class PaginatedResponse(BaseModel):
@@ -39,65 +102,109 @@ class PaginatedResponse(BaseModel):
     total: int
     page: int
     limit: int
+    next_cursor: Optional[str] = None
+    prev_cursor: Optional[str] = None
+    total_source: str = 'exact'  # 'exact', 'cached' or 'estimate'
+
+
+def encode_cursor(page: int, row: Optional[dict], direction: str) -> str:
+    """
+    Opaque cursor: page number plus the (razao_social, cnpj) key of the row
+    to continue from; without a row (search results) the page number alone.
+    """
+    key = [row['razao_social'], row['cnpj']] if row is not None else [None, None]
+    payload = json.dumps([page, *key, direction], ensure_ascii=False)
+    return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor: str):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        payload = json.loads(raw.decode('utf-8'))
+        if not (isinstance(payload, list) and len(payload) == 4):
+            raise ValueError(cursor)
+        page, razao_social, cnpj, direction = payload
+        keyed = isinstance(razao_social, str) and isinstance(cnpj, str)
+        if not (type(page) is int and page >= 1 and direction in ('next', 'prev')
+                and (keyed or razao_social is cnpj is None)):
+            raise ValueError(cursor)
+    except (TypeError, ValueError):
+        raise HTTPException(status_code=400, detail='Invalid cursor')
+    return page, (razao_social, cnpj) if keyed else None, direction
 
 
 @app.get('/api/operadoras', response_model=PaginatedResponse)
-def list_operadoras(page: int = Query(1, ge=1), limit: int = Query(20, ge=1, le=100), q: Optional[str] = None):
-    offset = (page - 1) * limit
-    with get_conn() as conn:
-        cur = conn.cursor()
-        if q:
-            q_like = f"%{q}%"
-            cur.execute("SELECT count(*) FROM operadoras WHERE cnpj ILIKE %s OR razao_social ILIKE %s", (q_like, q_like))
-            total = cur.fetchone()['count']
-            cur.execute("SELECT cnpj, razao_social, nome_fantasia, uf FROM operadoras WHERE cnpj ILIKE %s OR razao_social ILIKE %s ORDER BY razao_social LIMIT %s OFFSET %s", (q_like, q_like, limit, offset))
+async def list_operadoras(page: int = Query(1, ge=1), limit: int = Query(20, ge=1, le=100), q: Optional[str] = None,
+                          cursor: Optional[str] = None, exact_count: bool = False):
+    """
+    Operadoras in (razao_social, cnpj) order, or in relevance order when
+    searching with `q` (accent-insensitive, on razão social and CNPJ). With
+    `cursor` (next_cursor or prev_cursor of the previous response) the page
+    is read by key instead of OFFSET; search results and `page` alone are
+    paged by offset. `total` is an estimated or cached count unless
+    exact_count=true (see total_source).
+    """
+    repo = get_repository()
+    q = q.strip() if q else None
+    after = before = None
+    offset = 0
+    if cursor:
+        page, key, direction = decode_cursor(cursor)
+        if key is not None and not q:
+            after, before = (key, None) if direction == 'next' else (None, key)
         else:
-            cur.execute("SELECT count(*) FROM operadoras")
-            total = cur.fetchone()['count']
-            cur.execute("SELECT cnpj, razao_social, nome_fantasia, uf FROM operadoras ORDER BY razao_social LIMIT %s OFFSET %s", (limit, offset))
-        rows = cur.fetchall()
-    return {"data": rows, "total": int(total), "page": page, "limit": limit}
-
-
-@app.get('/api/operadoras/{cnpj}')
-def get_operadora(cnpj: str):
-    with get_conn() as conn:
-        cur = conn.cursor()
-        cur.execute("SELECT * FROM operadoras WHERE regexp_replace(cnpj,'[^0-9]','','g') = regexp_replace(%s,'[^0-9]','','g')", (cnpj,))
-        row = cur.fetchone()
+            offset = (page - 1) * limit
+    else:
+        offset = (page - 1) * limit
+    (rows, has_more), (total, total_source) = await asyncio.gather(
+        repo.page_operadoras(limit, q, after=after, before=before, offset=offset),
+        repo.count_operadoras(q, exact=exact_count))
+
+    # Going back, has_more refers to earlier rows; the later ones were just seen
+    more_after = has_more if before is None else True
+    more_before = has_more if before is not None else page > 1
+    return {
+        "data": rows, "total": total, "page": page, "limit": limit,
+        "next_cursor": encode_cursor(page + 1, None if q else rows[-1], 'next') if rows and more_after else None,
+        "prev_cursor": (encode_cursor(max(page - 1, 1), None if q else rows[0], 'prev')
+                        if rows and more_before else None),
+        "total_source": total_source,
+    }
+
+
+# A formatted CNPJ has a slash (12.345.678/0001-90), so both routes take the
+# rest of the path; /despesas is declared first so it is not read as a CNPJ
+@app.get('/api/operadoras/{cnpj:path}/despesas')
+async def operadora_despesas(cnpj: str):
+    if not repository.normalize_cnpj(cnpj):
+        return []
+    return await get_repository().despesas(cnpj)
+
+
+@app.get('/api/operadoras/{cnpj:path}')
+async def get_operadora(cnpj: str):
+    # Formatted or not, the CNPJ is looked up by its digits (see repository.normalize_cnpj)
+    if not repository.normalize_cnpj(cnpj):
+        raise HTTPException(status_code=404, detail='Operadora not found')
+    row = await get_repository().get_operadora(cnpj)
     if not row:
         raise HTTPException(status_code=404, detail='Operadora not found')
     return row
 
 
-@app.get('/api/operadoras/{cnpj}/despesas')
-def operadora_despesas(cnpj: str):
-    with get_conn() as conn:
-        cur = conn.cursor()
-        cur.execute(
-            "SELECT trimestre_date, despesa_total FROM consolidado_despesas WHERE regexp_replace(cnpj,'[^0-9]','','g') = regexp_replace(%s,'[^0-9]','','g') ORDER BY trimestre_date",
-            (cnpj,)
-        )
-        rows = cur.fetchall()
-    return rows
-
-
 # Simple in-memory cache for /api/estatisticas with TTL
 _cache = {"value": None, "ts": 0}
 CACHE_TTL = int(os.getenv('STATS_CACHE_SECONDS', '300'))
 
 
 @app.get('/api/estatisticas')
-def estatisticas(force: bool = False):
+async def estatisticas(force: bool = False):
     now = time.time()
     if not force and _cache['value'] and now - _cache['ts'] < CACHE_TTL:
         return _cache['value']
-    with get_conn() as conn:
-        cur = conn.cursor()
-        cur.execute("SELECT SUM(despesa_total) as total, AVG(despesa_total) as media FROM consolidado_despesas")
-        totals = cur.fetchone()
-        cur.execute("SELECT cnpj, SUM(despesa_total) as total FROM consolidado_despesas GROUP BY cnpj ORDER BY total DESC LIMIT 5")
-        top5 = cur.fetchall()
+    # The two queries are independent: run them at the same time
+    repo = get_repository()
+    totals, top5 = await asyncio.gather(repo.totals(), repo.top5())
     payload = {"total_despesas": totals['total'], "media": float(totals['media']) if totals['media'] is not None else None, "top5": top5}
     _cache['value'] = payload
     _cache['ts'] = now
@@ -105,14 +212,14 @@ def estatisticas(force: bool = False):
 
 
 @app.get('/api/estatisticas/uf')
-def estatisticas_uf():
+async def estatisticas_uf():
     """Return total despesas by UF and mean per operadora in each UF."""
-    with get_conn() as conn:
-        cur = conn.cursor()
-        cur.execute("SELECT uf, SUM(despesa_total) as total_despesas FROM consolidado_despesas GROUP BY uf ORDER BY total_despesas DESC")
-        totals_by_uf = cur.fetchall()
-        cur.execute(
-            "SELECT uf, AVG(sum_per_operadora) as media_por_operadora FROM (SELECT uf, cnpj, SUM(despesa_total) as sum_per_operadora FROM consolidado_despesas GROUP BY uf, cnpj) s GROUP BY uf ORDER BY media_por_operadora DESC"
-        )
-        media_por_operadora = cur.fetchall()
+    repo = get_repository()
+    totals_by_uf, media_por_operadora = await asyncio.gather(repo.totals_by_uf(), repo.media_por_operadora_uf())
     return {"totals_by_uf": totals_by_uf, "media_por_operadora": media_por_operadora}
+
+
+@app.get('/api/pool')
+async def pool_stats():
+    """Connection pool statistics (in use, idle, waits and wait times) for monitoring."""
+    return await get_repository().pool_stats()
@@ -0,0 +1,221 @@
+"""Thread-safe connection pool for the psycopg2 driver.
+
+The API handlers are async and never touch the pool: Psycopg2Repository
+(backend/repository.py) runs each blocking query in an anyio worker thread,
+so connections are shared between those threads. A query borrows one with
+`pool.connection()` and gives it back when the block ends. The pool keeps
+between `min_size` and `max_size` connections, makes callers wait up to
+`acquire_timeout` seconds when all of them are in use, pings connections
+that sat idle for a while before handing them out and replaces connections
+older than `max_lifetime`.
+"""
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Optional
+
+
+class PoolTimeout(Exception):
+    """No connection became available within the acquire timeout."""
+
+
+class _Entry:
+    __slots__ = ('conn', 'created', 'last_used')
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.created = time.monotonic()
+        self.last_used = self.created
+
+
+class ConnectionPool:
+    def __init__(self, connect: Callable, min_size: int = 1, max_size: int = 10,
+                 acquire_timeout: float = 5.0, max_lifetime: float = 1800.0,
+                 health_check_after: float = 30.0):
+        if not 0 <= min_size <= max_size or max_size < 1:
+            raise ValueError(f"invalid pool size: min={min_size} max={max_size}")
+        self._connect = connect
+        self.min_size = min_size
+        self.max_size = max_size
+        self.acquire_timeout = acquire_timeout
+        self.max_lifetime = max_lifetime
+        self.health_check_after = health_check_after
+
+        self._cond = threading.Condition()
+        self._idle = []        # most recently used last
+        self._in_use = {}      # id(conn) -> _Entry
+        self._opening = 0      # connections being created outside the lock
+        self._closed = False
+        self._counters = dict(created=0, closed_connections=0, recycled=0, health_check_failures=0,
+                              acquired=0, waits=0, timeouts=0, wait_seconds=0.0, max_wait_seconds=0.0)
+
+    # ------------------------------------------------------------------
+    # Lifecycle
+    # ------------------------------------------------------------------
+
+    def open(self):
+        """Create the first `min_size` connections (errors are raised)."""
+        with self._cond:
+            self._closed = False
+        entries = [self._new_entry() for _ in range(self.min_size - self._size())]
+        with self._cond:
+            self._idle.extend(entries)
+            self._cond.notify_all()
+
+    def close(self):
+        """Close idle connections now and the borrowed ones as they come back."""
+        with self._cond:
+            self._closed = True
+            idle, self._idle = self._idle, []
+            self._cond.notify_all()
+        for entry in idle:
+            self._close_entry(entry)
+
+    # ------------------------------------------------------------------
+    # Borrowing
+    # ------------------------------------------------------------------
+
+    @contextmanager
+    def connection(self, timeout: Optional[float] = None):
+        """Borrow a connection; commit on success, rollback on error, then return it."""
+        conn = self.acquire(timeout)
+        try:
+            yield conn
+        except BaseException:
+            self._finish(conn, 'rollback')
+            raise
+        else:
+            self._finish(conn, 'commit')
+
+    def acquire(self, timeout: Optional[float] = None):
+        timeout = self.acquire_timeout if timeout is None else timeout
+        start = time.monotonic()
+        deadline = start + timeout
+        waited = False
+        while True:
+            with self._cond:
+                while True:
+                    if self._closed:
+                        raise PoolTimeout("connection pool is closed")
+                    if self._idle:
+                        entry = self._idle.pop()
+                        break
+                    if self._size() < self.max_size:
+                        entry = None
+                        self._opening += 1
+                        break
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._counters['timeouts'] += 1
+                        raise PoolTimeout(f"no database connection available after {timeout:.1f}s "
+                                          f"({self.max_size} in use)")
+                    waited = True
+                    self._cond.wait(remaining)
+
+            if entry is None:
+                try:
+                    entry = self._new_entry()
+                finally:
+                    with self._cond:
+                        self._opening -= 1
+            elif not self._usable(entry):
+                self._close_entry(entry)
+                continue
+
+            with self._cond:
+                self._in_use[id(entry.conn)] = entry
+                wait = time.monotonic() - start
+                self._counters['acquired'] += 1
+                if waited:
+                    self._counters['waits'] += 1
+                    self._counters['wait_seconds'] += wait
+                    self._counters['max_wait_seconds'] = max(self._counters['max_wait_seconds'], wait)
+            return entry.conn
+
+    def release(self, conn, discard: bool = False):
+        with self._cond:
+            entry = self._in_use.pop(id(conn), None)
+        if entry is None:
+            raise ValueError("connection does not belong to this pool")
+        now = time.monotonic()
+        expired = now - entry.created > self.max_lifetime
+        if discard or expired or self._closed or getattr(conn, 'closed', 0):
+            if expired and not discard:
+                with self._cond:
+                    self._counters['recycled'] += 1
+            self._close_entry(entry)
+            with self._cond:
+                self._cond.notify()
+            return
+        entry.last_used = now
+        with self._cond:
+            self._idle.append(entry)
+            self._cond.notify()
+
+    def stats(self) -> dict:
+        with self._cond:
+            stats = dict(self._counters)
+            stats.update(
+                min_size=self.min_size,
+                max_size=self.max_size,
+                in_use=len(self._in_use),
+                idle=len(self._idle),
+                size=self._size(),
+                closed=self._closed,
+            )
+        stats['avg_wait_seconds'] = stats['wait_seconds'] / stats['waits'] if stats['waits'] else 0.0
+        return stats
+
+    # ------------------------------------------------------------------
+    # Internals
+    # ------------------------------------------------------------------
+
+    def _size(self):
+        return len(self._idle) + len(self._in_use) + self._opening
+
+    def _new_entry(self):
+        entry = _Entry(self._connect())
+        with self._cond:
+            self._counters['created'] += 1
+        return entry
+
+    def _close_entry(self, entry):
+        try:
+            entry.conn.close()
+        except Exception:
+            pass
+        with self._cond:
+            self._counters['closed_connections'] += 1
+
+    def _usable(self, entry) -> bool:
+        """Lifetime check, then a ping for connections idle longer than health_check_after."""
+        now = time.monotonic()
+        if getattr(entry.conn, 'closed', 0):
+            return False
+        if now - entry.created > self.max_lifetime:
+            with self._cond:
+                self._counters['recycled'] += 1
+            return False
+        if now - entry.last_used < self.health_check_after:
+            return True
+        try:
+            cur = entry.conn.cursor()
+            cur.execute("SELECT 1")
+            cur.fetchone()
+            entry.conn.rollback()
+            return True
+        except Exception:
+            with self._cond:
+                self._counters['health_check_failures'] += 1
+            return False
+
+    def _finish(self, conn, action):
+        try:
+            getattr(conn, action)()
+        except Exception:
+            # Broken connection (server restart, network): drop it from the pool
+            self.release(conn, discard=True)
+            if action == 'commit':
+                raise
+            return
+        self.release(conn)
@@ -0,0 +1,338 @@
+"""Data access for the API handlers.
+
+The handlers are async and only talk to a `Repository`; two drivers
+implement it (env var DB_DRIVER):
+- 'asyncpg':  non-blocking queries on an asyncpg pool, so one worker keeps
+              many queries in flight (default when asyncpg is installed);
+- 'psycopg2': the blocking driver, each query run in a worker thread on a
+              connection borrowed from a backend/pool.py ConnectionPool.
+Both run the same SQL; asyncpg gets the %s placeholders renumbered to $n.
+"""
+import abc
+import asyncio
+import os
+import re
+import threading
+import time
+from typing import List, Optional, Tuple
+
+import anyio
+import psycopg2
+from psycopg2.extras import RealDictCursor
+
+from backend.pool import ConnectionPool, PoolTimeout
+
+try:
+    import asyncpg
+except ImportError:  # asyncpg missing from the install: the psycopg2 driver is used instead
+    asyncpg = None
+
+
+OPERADORA_COLUMNS = "cnpj, razao_social, nome_fantasia, uf"
+
+# Counts of operadoras (per search term) are reused for this long unless an
+# exact count is asked for; the unfiltered total comes from the planner's
+# estimate (pg_class.reltuples) instead of a full scan
+COUNT_CACHE_SECONDS = int(os.getenv('COUNT_CACHE_SECONDS', '60'))
+COUNT_CACHE_SIZE = 256
+
+SQL = {
+    'count_operadoras': "SELECT count(*) FROM operadoras",
+    'estimate_operadoras': "SELECT reltuples::bigint AS count FROM pg_class WHERE oid = 'operadoras'::regclass",
+    # CNPJs are stored digits-only and the caller passes normalize_cnpj(...):
+    # plain equality, served by the primary key / idx_consolidado_cnpj_trimestre
+    'operadora': "SELECT * FROM operadoras WHERE cnpj = %s",
+    'despesas': "SELECT trimestre_date, despesa_total FROM consolidado_despesas WHERE cnpj = %s "
+                "ORDER BY trimestre_date",
+    'totals': "SELECT SUM(despesa_total) as total, AVG(despesa_total) as media FROM consolidado_despesas",
+    'top5': "SELECT cnpj, SUM(despesa_total) as total FROM consolidado_despesas GROUP BY cnpj "
+            "ORDER BY total DESC LIMIT 5",
+    'totals_by_uf': "SELECT uf, SUM(despesa_total) as total_despesas FROM consolidado_despesas GROUP BY uf "
+                    "ORDER BY total_despesas DESC",
+    'media_por_operadora_uf': "SELECT uf, AVG(sum_per_operadora) as media_por_operadora FROM (SELECT uf, cnpj, "
+                              "SUM(despesa_total) as sum_per_operadora FROM consolidado_despesas GROUP BY uf, cnpj) s "
+                              "GROUP BY uf ORDER BY media_por_operadora DESC",
+}
+
+
+def _page_query(keyset: Optional[str]) -> str:
+    """
+    One page of operadoras in (razao_social, cnpj) order: from an OFFSET, or
+    by key after/before the (razao_social, cnpj) of a row already seen, which
+    the idx_operadoras_razao_cnpj index serves without skipping rows.
+    """
+    sql = f"SELECT {OPERADORA_COLUMNS} FROM operadoras"
+    if keyset:
+        sql += f" WHERE (razao_social, cnpj) {'>' if keyset == 'after' else '<'} (%s, %s)"
+    order = "razao_social DESC, cnpj DESC" if keyset == 'before' else "razao_social, cnpj"
+    return sql + f" ORDER BY {order} LIMIT %s OFFSET %s"
+
+
+for _keyset in (None, 'after', 'before'):
+    SQL['page_operadoras' + (f'_{_keyset}' if _keyset else '')] = _page_query(_keyset)
+
+# Search: accent- and case-insensitive substring or word-similarity match on
+# razão social (pg_trgm) and substring match on the CNPJ digits, both served
+# by the trigram GIN indexes of sql/teste3_sql_scripts.sql. Results come in
+# relevance order: CNPJ hits, then by word similarity to the search term.
+_NAME = "lower(f_unaccent(razao_social))"
+_TERM = "lower(f_unaccent(%s))"
+_SEARCH = f"({_NAME} LIKE '%%' || {_TERM} || '%%' OR {_TERM} <%% {_NAME} OR cnpj LIKE %s)"
+SQL['count_search'] = f"SELECT count(*) FROM operadoras WHERE {_SEARCH}"
+SQL['page_search'] = (f"SELECT {OPERADORA_COLUMNS} FROM operadoras WHERE {_SEARCH} "
+                      f"ORDER BY (cnpj LIKE %s) IS TRUE DESC, word_similarity({_TERM}, {_NAME}) DESC, "
+                      "razao_social, cnpj LIMIT %s OFFSET %s")
+
+
+def search_params(q: str) -> Tuple[str, str, Optional[str]]:
+    """
+    Parameters of _SEARCH for the term `q`: the term with LIKE wildcards
+    escaped, the term itself and a LIKE pattern for its digits (None when
+    it has no digits, which matches no CNPJ).
+    """
+    escaped = re.sub(r'([\\%_])', r'\\\1', q)
+    digits = re.sub(r'\D', '', q)
+    return escaped, q, f"%{digits}%" if digits else None
+
+
+def normalize_cnpj(cnpj: str) -> str:
+    """Canonical CNPJ as stored in the database: digits only."""
+    return re.sub(r'\D', '', cnpj or '')
+
+
+def numbered(sql: str) -> str:
+    """psycopg2 placeholders (%s) as asyncpg ones ($1, $2, ...), with %% back to %."""
+    counter = iter(range(1, sql.count('%s') + 1))
+    return re.sub(r'%[s%]', lambda m: '%' if m.group() == '%%' else f"${next(counter)}", sql)
+
+
+class Repository(abc.ABC):
+    """
+    Queries used by the API; every method is a coroutine. Drivers implement
+    pool_stats, fetch and fetch_one (rows as dicts, by name in SQL).
+    """
+
+    def __init__(self):
+        self._counts = {}  # search term -> (count, monotonic time)
+
+    async def open(self):
+        pass
+
+    async def close(self):
+        pass
+
+    @abc.abstractmethod
+    async def pool_stats(self) -> dict:
+        ...
+
+    @abc.abstractmethod
+    async def fetch(self, name: str, *params) -> List[dict]:
+        ...
+
+    @abc.abstractmethod
+    async def fetch_one(self, name: str, *params) -> Optional[dict]:
+        ...
+
+    async def page_operadoras(self, limit: int, q: Optional[str] = None, after: Optional[tuple] = None,
+                              before: Optional[tuple] = None, offset: int = 0) -> Tuple[List[dict], bool]:
+        """
+        Up to `limit` operadoras in (razao_social, cnpj) order, after or
+        before a (razao_social, cnpj) key, or from `offset`; search results
+        (`q`) come in relevance order and are paged by offset only. Returns
+        (rows, has_more); has_more tells if rows exist past the page in the
+        direction read (earlier rows when paging `before`).
+        """
+        if q:
+            if after is not None or before is not None:
+                raise ValueError("search results are paged by offset")
+            escaped, term, cnpj_pattern = search_params(q)
+            rows = await self.fetch('page_search', escaped, term, cnpj_pattern, cnpj_pattern, term,
+                                    limit + 1, offset)
+            return rows[:limit], len(rows) > limit
+
+        keyset = 'after' if after is not None else 'before' if before is not None else None
+        name = 'page_operadoras' + (f'_{keyset}' if keyset else '')
+        params = tuple(after if after is not None else before or ())
+        rows = await self.fetch(name, *params, limit + 1, offset if keyset is None else 0)
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        if keyset == 'before':
+            rows = rows[::-1]
+        return rows, has_more
+
+    async def count_operadoras(self, q: Optional[str] = None, exact: bool = False) -> Tuple[int, str]:
+        """
+        (total, source) with source 'exact', 'cached' (an exact count from the
+        last COUNT_CACHE_SECONDS) or 'estimate' (planner statistics, no search).
+        """
+        key = q or ''
+        now = time.monotonic()
+        if not exact:
+            cached = self._counts.get(key)
+            if cached is not None and now - cached[1] < COUNT_CACHE_SECONDS:
+                return cached[0], 'cached'
+            if not q:
+                estimate = await self.fetch_one('estimate_operadoras')
+                # reltuples is -1 (or 0 on old servers) before the first ANALYZE
+                if estimate is not None and estimate['count'] is not None and estimate['count'] > 0:
+                    return int(estimate['count']), 'estimate'
+
+        if q:
+            row = await self.fetch_one('count_search', *search_params(q))
+        else:
+            row = await self.fetch_one('count_operadoras')
+        total = int(row['count'])
+        self._counts.pop(key, None)
+        self._counts[key] = (total, now)
+        if len(self._counts) > COUNT_CACHE_SIZE:
+            del self._counts[next(iter(self._counts))]
+        return total, 'exact'
+
+    async def get_operadora(self, cnpj: str) -> Optional[dict]:
+        return await self.fetch_one('operadora', normalize_cnpj(cnpj))
+
+    async def despesas(self, cnpj: str) -> List[dict]:
+        return await self.fetch('despesas', normalize_cnpj(cnpj))
+
+    async def totals(self) -> dict:
+        return await self.fetch_one('totals')
+
+    async def top5(self) -> List[dict]:
+        return await self.fetch('top5')
+
+    async def totals_by_uf(self) -> List[dict]:
+        return await self.fetch('totals_by_uf')
+
+    async def media_por_operadora_uf(self) -> List[dict]:
+        return await self.fetch('media_por_operadora_uf')
+
+
+class Psycopg2Repository(Repository):
+    """
+    Blocking psycopg2 queries moved off the event loop, each on a connection
+    borrowed from a ConnectionPool (backend/pool.py) created on first use;
+    `pool_settings` are the ConnectionPool arguments.
+    """
+
+    def __init__(self, db_params: dict, **pool_settings):
+        super().__init__()
+        self._db_params = dict(db_params)
+        self._pool_settings = pool_settings
+        self._pool = None
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        return psycopg2.connect(cursor_factory=RealDictCursor, **self._db_params)
+
+    def get_pool(self) -> ConnectionPool:
+        with self._lock:
+            if self._pool is None:
+                self._pool = ConnectionPool(self._connect, **self._pool_settings)
+            return self._pool
+
+    def close_pool(self):
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.close()
+
+    def connection(self):
+        """Pooled connection, used as `with repo.connection() as conn:` (commit/rollback and return on exit)."""
+        return self.get_pool().connection()
+
+    async def open(self):
+        await anyio.to_thread.run_sync(lambda: self.get_pool().open())
+
+    async def close(self):
+        await anyio.to_thread.run_sync(self.close_pool)
+
+    async def pool_stats(self) -> dict:
+        return dict(self.get_pool().stats(), driver='psycopg2')
+
+    def _execute(self, name, params, one):
+        with self.connection() as conn:
+            cur = conn.cursor()
+            cur.execute(SQL[name], params)
+            return cur.fetchone() if one else cur.fetchall()
+
+    async def fetch(self, name, *params):
+        return await anyio.to_thread.run_sync(self._execute, name, params, False)
+
+    async def fetch_one(self, name, *params):
+        return await anyio.to_thread.run_sync(self._execute, name, params, True)
+
+
+class AsyncpgRepository(Repository):
+    """
+    Queries on an asyncpg pool created in open() (app startup). asyncpg has
+    no age limit per connection (its max_inactive_connection_lifetime is an
+    idle timeout, left at asyncpg's default), so `max_lifetime` is applied by
+    expiring the pool's connections every `max_lifetime` seconds: each one is
+    replaced when next released, so none lives much past twice that.
+    """
+
+    def __init__(self, db_params: dict, min_size: int = 1, max_size: int = 10,
+                 acquire_timeout: float = 5.0, max_lifetime: float = 1800.0, **_):
+        if asyncpg is None:
+            raise ImportError("asyncpg is required for DB_DRIVER=asyncpg")
+        super().__init__()
+        self._connect_args = dict(db_params)
+        self._connect_args['database'] = self._connect_args.pop('dbname', None)
+        self._min_size = min_size
+        self._max_size = max_size
+        self._acquire_timeout = acquire_timeout
+        self._max_lifetime = max_lifetime
+        self._expired_at = time.monotonic()
+        self._pool = None
+        self._lock = asyncio.Lock()
+        self._sql = {name: numbered(sql) for name, sql in SQL.items()}
+
+    async def _get_pool(self):
+        async with self._lock:
+            if self._pool is None:
+                self._pool = await asyncpg.create_pool(
+                    min_size=self._min_size, max_size=self._max_size, **self._connect_args)
+                self._expired_at = time.monotonic()
+            elif time.monotonic() - self._expired_at > self._max_lifetime:
+                self._expired_at = time.monotonic()
+                await self._pool.expire_connections()
+            return self._pool
+
+    async def open(self):
+        await self._get_pool()
+
+    async def close(self):
+        if self._pool is not None:
+            await self._pool.close()
+            self._pool = None
+
+    async def pool_stats(self) -> dict:
+        pool = await self._get_pool()
+        return {
+            'driver': 'asyncpg',
+            'min_size': pool.get_min_size(),
+            'max_size': pool.get_max_size(),
+            'size': pool.get_size(),
+            'idle': pool.get_idle_size(),
+            'in_use': pool.get_size() - pool.get_idle_size(),
+        }
+
+    async def _execute(self, name, params, one):
+        pool = await self._get_pool()
+        try:
+            conn = await pool.acquire(timeout=self._acquire_timeout)
+        except asyncio.TimeoutError:
+            raise PoolTimeout(f"no database connection available after {self._acquire_timeout:.1f}s")
+        try:
+            if one:
+                row = await conn.fetchrow(self._sql[name], *params)
+                return dict(row) if row is not None else None
+            return [dict(row) for row in await conn.fetch(self._sql[name], *params)]
+        finally:
+            await pool.release(conn)
+
+    async def fetch(self, name, *params):
+        return await self._execute(name, params, False)
+
+    async def fetch_one(self, name, *params):
+        return await self._execute(name, params, True)
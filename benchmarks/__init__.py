@@ -0,0 +1 @@
+"""Gerador de dados sintéticos e benchmark do pipeline ANS."""
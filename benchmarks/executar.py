@@ -0,0 +1,251 @@
+"""
+BENCHMARK DO PIPELINE
+Gera (ou reaproveita) dados sintéticos em cada tamanho pedido e executa
+ans_integration.main e transform_validate.process de ponta a ponta, cada um
+em um processo separado com ANS_TRABALHO_DIR apontando para os dados
+gerados. Tempo total, tempo por etapa e pico de memória vêm do arquivo de
+métricas que cada script grava (metricas_pipeline).
+
+Uma execução só vale como medida se terminou sem erro (campo 'erro' das
+métricas) e se as linhas da saída batem com o manifesto do gerador: uma
+execução que perde linhas seria registrada como rápida.
+
+Os resultados podem ser comparados com uma baseline salva: o runner termina
+com código 1 quando alguma métrica piora além da tolerância.
+
+Uso:
+    python -m benchmarks.executar --tamanhos 100k,1m
+    python -m benchmarks.executar --tamanhos 1m --salvar-baseline
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import subprocess
+from datetime import datetime
+from pathlib import Path
+
+from benchmarks import gerar_dados
+
+# ============================================================================
+# CONFIGURAÇÕES
+# ============================================================================
+
+RAIZ = Path(__file__).resolve().parent.parent
+DADOS_DIR = Path(os.getenv('ANS_BENCHMARK_DIR', RAIZ / "dados_benchmark"))
+BASELINE_PATH = Path(__file__).resolve().parent / "baseline.json"
+RESULTADOS_DIR = Path(__file__).resolve().parent / "resultados"
+TOLERANCIA = 0.20  # piora relativa aceita antes de acusar regressão
+
+# Execuções medidas: nome → (código, arquivo de métricas em output/)
+EXECUCOES = {
+    'ans_integration': ("import ans_integration; ans_integration.main()", "metricas_execucao.json"),
+    'transform_validate': ("import transform_validate; transform_validate.process()",
+                           "metricas_transformacao.json"),
+}
+
+# Relatórios em output/ de onde vêm as contagens conferidas com o manifesto
+RELATORIO_CONSOLIDACAO = "relatorio_inconsistencias.json"
+RELATORIO_TRANSFORMACAO = "relatorio_transformacao.json"
+RELATORIOS = {
+    'ans_integration': RELATORIO_CONSOLIDACAO,
+    'transform_validate': RELATORIO_TRANSFORMACAO,
+}
+
+# Métricas comparadas com a baseline (maior é pior)
+METRICAS_COMPARADAS = ('segundos', 'pico_rss_bytes')
+
+
+def preparar_dados(tamanho, semente=42, diretorio=None):
+    """Diretório de trabalho com os dados do tamanho pedido (gera se preciso)."""
+    linhas = gerar_dados.interpretar_tamanho(tamanho)
+    destino = Path(diretorio or DADOS_DIR) / f"{tamanho}_s{semente}"
+    manifesto = destino / "manifesto_benchmark.json"
+    # Manifestos antigos, sem as linhas válidas esperadas, são regerados
+    if manifesto.exists() and 'linhas_validas' in _ler_json(manifesto):
+        print(f"✓ Dados de {tamanho} reaproveitados: {destino}")
+    else:
+        print(f"→ Gerando {linhas} linhas em {destino}...")
+        inicio = time.perf_counter()
+        gerar_dados.gerar(destino, linhas, semente=semente)
+        print(f"  ✓ ({time.perf_counter() - inicio:.1f} s)")
+    return destino
+
+
+def executar(nome, trabalho_dir, ambiente=None):
+    """
+    Executa um dos scripts em um processo novo e retorna as métricas
+    resumidas: tempo de parede, pico de RSS e tempo/linhas por etapa.
+    """
+    codigo, arquivo_metricas = EXECUCOES[nome]
+    # Execuções independentes entre si: sem download, incremental nem cache de dialetos
+    env = dict(os.environ, ANS_TRABALHO_DIR=str(trabalho_dir), ANS_INCREMENTAL='0', ANS_BAIXAR='0',
+               ANS_CACHE_DIALETOS='0')
+    env.update(ambiente or {})
+    env['PYTHONPATH'] = os.pathsep.join(filter(None, [str(RAIZ), env.get('PYTHONPATH')]))
+
+    metricas_path = Path(trabalho_dir) / "output" / arquivo_metricas
+    metricas_path.unlink(missing_ok=True)
+    (Path(trabalho_dir) / "output" / RELATORIOS[nome]).unlink(missing_ok=True)
+    inicio = time.perf_counter()
+    processo = subprocess.run([sys.executable, '-c', codigo], cwd=RAIZ, env=env,
+                              stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    segundos = time.perf_counter() - inicio
+    if processo.returncode != 0 or not metricas_path.exists():
+        raise RuntimeError(f"{nome} falhou: {processo.stderr[-500:]}")
+
+    metricas = _ler_json(metricas_path)
+    # ans_integration.main captura as exceções e grava as métricas mesmo assim
+    if metricas.get('erro'):
+        raise RuntimeError(f"{nome} falhou: {metricas['erro']}")
+    conferir_linhas(nome, trabalho_dir)
+    picos = [metricas.get('pico_rss_bytes'), metricas.get('pico_rss_filhos_bytes')]
+    return {
+        'segundos': round(segundos, 3),
+        'pico_rss_bytes': max(filter(None, picos), default=None),
+        'etapas': {
+            etapa['etapa']: {
+                'segundos': etapa['segundos'],
+                'linhas_entrada': etapa['linhas_entrada'],
+                'linhas_por_segundo': etapa['linhas_por_segundo'],
+            }
+            for etapa in metricas['etapas']
+        },
+    }
+
+
+def conferir_linhas(nome, trabalho_dir):
+    """
+    Confere as contagens dos relatórios com o manifesto do gerador:
+    ans_integration lê todas as linhas geradas e mantém exatamente as
+    válidas; transform_validate lê todas as linhas consolidadas.
+    """
+    saida = Path(trabalho_dir) / "output"
+    manifesto = _ler_json(Path(trabalho_dir) / "manifesto_benchmark.json")
+    try:
+        consolidacao = _ler_json(saida / RELATORIO_CONSOLIDACAO)
+        if nome == 'ans_integration':
+            esperado = {'linhas_processadas': manifesto['linhas'],
+                        'linhas_finais': manifesto['linhas_validas']}
+            obtido = {chave: consolidacao.get(chave) for chave in esperado}
+        else:
+            transformacao = _ler_json(saida / RELATORIO_TRANSFORMACAO)
+            esperado = {'rows_read_approx_chunked': consolidacao.get('linhas_finais')}
+            obtido = {'rows_read_approx_chunked': transformacao.get('rows_read_approx_chunked')}
+    except OSError as e:
+        raise RuntimeError(f"{nome} não gravou o relatório: {e}")
+    if obtido != esperado:
+        raise RuntimeError(f"{nome}: contagem de linhas {obtido} difere do esperado {esperado}")
+
+
+def _ler_json(caminho):
+    with open(caminho, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def executar_benchmark(tamanhos, semente=42, diretorio=None, repeticoes=1, ambiente=None):
+    """Roda todas as execuções em todos os tamanhos; guarda a melhor repetição."""
+    resultados = {}
+    for tamanho in tamanhos:
+        trabalho_dir = preparar_dados(tamanho, semente, diretorio)
+        resultados[tamanho] = {}
+        for nome in EXECUCOES:
+            medidas = [executar(nome, trabalho_dir, ambiente) for _ in range(repeticoes)]
+            melhor = min(medidas, key=lambda m: m['segundos'])
+            resultados[tamanho][nome] = melhor
+            pico = melhor['pico_rss_bytes']
+            print(f"  {tamanho:>6} {nome:<20} {melhor['segundos']:>9.2f} s"
+                  f"{f'  pico {pico / 1024 / 1024:,.0f} MB' if pico else ''}")
+    return {
+        'data': datetime.now().isoformat(timespec='seconds'),
+        'python': sys.version.split()[0],
+        'semente': semente,
+        'resultados': resultados,
+    }
+
+
+def comparar(atual, baseline, tolerancia=TOLERANCIA):
+    """
+    Lista as regressões de `atual` em relação a `baseline`: métricas (total
+    e por etapa) que pioraram mais que `tolerancia`. Tamanhos/execuções que
+    não existem na baseline são ignorados.
+    """
+    regressoes = []
+    for tamanho, execucoes in atual['resultados'].items():
+        for nome, medidas in execucoes.items():
+            referencia = baseline.get('resultados', {}).get(tamanho, {}).get(nome)
+            if not referencia:
+                continue
+            pares = [(metrica, medidas.get(metrica), referencia.get(metrica))
+                     for metrica in METRICAS_COMPARADAS]
+            pares += [(f"etapa {etapa}", dados['segundos'],
+                       referencia.get('etapas', {}).get(etapa, {}).get('segundos'))
+                      for etapa, dados in medidas.get('etapas', {}).items()]
+            for metrica, valor, anterior in pares:
+                if valor is None or not anterior:
+                    continue
+                variacao = valor / anterior - 1
+                if variacao > tolerancia:
+                    regressoes.append({
+                        'tamanho': tamanho,
+                        'execucao': nome,
+                        'metrica': metrica,
+                        'baseline': anterior,
+                        'atual': valor,
+                        'variacao': round(variacao, 3),
+                    })
+    return regressoes
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark do pipeline ANS")
+    parser.add_argument('--tamanhos', default='100k', help="lista separada por vírgula (100k,1m,10m,50m)")
+    parser.add_argument('--semente', type=int, default=42)
+    parser.add_argument('--dados', default=None, help="onde gerar/reaproveitar os dados")
+    parser.add_argument('--repeticoes', type=int, default=1)
+    parser.add_argument('--baseline', default=str(BASELINE_PATH))
+    parser.add_argument('--salvar-baseline', action='store_true')
+    parser.add_argument('--tolerancia', type=float, default=TOLERANCIA)
+    args = parser.parse_args(argv)
+
+    print("=" * 80)
+    print("BENCHMARK DO PIPELINE ANS")
+    print("=" * 80)
+    atual = executar_benchmark([t.strip() for t in args.tamanhos.split(',') if t.strip()],
+                               args.semente, args.dados, args.repeticoes)
+
+    RESULTADOS_DIR.mkdir(parents=True, exist_ok=True)
+    resultado_path = RESULTADOS_DIR / f"benchmark_{datetime.now():%Y%m%d_%H%M%S}.json"
+    with open(resultado_path, 'w', encoding='utf-8') as f:
+        json.dump(atual, f, indent=2)
+    print(f"\n✓ Resultados salvos: {resultado_path}")
+
+    baseline_path = Path(args.baseline)
+    if args.salvar_baseline:
+        with open(baseline_path, 'w', encoding='utf-8') as f:
+            json.dump(atual, f, indent=2)
+        print(f"✓ Baseline atualizada: {baseline_path}")
+        return 0
+
+    if not baseline_path.exists():
+        print("⚠ Sem baseline para comparar (use --salvar-baseline)")
+        return 0
+
+    with open(baseline_path, 'r', encoding='utf-8') as f:
+        baseline = json.load(f)
+    regressoes = comparar(atual, baseline, args.tolerancia)
+    if not regressoes:
+        print(f"✓ Nenhuma regressão acima de {args.tolerancia:.0%} em relação à baseline")
+        return 0
+
+    print(f"\nX {len(regressoes)} regressão(ões) acima de {args.tolerancia:.0%}:")
+    for r in regressoes:
+        print(f"  - {r['tamanho']} {r['execucao']} {r['metrica']}: "
+              f"{r['baseline']} → {r['atual']} (+{r['variacao']:.0%})")
+    return 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,288 @@
+"""
+GERADOR DE DADOS SINTÉTICOS NO FORMATO DA ANS
+Cria diretórios trimestrais (1T2025, 2T2025, ...) como os que
+ans_integration.py espera em dados_trabalho/, misturando os formatos que
+aparecem nos dados reais:
+- CSV ';' em latin-1 no layout das demonstrações contábeis (REG_ANS,
+  DESCRICAO, VL_SALDO_*), com vírgula decimal;
+- TXT com tabulação em UTF-8, trimestre como 'Q1' e ano com 2 dígitos;
+- CSV ',' em UTF-8;
+- XLSX (limitado a linhas_xlsx linhas: escrever planilhas é lento);
+e também um cadastro_operadoras.csv para o transform_validate.py.
+
+Dados sujos de propósito: CNPJs vazios ou com pontuação, razões sociais
+vazias, valores zerados, negativos e não numéricos. Tudo é gerado em blocos,
+então 50M linhas não precisam caber em memória.
+
+Uso:
+    python -m benchmarks.gerar_dados --linhas 1m --destino /tmp/ans_bench
+"""
+
+import argparse
+import json
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+# ============================================================================
+# CONFIGURAÇÕES
+# ============================================================================
+
+TAMANHOS = {
+    '100k': 100_000,
+    '1m': 1_000_000,
+    '10m': 10_000_000,
+    '50m': 50_000_000,
+}
+TRIMESTRES_PADRAO = [('2025', '1'), ('2025', '2'), ('2025', '3')]
+TAMANHO_BLOCO = 500_000
+LINHAS_XLSX = 20_000
+
+# Fração das linhas de cada trimestre por arquivo (o XLSX sai da parte CSV ',')
+FRACOES = {'ans': 0.60, 'txt': 0.25, 'csv_virgula': 0.15}
+
+# (identificador, valor) de cada layout, como a consolidação os mapeia
+COLUNAS_ANS = ('REG_ANS', 'VL_SALDO_INICIAL')
+COLUNAS_SIMPLES = ('CNPJ', 'VALOR_DESPESA')
+
+# Taxas de sujeira
+TAXA_CNPJ_VAZIO = 0.02
+TAXA_CNPJ_FORMATADO = 0.05
+TAXA_RAZAO_VAZIA = 0.01
+TAXA_ZERADO = 0.05
+TAXA_NEGATIVO = 0.02
+TAXA_NAO_NUMERICO = 0.005
+
+MODALIDADES = ['Medicina de Grupo', 'Cooperativa Médica', 'Autogestão',
+               'Seguradora Especializada em Saúde', 'Filantropia', 'Odontologia de Grupo']
+UFS = ['SP', 'RJ', 'MG', 'RS', 'PR', 'SC', 'BA', 'PE', 'CE', 'GO', 'DF', 'ES', 'PA', 'AM']
+NOMES = ['SAÚDE', 'ASSISTÊNCIA MÉDICA', 'PLANOS DE SAÚDE', 'COOPERATIVA DE TRABALHO MÉDICO',
+         'ODONTOLÓGICA', 'SEGURADORA', 'AUTOGESTÃO', 'SERVIÇOS HOSPITALARES']
+
+
+# ============================================================================
+# OPERADORAS
+# ============================================================================
+
+def gerar_operadoras(quantidade, rng):
+    """Tabela de operadoras: registro ANS (6 dígitos), CNPJ (14), razão social."""
+    registros = rng.choice(np.arange(300000, 999999), size=quantidade, replace=False)
+    cnpjs = rng.integers(10**12, 10**14, size=quantidade)
+    nomes = rng.choice(NOMES, size=quantidade)
+    return pd.DataFrame({
+        'reg_ans': registros.astype(str),
+        'cnpj': np.char.zfill(cnpjs.astype(str), 14),
+        'razao_social': [f"OPERADORA {i:05d} {nome} LTDA" for i, nome in enumerate(nomes)],
+        'modalidade': rng.choice(MODALIDADES, size=quantidade),
+        'uf': rng.choice(UFS, size=quantidade),
+    })
+
+
+def _quantidade_operadoras(linhas):
+    return int(min(5000, max(50, linhas // 2000)))
+
+
+# ============================================================================
+# BLOCOS DE LINHAS SUJAS
+# ============================================================================
+
+def _identificadores(base, rng):
+    """Identificadores com sujeira: vazios e com pontuação/espaços."""
+    ids = base.astype(object).copy()
+    sorteio = rng.random(len(ids))
+    formatados = (sorteio >= TAXA_CNPJ_VAZIO) & (sorteio < TAXA_CNPJ_VAZIO + TAXA_CNPJ_FORMATADO)
+    ids[formatados] = [_formatar(v) for v in ids[formatados]]
+    ids[sorteio < TAXA_CNPJ_VAZIO] = ''
+    return ids
+
+
+def _formatar(identificador):
+    """Como o identificador aparece digitado à mão: máscara e espaços."""
+    if len(identificador) == 14:
+        v = identificador
+        return f" {v[:2]}.{v[2:5]}.{v[5:8]}/{v[8:12]}-{v[12:]} "
+    return f" {identificador[:-1]}-{identificador[-1]} "
+
+
+def _valores(quantidade, rng, virgula_decimal=False):
+    """Valores monetários em texto, com zerados, negativos e lixo."""
+    valores = np.round(rng.lognormal(mean=9, sigma=2, size=quantidade), 2)
+    sorteio = rng.random(quantidade)
+    valores[sorteio < TAXA_ZERADO] = 0.0
+    negativos = (sorteio >= TAXA_ZERADO) & (sorteio < TAXA_ZERADO + TAXA_NEGATIVO)
+    valores[negativos] *= -1
+    texto = np.char.mod('%.2f', valores).astype(object)
+    if virgula_decimal:
+        texto = np.char.replace(texto.astype(str), '.', ',').astype(object)
+    lixo = sorteio >= 1 - TAXA_NAO_NUMERICO
+    texto[lixo] = rng.choice(['abc', 'N/D', '-', '1.2.3'], size=int(lixo.sum()))
+    return texto
+
+
+def _razoes(base, rng):
+    razoes = base.astype(object).copy()
+    razoes[rng.random(len(razoes)) < TAXA_RAZAO_VAZIA] = ''
+    return razoes
+
+
+def bloco_ans(operadoras, quantidade, ano, trimestre, rng):
+    """Layout das demonstrações contábeis (cnpj ← REG_ANS, valor ← VL_SALDO_INICIAL)."""
+    escolha = rng.integers(0, len(operadoras), size=quantidade)
+    mes = int(trimestre) * 3
+    return pd.DataFrame({
+        'DATA': f"{ano}-{mes:02d}-01",
+        'REG_ANS': _identificadores(operadoras['reg_ans'].to_numpy()[escolha], rng),
+        'CD_CONTA_CONTABIL': rng.choice(['41', '411', '4111', '41111'], size=quantidade),
+        'DESCRICAO': _razoes(operadoras['razao_social'].to_numpy()[escolha], rng),
+        'VL_SALDO_INICIAL': _valores(quantidade, rng, virgula_decimal=True),
+        'VL_SALDO_FINAL': _valores(quantidade, rng, virgula_decimal=True),
+    })
+
+
+def bloco_simples(operadoras, quantidade, ano, trimestre, rng, curto=False):
+    """Layout 'limpo' (CNPJ/RAZAO_SOCIAL/VALOR_DESPESA/TRIMESTRE/ANO)."""
+    escolha = rng.integers(0, len(operadoras), size=quantidade)
+    return pd.DataFrame({
+        'CNPJ': _identificadores(operadoras['cnpj'].to_numpy()[escolha], rng),
+        'RAZAO_SOCIAL': _razoes(operadoras['razao_social'].to_numpy()[escolha], rng),
+        'VALOR_DESPESA': _valores(quantidade, rng),
+        'TRIMESTRE': f"Q{trimestre}" if curto else trimestre,
+        'ANO': ano[2:] if curto else ano,
+    })
+
+
+# ============================================================================
+# ARQUIVOS
+# ============================================================================
+
+def linhas_validas(bloco, coluna_id, coluna_valor):
+    """
+    Linhas do bloco que a consolidação do ans_integration deve manter:
+    identificador preenchido e valor numérico (vírgula decimal aceita) não
+    negativo. O benchmark confere a saída com a soma gravada no manifesto.
+    """
+    valores = pd.to_numeric(bloco[coluna_valor].astype(str).str.replace(',', '.', regex=False),
+                            errors='coerce')
+    return int(((bloco[coluna_id].astype(str).str.strip() != '') & (valores >= 0)).sum())
+
+
+def _gravar_em_blocos(caminho, total, gerar_bloco, tamanho_bloco, colunas, **to_csv):
+    """
+    Grava `total` linhas geradas por gerar_bloco(n) em blocos de CSV.
+    Retorna (linhas gravadas, linhas válidas), com `colunas` =
+    (identificador, valor) lidas pela consolidação.
+    """
+    escritas = validas = 0
+    with open(caminho, 'w', newline='', encoding=to_csv.pop('encoding')) as f:
+        while escritas < total:
+            n = min(tamanho_bloco, total - escritas)
+            bloco = gerar_bloco(n)
+            bloco.to_csv(f, index=False, header=(escritas == 0), **to_csv)
+            validas += linhas_validas(bloco, *colunas)
+            escritas += n
+    return escritas, validas
+
+
+def gerar(destino, linhas, trimestres=None, semente=42, linhas_xlsx=LINHAS_XLSX,
+          tamanho_bloco=TAMANHO_BLOCO):
+    """
+    Gera `linhas` linhas (no total, divididas entre os trimestres) em
+    `destino`, que funciona como ANS_TRABALHO_DIR. Retorna o manifesto
+    gravado em destino/manifesto_benchmark.json.
+    """
+    destino = Path(destino)
+    destino.mkdir(parents=True, exist_ok=True)
+    trimestres = trimestres or TRIMESTRES_PADRAO
+    rng = np.random.default_rng(semente)
+    operadoras = gerar_operadoras(_quantidade_operadoras(linhas), rng)
+
+    arquivos = []
+    por_trimestre = linhas // len(trimestres)
+    for posicao, (ano, trimestre) in enumerate(trimestres):
+        pasta = destino / f"{trimestre}T{ano}"
+        pasta.mkdir(exist_ok=True)
+        total = por_trimestre + (linhas % len(trimestres) if posicao == 0 else 0)
+        n_ans = int(total * FRACOES['ans'])
+        n_txt = int(total * FRACOES['txt'])
+        n_xlsx = min(linhas_xlsx, total - n_ans - n_txt)
+        n_virgula = total - n_ans - n_txt - n_xlsx
+
+        especificacoes = [
+            (pasta / f"{trimestre}T{ano}.csv", n_ans,
+             lambda n: bloco_ans(operadoras, n, ano, trimestre, rng),
+             COLUNAS_ANS, {'sep': ';', 'encoding': 'latin-1'}),
+            (pasta / f"despesas_{trimestre}T{ano}.txt", n_txt,
+             lambda n: bloco_simples(operadoras, n, ano, trimestre, rng, curto=True),
+             COLUNAS_SIMPLES, {'sep': '\t', 'encoding': 'utf-8'}),
+            (pasta / f"eventos_{trimestre}T{ano}.csv", n_virgula,
+             lambda n: bloco_simples(operadoras, n, ano, trimestre, rng),
+             COLUNAS_SIMPLES, {'sep': ',', 'encoding': 'utf-8'}),
+        ]
+        for caminho, quantidade, gerar_bloco, colunas, opcoes in especificacoes:
+            _, validas = _gravar_em_blocos(caminho, quantidade, gerar_bloco, tamanho_bloco, colunas, **opcoes)
+            arquivos.append({'arquivo': str(caminho.relative_to(destino)), 'linhas': quantidade,
+                             'linhas_validas': validas})
+
+        if n_xlsx > 0:
+            caminho = pasta / f"sinistros_{trimestre}T{ano}.xlsx"
+            bloco = bloco_simples(operadoras, n_xlsx, ano, trimestre, rng)
+            bloco.to_excel(caminho, index=False)
+            arquivos.append({'arquivo': str(caminho.relative_to(destino)), 'linhas': n_xlsx,
+                             'linhas_validas': linhas_validas(bloco, *COLUNAS_SIMPLES)})
+
+    gerar_cadastro(operadoras, destino / "cadastro_operadoras.csv", rng)
+
+    manifesto = {
+        'linhas': linhas,
+        'semente': semente,
+        'trimestres': [f"{t}T{a}" for a, t in trimestres],
+        'operadoras': len(operadoras),
+        'linhas_validas': sum(a['linhas_validas'] for a in arquivos),
+        'arquivos': arquivos,
+        'bytes': sum(p.stat().st_size for p in destino.rglob('*') if p.is_file()),
+    }
+    with open(destino / "manifesto_benchmark.json", 'w', encoding='utf-8') as f:
+        json.dump(manifesto, f, indent=2, ensure_ascii=False)
+    return manifesto
+
+
+def gerar_cadastro(operadoras, caminho, rng):
+    """Cadastro de operadoras com alguns CNPJs repetidos (conflitos)."""
+    cadastro = pd.DataFrame({
+        'CNPJ': operadoras['cnpj'],
+        'RegistroANS': operadoras['reg_ans'],
+        'Razao_Social': operadoras['razao_social'],
+        'Modalidade': operadoras['modalidade'],
+        'UF': operadoras['uf'],
+    })
+    repetidos = cadastro.sample(n=max(1, len(cadastro) // 100), random_state=int(rng.integers(2**31)))
+    repetidos = repetidos.assign(UF=rng.choice(UFS, size=len(repetidos)))
+    pd.concat([cadastro, repetidos], ignore_index=True).to_csv(caminho, index=False)
+
+
+def interpretar_tamanho(texto):
+    """'100k', '1m', '2500' → número de linhas."""
+    texto = str(texto).strip().lower()
+    if texto in TAMANHOS:
+        return TAMANHOS[texto]
+    multiplicador = {'k': 1_000, 'm': 1_000_000}.get(texto[-1:], 1)
+    return int(float(texto.rstrip('km')) * multiplicador)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Gera dados sintéticos no formato da ANS")
+    parser.add_argument('--linhas', default='100k', help="total de linhas (100k, 1m, 10m, 50m ou número)")
+    parser.add_argument('--destino', required=True, help="diretório de trabalho a criar")
+    parser.add_argument('--semente', type=int, default=42)
+    parser.add_argument('--linhas-xlsx', type=int, default=LINHAS_XLSX)
+    args = parser.parse_args(argv)
+
+    manifesto = gerar(args.destino, interpretar_tamanho(args.linhas), semente=args.semente,
+                      linhas_xlsx=args.linhas_xlsx)
+    print(f"✓ {manifesto['linhas']} linhas em {len(manifesto['arquivos'])} arquivos "
+          f"({manifesto['bytes'] / 1024 / 1024:.1f} MB) → {args.destino}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,137 @@
+"""
+CORRESPONDÊNCIA APROXIMADA POR RAZÃO SOCIAL
+Segunda tentativa de ligar ao cadastro as linhas cujo CNPJ_clean não tem
+correspondência exata (códigos ANS truncados, reformatados...), pela razão
+social. Usada por transform_validate.py quando ANS_CORRESPONDENCIA_NOMES=1.
+
+Comparar cada nome sem correspondência com todos os nomes do cadastro é
+quadrático; aqui o cadastro vira um índice invertido de trigramas (blocking):
+- cada nome normalizado (sem acentos, maiúsculo, sem LTDA/S.A./DE...) gera
+  seus trigramas, e cada trigrama aponta para os nomes que o contêm;
+- um nome procurado consulta só os baldes dos seus GRAMAS_POR_BUSCA
+  trigramas mais raros (os que mais distinguem um nome de outro); baldes
+  com mais de TAMANHO_MAXIMO_BALDE nomes são ignorados;
+- só os CANDIDATOS_POR_NOME nomes que mais compartilham esses trigramas
+  são pontuados (coeficiente de Dice sobre todos os trigramas).
+Cada busca custa no máximo GRAMAS_POR_BUSCA × TAMANHO_MAXIMO_BALDE, então o
+total cresce linearmente com a quantidade de nomes procurados.
+"""
+
+import os
+import re
+import unicodedata
+from collections import defaultdict
+
+import numpy as np
+
+# ============================================================================
+# CONFIGURAÇÕES
+# ============================================================================
+
+USAR_CORRESPONDENCIA = os.getenv('ANS_CORRESPONDENCIA_NOMES', '0') == '1'
+PONTUACAO_MINIMA = float(os.getenv('ANS_CORRESPONDENCIA_MINIMA', '0.8'))
+TAMANHO_MAXIMO_BALDE = int(os.getenv('ANS_CORRESPONDENCIA_BALDE', '1000'))
+GRAMAS_POR_BUSCA = 8
+CANDIDATOS_POR_NOME = 20
+
+# Formas societárias e preposições: comuns a quase todos os nomes
+PALAVRAS_IGNORADAS = {
+    'LTDA', 'SA', 'S', 'A', 'CIA', 'ME', 'EPP', 'EIRELI',
+    'DE', 'DA', 'DO', 'DAS', 'DOS', 'E',
+}
+
+
+def normalizar_nome(nome):
+    """'Saúde & Vida S/A - Ltda.' → 'SAUDE VIDA'."""
+    if not isinstance(nome, str):
+        return ''
+    sem_acento = unicodedata.normalize('NFKD', nome).encode('ascii', 'ignore').decode('ascii')
+    palavras = re.sub(r'[^A-Z0-9]+', ' ', sem_acento.upper()).split()
+    return ' '.join(p for p in palavras if p not in PALAVRAS_IGNORADAS)
+
+
+def trigramas(nome_normalizado):
+    texto = f' {nome_normalizado} '
+    return {texto[i:i + 3] for i in range(len(texto) - 2)}
+
+
+def dice(a, b):
+    if not a or not b:
+        return 0.0
+    return 2 * len(a & b) / (len(a) + len(b))
+
+
+class IndiceNomes:
+    """
+    Índice de trigramas sobre os nomes do cadastro. `dados` traz, na mesma
+    ordem de `nomes`, o que deve ser devolvido para cada nome encontrado;
+    `chaves` identifica a operadora de cada nome (CNPJ), para reconhecer
+    nomes iguais de operadoras diferentes (padrão: cada posição é uma).
+    """
+
+    def __init__(self, nomes, dados, chaves=None):
+        self.dados = list(dados)
+        self.chaves = list(chaves) if chaves is not None else list(range(len(self.dados)))
+        self.exatos = {}
+        self.ambiguos = set()  # nomes normalizados de mais de uma chave
+        self.gramas = []
+        baldes = defaultdict(list)
+        for posicao, nome in enumerate(nomes):
+            normalizado = normalizar_nome(nome)
+            primeira = self.exatos.setdefault(normalizado, posicao)
+            if self.chaves[primeira] != self.chaves[posicao]:
+                self.ambiguos.add(normalizado)
+            gramas = trigramas(normalizado) if normalizado else set()
+            self.gramas.append(gramas)
+            for grama in gramas:
+                baldes[grama].append(posicao)
+        self.baldes = {g: np.array(ids, dtype=np.int32) for g, ids in baldes.items()}
+
+    def __len__(self):
+        return len(self.dados)
+
+    def buscar(self, nome):
+        """
+        (dados, pontuação, posição) do nome mais parecido, ou None sem
+        candidatos. Se a melhor pontuação é de nomes de chaves diferentes, a
+        correspondência é ambígua: dados e posição vêm como None.
+        """
+        normalizado = normalizar_nome(nome)
+        if not normalizado:
+            return None
+        if normalizado in self.exatos:
+            if normalizado in self.ambiguos:
+                return None, 1.0, None
+            posicao = self.exatos[normalizado]
+            return self.dados[posicao], 1.0, posicao
+
+        gramas = trigramas(normalizado)
+        baldes = sorted((self.baldes[g] for g in gramas if g in self.baldes), key=len)
+        baldes = [b for b in baldes[:GRAMAS_POR_BUSCA] if len(b) <= TAMANHO_MAXIMO_BALDE]
+        if not baldes:
+            return None
+        posicoes, compartilhados = np.unique(np.concatenate(baldes), return_counts=True)
+        # Mais trigramas em comum primeiro; empate pela ordem do cadastro
+        ordem = np.argsort(-compartilhados, kind='stable')[:CANDIDATOS_POR_NOME]
+        melhor = None
+        for posicao in posicoes[ordem].tolist():
+            pontuacao = dice(gramas, self.gramas[posicao])
+            if melhor is None or pontuacao > melhor[1]:
+                melhor = (self.dados[posicao], pontuacao, posicao)
+            elif (pontuacao == melhor[1] and melhor[2] is not None
+                  and self.chaves[posicao] != self.chaves[melhor[2]]):
+                melhor = (None, pontuacao, None)
+        return melhor
+
+    def propor(self, nomes, minima=None):
+        """
+        {nome: (dados, pontuação)} para os nomes com pontuação >= `minima`;
+        dados é None quando a correspondência é ambígua (ver buscar).
+        """
+        minima = PONTUACAO_MINIMA if minima is None else minima
+        propostas = {}
+        for nome in nomes:
+            encontrado = self.buscar(nome)
+            if encontrado is not None and encontrado[1] >= minima:
+                propostas[nome] = encontrado[:2]
+        return propostas
@@ -0,0 +1,238 @@
+"""
+ESQUEMA COMPACTO DO CONSOLIDADO
+Representação tipada das colunas do consolidado em memória, usada por
+ans_integration.py (PASSOS 4-5) e transform_validate.py quando
+ANS_ESQUEMA_COMPACTO=1:
+- colunas de texto repetitivas (CNPJ, RazaoSocial, status, UF, ...) como
+  category: dicionário de valores únicos + códigos inteiros por linha;
+- Ano (int16) e Trimestre (int8), quando todos os valores são dígitos de
+  mesma largura (assim a ordem numérica é a mesma da ordem textual);
+- ValorDespesas com precisão fixa, em centavos (int64), quando nenhum valor
+  tem mais de 2 casas decimais.
+
+As categorias ficam sempre em ordem lexicográfica, para que ordenações e
+groupby saiam na mesma ordem das colunas de texto; expandir() volta ao
+formato texto e os CSVs gravados são idênticos aos do modo normal.
+"""
+
+import os
+
+import numpy as np
+import pandas as pd
+from pandas.api.types import union_categoricals
+
+# ============================================================================
+# CONFIGURAÇÕES
+# ============================================================================
+
+USAR_ESQUEMA_COMPACTO = os.getenv('ANS_ESQUEMA_COMPACTO', '0') == '1'
+
+COLUNAS_CATEGORIA = ('CNPJ', 'RazaoSocial', 'status')
+COLUNAS_INTEIRAS = {'Ano': 'int16', 'Trimestre': 'int8'}
+COLUNA_VALOR = 'ValorDespesas'
+ESCALA_VALOR = 100  # centavos
+
+
+def memoria_bytes(df):
+    """Memória do DataFrame contando o conteúdo das strings."""
+    return int(df.memory_usage(deep=True, index=False).sum())
+
+
+def _esquema(df):
+    return df.attrs.get('esquema_compacto', {})
+
+
+# ============================================================================
+# COMPACTAR
+# ============================================================================
+
+def categoria(serie):
+    """Series como category com as categorias em ordem lexicográfica."""
+    if isinstance(serie.dtype, pd.CategoricalDtype):
+        return serie.cat.reorder_categories(sorted(serie.cat.categories))
+    categorias = sorted(pd.unique(serie.dropna()))
+    return pd.Series(pd.Categorical(serie, categories=categorias), index=serie.index, name=serie.name)
+
+
+def _inteiro(serie, tipo):
+    """int de largura fixa ou None se a coluna não puder ser convertida sem perda."""
+    texto = serie.astype(object)
+    if texto.isna().any() or not len(texto):
+        return None
+    texto = texto.astype(str)
+    larguras = texto.str.len()
+    if larguras.nunique() != 1 or not texto.str.fullmatch(r'\d+').all():
+        return None
+    valores = texto.astype('int64')
+    if valores.max() > np.iinfo(tipo).max:
+        return None
+    return valores.astype(tipo), int(larguras.iloc[0])
+
+
+def _centavos(serie):
+    """Valores em centavos (int64) ou None se algum valor perderia precisão."""
+    valores = serie.to_numpy(dtype='float64')
+    centavos = np.round(valores * ESCALA_VALOR)
+    if (not np.isfinite(valores).all() or np.abs(centavos).max(initial=0) >= 2**53
+            or not (centavos / ESCALA_VALOR == valores).all()):
+        return None
+    return centavos.astype('int64')
+
+
+def compactar(df, colunas_categoria=COLUNAS_CATEGORIA, coluna_valor=COLUNA_VALOR):
+    """
+    Versão compacta de um bloco do consolidado. Colunas que não podem ser
+    convertidas sem perda ficam como category (texto) ou float64 (valor).
+    O esquema escolhido fica em df.attrs['esquema_compacto'].
+    coluna_valor=None mantém a coluna de valor como está.
+    """
+    compacto = pd.DataFrame(index=df.index)
+    esquema = {'larguras': {}, 'centavos': False}
+    for coluna in df.columns:
+        serie = df[coluna]
+        if coluna in COLUNAS_INTEIRAS:
+            convertido = _inteiro(serie, COLUNAS_INTEIRAS[coluna])
+            if convertido is not None:
+                compacto[coluna], esquema['larguras'][coluna] = convertido
+            else:
+                compacto[coluna] = categoria(serie)
+        elif coluna_valor is not None and coluna == coluna_valor:
+            centavos = _centavos(serie)
+            esquema['centavos'] = centavos is not None
+            compacto[coluna] = centavos if centavos is not None else serie.astype('float64')
+        elif coluna in colunas_categoria:
+            compacto[coluna] = categoria(serie)
+        else:
+            compacto[coluna] = serie
+    compacto.attrs['esquema_compacto'] = esquema
+    return compacto
+
+
+def categorizar(df, colunas):
+    """Converte só as `colunas` presentes em category (sem mexer nas demais)."""
+    df = df.copy()
+    for coluna in colunas:
+        if coluna in df.columns:
+            df[coluna] = categoria(df[coluna])
+    return df
+
+
+def concatenar(blocos):
+    """
+    pd.concat(blocos, ignore_index=True) preservando o esquema compacto:
+    categories são unidas (pd.concat as transformaria em object) e colunas
+    em que os blocos escolheram representações diferentes são refeitas a
+    partir do texto.
+    """
+    blocos = [bloco for bloco in blocos if bloco is not None and len(bloco.columns)]
+    if not blocos:
+        return pd.DataFrame()
+    if len(blocos) == 1:
+        return blocos[0].reset_index(drop=True)
+
+    esquemas = [_esquema(bloco) for bloco in blocos]
+    resultado = {}
+    esquema = {'larguras': {}, 'centavos': False}
+    for coluna in blocos[0].columns:
+        series = [bloco[coluna] for bloco in blocos]
+        if all(isinstance(s.dtype, pd.CategoricalDtype) for s in series):
+            resultado[coluna] = pd.Series(union_categoricals(series, sort_categories=True))
+            continue
+        larguras = {e.get('larguras', {}).get(coluna) for e in esquemas}
+        centavos = {e.get('centavos', False) for e in esquemas} if coluna == COLUNA_VALOR else {False}
+        if len(larguras) == 1 and None not in larguras:
+            resultado[coluna] = pd.Series(np.concatenate([s.to_numpy() for s in series]))
+            esquema['larguras'][coluna] = larguras.pop()
+        elif centavos == {True}:
+            resultado[coluna] = pd.Series(np.concatenate([s.to_numpy() for s in series]))
+            esquema['centavos'] = True
+        elif larguras != {None} or True in centavos:
+            # Representações diferentes entre blocos: refazer a partir do texto
+            textos = pd.concat([_expandir_coluna(b, coluna) for b in blocos], ignore_index=True)
+            refeito = compactar(textos.to_frame())
+            resultado[coluna] = refeito[coluna]
+            esquema['larguras'].update(_esquema(refeito)['larguras'])
+            esquema['centavos'] = esquema['centavos'] or _esquema(refeito)['centavos']
+        else:
+            resultado[coluna] = pd.concat(series, ignore_index=True)
+    df = pd.DataFrame(resultado)
+    df.attrs['esquema_compacto'] = esquema
+    return df
+
+
+# ============================================================================
+# EXPANDIR (VOLTAR AO FORMATO TEXTO)
+# ============================================================================
+
+def _expandir_coluna(df, coluna):
+    esquema = _esquema(df)
+    serie = df[coluna]
+    largura = esquema.get('larguras', {}).get(coluna)
+    if largura is not None:
+        return serie.astype('int64').astype(str).str.zfill(largura).astype(object)
+    if coluna == COLUNA_VALOR and esquema.get('centavos'):
+        return pd.Series(serie.to_numpy() / ESCALA_VALOR, index=serie.index, name=coluna)
+    if isinstance(serie.dtype, pd.CategoricalDtype):
+        return pd.Series(serie.to_numpy(dtype=object), index=serie.index, name=coluna)
+    return serie
+
+
+def expandir(df):
+    """DataFrame no formato do modo normal (texto/float64); sem esquema, devolve df."""
+    if not isinstance(df.dtypes, pd.Series) or df.empty and not _esquema(df):
+        return df
+    if not _esquema(df) and not any(isinstance(t, pd.CategoricalDtype) for t in df.dtypes):
+        return df
+    expandido = pd.DataFrame({coluna: _expandir_coluna(df, coluna) for coluna in df.columns},
+                             index=df.index)
+    expandido.attrs.pop('esquema_compacto', None)
+    return expandido
+
+
+def em_blocos(df, tamanho):
+    """Fatias expandidas de `tamanho` linhas, para gravar sem expandir tudo de uma vez."""
+    for inicio in range(0, len(df), tamanho):
+        yield expandir(df.iloc[inicio:inicio + tamanho])
+
+
+# ============================================================================
+# OPERAÇÕES QUE PRECISAM CONHECER CATEGORIAS
+# ============================================================================
+
+def preencher_nulos(serie, valor):
+    """fillna que também funciona em category (mantendo as categorias ordenadas)."""
+    if isinstance(serie.dtype, pd.CategoricalDtype):
+        if valor not in serie.cat.categories:
+            serie = serie.cat.set_categories(sorted([*serie.cat.categories, valor]))
+    return serie.fillna(valor)
+
+
+def categoria_texto(df, coluna):
+    """
+    Coluna de um bloco compacto como category do seu texto: inteiros de
+    largura fixa voltam como '01', '2025'..., montados a partir dos valores
+    únicos (sem uma string por linha).
+    """
+    serie = df[coluna]
+    largura = _esquema(df).get('larguras', {}).get(coluna)
+    if largura is None:
+        return categoria(serie)
+    valores, codigos = np.unique(serie.to_numpy(), return_inverse=True)
+    rotulos = [str(valor).zfill(largura) for valor in valores.tolist()]
+    return pd.Series(pd.Categorical.from_codes(codigos.reshape(-1), categories=rotulos),
+                     index=serie.index, name=serie.name)
+
+
+def juntar_textos(a, b, separador):
+    """
+    a.astype(str) + separador + b.astype(str) como category, montado só a
+    partir das combinações de categorias (sem uma string por linha).
+    """
+    a, b = categoria(a), categoria(b)
+    codigos_a, codigos_b = a.cat.codes.to_numpy(), b.cat.codes.to_numpy()
+    rotulos = [f"{x}{separador}{y}" for x in a.cat.categories for y in b.cat.categories]
+    if (codigos_a < 0).any() or (codigos_b < 0).any() or len(set(rotulos)) != len(rotulos):
+        return categoria(a.astype(str) + separador + b.astype(str))
+    codigos = codigos_a.astype('int64') * len(b.cat.categories) + codigos_b
+    juntos = pd.Series(pd.Categorical.from_codes(codigos, categories=rotulos), index=a.index)
+    return categoria(juntos.cat.remove_unused_categories())
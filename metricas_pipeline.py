@@ -0,0 +1,342 @@
+"""
+MÉTRICAS DE EXECUÇÃO DO PIPELINE
+Mede cada etapa (PASSO) e cada arquivo processado: tempo de parede,
+linhas de entrada/saída, linhas por segundo, bytes lidos e pico de memória
+(RSS). O resultado vai para um JSON ao lado dos relatórios da execução.
+
+Perfil opcional, escolhido pela variável ANS_PERFIL:
+- 'cprofile':   cProfile da execução inteira (.prof + top 40 em texto)
+- 'amostragem': amostras periódicas da pilha da thread principal, gravadas
+                no formato "pilha;colapsada contagem" (compatível com
+                flamegraph.pl / speedscope)
+"""
+
+import os
+import sys
+import json
+import time
+import threading
+import contextlib
+from collections import Counter
+from datetime import datetime
+from pathlib import Path
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+try:
+    import psutil
+except ImportError:  # psutil é opcional
+    psutil = None
+
+# ============================================================================
+# CONFIGURAÇÕES
+# ============================================================================
+
+PERFIL = os.getenv('ANS_PERFIL', '').lower()  # ''|cprofile|amostragem
+INTERVALO_AMOSTRAGEM = float(os.getenv('ANS_PERFIL_INTERVALO', '0.005'))
+
+
+# ============================================================================
+# MEMÓRIA
+# ============================================================================
+
+def rss_atual_bytes():
+    """RSS atual do processo, ou None se não houver como medir."""
+    if psutil is not None:
+        return psutil.Process().memory_info().rss
+    try:
+        with open('/proc/self/statm', 'r') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def pico_rss_bytes():
+    """
+    Pico de RSS do processo. No Linux vem de VmHWM, que _reiniciar_pico
+    consegue zerar para medir o pico de cada etapa; nos demais sistemas é
+    o pico desde o início do processo.
+    """
+    try:
+        with open('/proc/self/status', 'r') as f:
+            for linha in f:
+                if linha.startswith('VmHWM:'):
+                    return int(linha.split()[1]) * 1024
+    except OSError:
+        pass
+    if resource is not None:
+        pico = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # ru_maxrss é em KB no Linux e em bytes no macOS
+        return pico if sys.platform == 'darwin' else pico * 1024
+    if psutil is not None:
+        info = psutil.Process().memory_info()
+        return getattr(info, 'peak_wset', info.rss)
+    return None
+
+
+def pico_rss_filhos_bytes():
+    """Maior pico de RSS entre os processos filhos já encerrados (workers)."""
+    if resource is None:
+        return None
+    pico = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return pico if sys.platform == 'darwin' else pico * 1024
+
+
+def _reiniciar_pico():
+    """Zera VmHWM (Linux >= 4.0). Retorna False se não for possível."""
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def _taxa(linhas, segundos):
+    if not linhas or not segundos:
+        return None
+    return round(linhas / segundos, 1)
+
+
+# ============================================================================
+# COLETA
+# ============================================================================
+
+class MetricasExecucao:
+    """
+    Métricas de uma execução. Etapas são medidas com `with etapa(nome)`;
+    dentro dela, anotar() preenche linhas_entrada, linhas_saida e
+    bytes_lidos. Arquivos (ou blocos) entram com registrar_arquivo().
+    """
+
+    def __init__(self, nome):
+        self.nome = nome
+        self.inicio = datetime.now().isoformat(timespec='seconds')
+        self._t0 = time.perf_counter()
+        self.etapas = []
+        self.arquivos = []
+        self.perfil = None
+        self.erro = None
+        self._abertas = []
+
+    @contextlib.contextmanager
+    def etapa(self, nome):
+        registro = {
+            'etapa': nome,
+            'linhas_entrada': None,
+            'linhas_saida': None,
+            'bytes_lidos': None,
+        }
+        # Etapas aninhadas não zeram o pico da etapa externa
+        pico_da_etapa = not self._abertas and _reiniciar_pico()
+        self._abertas.append(registro)
+        inicio = time.perf_counter()
+        try:
+            yield registro
+        finally:
+            self._abertas.pop()
+            registro['segundos'] = round(time.perf_counter() - inicio, 4)
+            registro['linhas_por_segundo'] = _taxa(registro['linhas_entrada'], registro['segundos'])
+            registro['pico_rss_bytes'] = pico_rss_bytes()
+            registro['pico_rss_escopo'] = 'etapa' if pico_da_etapa else 'processo'
+            self.etapas.append(registro)
+
+    def anotar(self, **dados):
+        """Atualiza a etapa aberta mais interna (sem etapa aberta, ignora)."""
+        if self._abertas:
+            self._abertas[-1].update(dados)
+
+    def registrar_arquivo(self, nome, segundos, linhas_entrada=None, linhas_saida=None,
+                          bytes_lidos=None, **extras):
+        self.arquivos.append(dict({
+            'arquivo': nome,
+            'segundos': round(segundos, 4),
+            'linhas_entrada': linhas_entrada,
+            'linhas_saida': linhas_saida,
+            'bytes_lidos': bytes_lidos,
+            'linhas_por_segundo': _taxa(linhas_entrada, segundos),
+            'mb_por_segundo': (round(bytes_lidos / 1024 / 1024 / segundos, 2)
+                               if bytes_lidos and segundos else None),
+        }, **extras))
+
+    def registrar_erro(self, erro):
+        """Marca a execução como falha (o arquivo de métricas é gravado mesmo assim)."""
+        self.erro = f"{type(erro).__name__}: {erro}"
+
+    def resumo(self):
+        return {
+            'execucao': self.nome,
+            'erro': self.erro,
+            'inicio': self.inicio,
+            'segundos_total': round(time.perf_counter() - self._t0, 4),
+            'pico_rss_bytes': pico_rss_bytes(),
+            'pico_rss_filhos_bytes': pico_rss_filhos_bytes(),
+            'etapas': self.etapas,
+            'arquivos': self.arquivos,
+            'perfil': self.perfil,
+        }
+
+    def salvar(self, caminho):
+        caminho = Path(caminho)
+        caminho.parent.mkdir(parents=True, exist_ok=True)
+        with open(caminho, 'w', encoding='utf-8') as f:
+            json.dump(self.resumo(), f, indent=2, ensure_ascii=False)
+        return caminho
+
+    def imprimir(self):
+        print("\n" + "-"*80)
+        print("MÉTRICAS DA EXECUÇÃO:")
+        print("-"*80)
+        for registro in self.etapas:
+            pico = registro['pico_rss_bytes']
+            taxa = registro['linhas_por_segundo']
+            print(f"  {registro['etapa']:<28} {registro['segundos']:>9.2f} s"
+                  f"{f'  {taxa:>12,.0f} linhas/s' if taxa else '':<22}"
+                  f"{f'  pico {pico / 1024 / 1024:,.0f} MB' if pico else ''}")
+
+
+# Coletor ativo do processo; as funções do pipeline registram nele sem
+# precisar receber o objeto como parâmetro
+_ativa = None
+
+
+def iniciar(nome):
+    global _ativa
+    _ativa = MetricasExecucao(nome)
+    return _ativa
+
+
+def ativa():
+    return _ativa
+
+
+def finalizar(caminho):
+    """Salva e imprime as métricas do coletor ativo e o desativa."""
+    global _ativa
+    metricas, _ativa = _ativa, None
+    if metricas is None:
+        return None
+    metricas.imprimir()
+    caminho = metricas.salvar(caminho)
+    print(f"✓ Métricas da execução salvas: {caminho}")
+    return caminho
+
+
+@contextlib.contextmanager
+def etapa(nome):
+    """Etapa no coletor ativo; sem coletor, apenas executa o bloco."""
+    if _ativa is None:
+        yield {}
+    else:
+        with _ativa.etapa(nome) as registro:
+            yield registro
+
+
+def anotar(**dados):
+    if _ativa is not None:
+        _ativa.anotar(**dados)
+
+
+def registrar_arquivo(nome, segundos, **dados):
+    if _ativa is not None:
+        _ativa.registrar_arquivo(nome, segundos, **dados)
+
+
+def registrar_erro(erro):
+    if _ativa is not None:
+        _ativa.registrar_erro(erro)
+
+
+# ============================================================================
+# PERFIL (ANS_PERFIL)
+# ============================================================================
+
+@contextlib.contextmanager
+def perfilar(diretorio, nome, modo=None):
+    """
+    Executa o bloco sob o perfilador escolhido em ANS_PERFIL (ou `modo`) e
+    grava o resultado em `diretorio`. Sem perfilador, não faz nada.
+    """
+    modo = PERFIL if modo is None else modo
+    if modo not in ('cprofile', 'amostragem'):
+        yield None
+        return
+
+    diretorio = Path(diretorio)
+    diretorio.mkdir(parents=True, exist_ok=True)
+    if modo == 'cprofile':
+        import cProfile
+        import pstats
+
+        perfil = cProfile.Profile()
+        perfil.enable()
+        try:
+            yield perfil
+        finally:
+            perfil.disable()
+            destino = diretorio / f"perfil_{nome}.prof"
+            perfil.dump_stats(destino)
+            with open(diretorio / f"perfil_{nome}.txt", 'w', encoding='utf-8') as f:
+                pstats.Stats(perfil, stream=f).sort_stats('cumulative').print_stats(40)
+            _registrar_perfil(destino)
+    else:
+        amostrador = AmostradorPilha(INTERVALO_AMOSTRAGEM)
+        amostrador.iniciar()
+        try:
+            yield amostrador
+        finally:
+            amostrador.parar()
+            destino = amostrador.salvar(diretorio / f"perfil_{nome}.txt")
+            _registrar_perfil(destino)
+
+
+def _registrar_perfil(destino):
+    print(f"✓ Perfil da execução salvo: {destino}")
+    if _ativa is not None:
+        _ativa.perfil = str(destino)
+
+
+class AmostradorPilha:
+    """
+    Perfilador por amostragem: uma thread lê a pilha da thread principal a
+    cada `intervalo` segundos e conta as pilhas vistas. O custo não depende
+    do número de chamadas, então serve para execuções longas de produção.
+    """
+
+    def __init__(self, intervalo=None):
+        self.intervalo = intervalo or INTERVALO_AMOSTRAGEM
+        self.contagens = Counter()
+        self.amostras = 0
+        self._alvo = threading.main_thread().ident
+        self._parar = threading.Event()
+        self._thread = None
+
+    def iniciar(self):
+        self._thread = threading.Thread(target=self._executar, name='amostrador-perfil', daemon=True)
+        self._thread.start()
+
+    def parar(self):
+        self._parar.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _executar(self):
+        while not self._parar.wait(self.intervalo):
+            quadro = sys._current_frames().get(self._alvo)
+            pilha = []
+            while quadro is not None:
+                codigo = quadro.f_code
+                pilha.append(f"{Path(codigo.co_filename).stem}:{codigo.co_name}")
+                quadro = quadro.f_back
+            if pilha:
+                self.contagens[';'.join(reversed(pilha))] += 1
+                self.amostras += 1
+
+    def salvar(self, destino):
+        with open(destino, 'w', encoding='utf-8') as f:
+            for pilha, contagem in self.contagens.most_common():
+                f.write(f"{pilha} {contagem}\n")
+        return destino
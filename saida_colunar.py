@@ -0,0 +1,182 @@
+"""
+SAÍDA COLUNAR (PARQUET)
+Grava os conjuntos consolidado e enriquecido em Parquet, ao lado dos CSVs:
+colunas tipadas, compressão e partições Ano=/Trimestre= (hive), para que
+quem consome leia só as colunas e os trimestres de que precisa.
+Depende de pyarrow, que é opcional: sem ele a gravação é ignorada com aviso.
+"""
+
+import os
+import shutil
+import tempfile
+from pathlib import Path
+
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # pyarrow é opcional
+    pa = None
+    pq = None
+
+# ============================================================================
+# CONFIGURAÇÕES
+# ============================================================================
+
+GERAR_PARQUET = os.getenv('ANS_PARQUET', '0') == '1'
+COMPRESSAO = os.getenv('ANS_PARQUET_COMPRESSAO', 'zstd')
+LINHAS_POR_GRUPO = int(os.getenv('ANS_PARQUET_LINHAS_GRUPO', '131072'))
+COLUNAS_PARTICAO = ['Ano', 'Trimestre']
+
+# Tipos do consolidado; Ano/Trimestre ficam como texto ("2025", "01") para
+# que o nome das partições seja o mesmo valor gravado no CSV
+TIPOS_CONSOLIDADO = {
+    'CNPJ': 'string',
+    'RazaoSocial': 'string',
+    'Trimestre': 'string',
+    'Ano': 'string',
+    'ValorDespesas': 'float64',
+    'status': 'string',
+}
+
+
+def disponivel():
+    """True se pyarrow está instalado."""
+    return pq is not None
+
+
+def _tipar(df, tipos=None):
+    """
+    Aplica os tipos pedidos e converte as demais colunas de texto para
+    'string', para que todos os blocos gerem o mesmo esquema Arrow (um bloco
+    com a coluna toda nula não vira tipo null).
+    """
+    df = df.copy()
+    tipos = tipos or {}
+    for coluna in df.columns:
+        if coluna in tipos:
+            df[coluna] = df[coluna].astype(tipos[coluna])
+        elif (df[coluna].dtype == object or pd.api.types.is_string_dtype(df[coluna])
+              or isinstance(df[coluna].dtype, pd.CategoricalDtype)):
+            df[coluna] = df[coluna].astype('string')
+    return df
+
+
+def gravar_bloco(bloco, diretorio, numero, tipos=None, particoes=None):
+    """
+    Grava `bloco` como parte-<numero>-*.parquet do dataset em `diretorio`
+    e retorna as linhas gravadas. Processos diferentes podem gravar no
+    mesmo diretório ao mesmo tempo, desde que com números diferentes.
+    """
+    if bloco.empty:
+        return 0
+    particoes = COLUNAS_PARTICAO if particoes is None else particoes
+    tabela = pa.Table.from_pandas(_tipar(bloco, tipos), preserve_index=False)
+    pq.write_to_dataset(
+        tabela, diretorio,
+        partition_cols=[c for c in particoes if c in tabela.column_names] or None,
+        basename_template=f"parte-{numero:05d}-{{i}}.parquet",
+        compression=COMPRESSAO,
+        row_group_size=LINHAS_POR_GRUPO,
+    )
+    return len(bloco)
+
+
+class EscritorParquet:
+    """
+    Dataset Parquet particionado gravado bloco a bloco: cada adicionar()
+    grava um bloco num diretório temporário e concluir() o coloca no lugar
+    de `destino` (o dataset anterior só é substituído no fim). Serve para
+    quem produz os blocos aos poucos, sem guardá-los em memória.
+
+    Blocos também podem ser gravados por outros processos com gravar_bloco()
+    em diretorio_temporario(); registrar() contabiliza cada um deles.
+    """
+
+    def __init__(self, destino, tipos=None, particoes=None):
+        self.destino = Path(destino)
+        self.tipos = tipos
+        self.particoes = COLUNAS_PARTICAO if particoes is None else particoes
+        self.total = 0
+        self._blocos = 0
+        self._temporario = None
+
+    def diretorio_temporario(self):
+        """Diretório onde o dataset é montado (criado na primeira chamada)."""
+        if self._temporario is None:
+            self.destino.parent.mkdir(parents=True, exist_ok=True)
+            self._temporario = Path(tempfile.mkdtemp(prefix=f".{self.destino.name}.",
+                                                     dir=self.destino.parent))
+        return self._temporario
+
+    def adicionar(self, bloco):
+        if bloco.empty:
+            self.registrar(0)
+            return
+        self.registrar(gravar_bloco(bloco, self.diretorio_temporario(), self._blocos,
+                                    self.tipos, self.particoes))
+
+    def registrar(self, linhas):
+        """Contabiliza um bloco já gravado (por adicionar ou por gravar_bloco)."""
+        self._blocos += 1
+        self.total += linhas
+
+    def concluir(self):
+        """Substitui `destino` pelo dataset gravado; retorna o número de linhas."""
+        temporario = self.diretorio_temporario()
+        if self.destino.exists():
+            shutil.rmtree(self.destino)
+        os.replace(temporario, self.destino)
+        self._temporario = None
+        return self.total
+
+    def descartar(self):
+        if self._temporario is not None:
+            shutil.rmtree(self._temporario, ignore_errors=True)
+            self._temporario = None
+
+
+def gravar_parquet(blocos, destino, tipos=None, particoes=None):
+    """
+    Grava os DataFrames de `blocos` (uma lista ou um gerador, como o de
+    read_csv com chunksize) como um dataset Parquet particionado em `destino`.
+    O dataset é montado num diretório temporário e só substitui o anterior
+    no fim. Retorna o número de linhas gravadas, ou None sem pyarrow.
+    """
+    if not disponivel():
+        print("⚠ pyarrow não instalado: saída Parquet ignorada")
+        return None
+
+    escritor = EscritorParquet(destino, tipos, particoes)
+    try:
+        for bloco in blocos:
+            escritor.adicionar(bloco)
+    except Exception:
+        escritor.descartar()
+        raise
+    return escritor.concluir()
+
+
+def ler_parquet(origem, colunas=None, anos=None, trimestres=None):
+    """
+    Lê um dataset gravado por gravar_parquet carregando só `colunas` e só as
+    partições dos `anos`/`trimestres` pedidos (listas de textos, ex.: ['2025'],
+    ['01', '02']). As colunas de partição voltam como texto.
+    """
+    if not disponivel():
+        raise ImportError("pyarrow é necessário para ler a saída Parquet")
+
+    filtros = []
+    if anos is not None:
+        filtros.append(('Ano', 'in', [str(a) for a in anos]))
+    if trimestres is not None:
+        filtros.append(('Trimestre', 'in', [str(t).zfill(2) for t in trimestres]))
+
+    import pyarrow.dataset as ds
+
+    particionamento = ds.partitioning(
+        pa.schema([(c, pa.string()) for c in COLUNAS_PARTICAO]), flavor='hive')
+    dataset = ds.dataset(origem, format='parquet', partitioning=particionamento)
+    filtro = pq.filters_to_expression(filtros) if filtros else None
+    return dataset.to_table(columns=colunas, filter=filtro).to_pandas()
@@ -3,8 +3,10 @@
 -- DDL, import examples and analytical queries
 
 -- ===== DDL: operadoras (cadastro) =====
+-- CNPJs are stored in canonical digits-only form (the API normalizes the
+-- request the same way), so lookups are plain equality on the primary key
 CREATE TABLE IF NOT EXISTS operadoras (
-  cnpj VARCHAR(20) PRIMARY KEY,
+  cnpj VARCHAR(20) PRIMARY KEY CONSTRAINT operadoras_cnpj_digits CHECK (cnpj ~ '^[0-9]+$'),
   razao_social TEXT NOT NULL,
   nome_fantasia TEXT,
   tipo_operadora TEXT,
@@ -15,12 +17,39 @@ CREATE TABLE IF NOT EXISTS operadoras (
   created_at TIMESTAMP WITH TIME ZONE DEFAULT now()
 );
 CREATE INDEX IF NOT EXISTS idx_operadoras_uf ON operadoras(uf);
+-- keyset pagination of /api/operadoras: ORDER BY razao_social, cnpj and
+-- WHERE (razao_social, cnpj) > (last seen) are read straight from this index
+CREATE INDEX IF NOT EXISTS idx_operadoras_razao_cnpj ON operadoras(razao_social, cnpj);
+
+-- ===== Search on operadoras (q of /api/operadoras) =====
+-- Trigram GIN indexes serve LIKE '%term%' and word similarity (<%) without a
+-- sequential scan; razão social is indexed lowercased and without accents.
+-- unaccent() is only STABLE, so an IMMUTABLE wrapper is needed to index it.
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+CREATE EXTENSION IF NOT EXISTS unaccent;
+CREATE OR REPLACE FUNCTION f_unaccent(text) RETURNS text
+  LANGUAGE sql IMMUTABLE PARALLEL SAFE STRICT
+  AS $$ SELECT public.unaccent('public.unaccent'::regdictionary, $1) $$;
+CREATE INDEX IF NOT EXISTS idx_operadoras_razao_trgm
+  ON operadoras USING gin (lower(f_unaccent(razao_social)) gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS idx_operadoras_cnpj_trgm ON operadoras USING gin (cnpj gin_trgm_ops);
+
+-- Search query used by the API (term = 'saude', digits = NULL when the term has none):
+-- SELECT cnpj, razao_social, nome_fantasia, uf FROM operadoras
+-- WHERE lower(f_unaccent(razao_social)) LIKE '%' || lower(f_unaccent('saude')) || '%'
+--    OR lower(f_unaccent('saude')) <% lower(f_unaccent(razao_social))
+--    OR cnpj LIKE '%' || :digits || '%'
+-- ORDER BY (cnpj LIKE '%' || :digits || '%') IS TRUE DESC,
+--          word_similarity(lower(f_unaccent('saude')), lower(f_unaccent(razao_social))) DESC,
+--          razao_social, cnpj
+-- LIMIT 20;
 
 -- ===== DDL: consolidado_despesas =====
 -- stores per-operadora per-quarter expense records
 CREATE TABLE IF NOT EXISTS consolidado_despesas (
   id BIGSERIAL PRIMARY KEY,
-  cnpj VARCHAR(20) NOT NULL REFERENCES operadoras(cnpj),
+  cnpj VARCHAR(20) NOT NULL REFERENCES operadoras(cnpj)
+    CONSTRAINT consolidado_cnpj_digits CHECK (cnpj ~ '^[0-9]+$'),
   uf VARCHAR(2) NOT NULL,
   trimestre_date DATE NOT NULL, -- store as date (quarter start, e.g., '2025-01-01')
   despesa_total DECIMAL(15,2) NOT NULL,
@@ -28,6 +57,29 @@ CREATE TABLE IF NOT EXISTS consolidado_despesas (
   inserted_at TIMESTAMP WITH TIME ZONE DEFAULT now()
 );
 CREATE INDEX IF NOT EXISTS idx_consolidado_cnpj_trimestre ON consolidado_despesas(cnpj, trimestre_date);
+
+-- ===== Migration: canonical CNPJ for tables created by older versions =====
+-- Rewrites formatted CNPJs ('12.345.678/0001-90') as digits and adds the
+-- CHECK constraints; the foreign key is dropped while both sides change.
+-- (Two formatted variants of the same CNPJ in operadoras make the UPDATE
+-- fail on the primary key: merge them before running it.)
+BEGIN;
+ALTER TABLE consolidado_despesas DROP CONSTRAINT IF EXISTS consolidado_despesas_cnpj_fkey;
+UPDATE operadoras SET cnpj = regexp_replace(cnpj, '[^0-9]', '', 'g') WHERE cnpj ~ '[^0-9]';
+UPDATE consolidado_despesas SET cnpj = regexp_replace(cnpj, '[^0-9]', '', 'g') WHERE cnpj ~ '[^0-9]';
+ALTER TABLE consolidado_despesas ADD CONSTRAINT consolidado_despesas_cnpj_fkey
+  FOREIGN KEY (cnpj) REFERENCES operadoras(cnpj);
+DO $$
+BEGIN
+  ALTER TABLE operadoras ADD CONSTRAINT operadoras_cnpj_digits CHECK (cnpj ~ '^[0-9]+$');
+EXCEPTION WHEN duplicate_object THEN NULL;
+END $$;
+DO $$
+BEGIN
+  ALTER TABLE consolidado_despesas ADD CONSTRAINT consolidado_cnpj_digits CHECK (cnpj ~ '^[0-9]+$');
+EXCEPTION WHEN duplicate_object THEN NULL;
+END $$;
+COMMIT;
 CREATE INDEX IF NOT EXISTS idx_consolidado_uf ON consolidado_despesas(uf);
 
 -- ===== DDL: despesas_agregadas =====
@@ -62,7 +114,7 @@ CREATE TABLE IF NOT EXISTS staging_consolidado_raw (
 -- Sample insert with robust parsing (handles commas/dots in numbers and some date formats)
 INSERT INTO consolidado_despesas(cnpj, uf, trimestre_date, despesa_total, detalhe)
 SELECT
-  trim(NULLIF(cnpj, '')) AS cnpj_clean,
+  regexp_replace(cnpj, '[^0-9]', '', 'g') AS cnpj_clean,
   upper(trim(NULLIF(uf, ''))) AS uf_clean,
   -- convert trimestre to a quarter start date: try YYYY-MM-DD, else try YYYY-Qn, else parse first 4 chars as year
   (CASE
@@ -80,7 +132,7 @@ SELECT
    END) as despesa_clean,
   jsonb_build_object('src_row', ctid)::jsonb
 FROM staging_consolidado_raw
-WHERE trim(NULLIF(cnpj, '')) IS NOT NULL
+WHERE regexp_replace(cnpj, '[^0-9]', '', 'g') <> ''
   AND trim(NULLIF(uf, '')) <> ''
   AND (regexp_replace(despesa, '[^0-9,.-]', '', 'g') ~ '^[0-9]+([.,][0-9]+)?$');
 
@@ -111,7 +163,7 @@ SELECT
   upper(trim(NULLIF(uf, ''))),
   trim(NULLIF(cidade, ''))
 FROM staging_operadoras_raw
-WHERE trim(NULLIF(cnpj, '')) IS NOT NULL AND trim(NULLIF(razao_social, '')) IS NOT NULL;
+WHERE regexp_replace(cnpj, '[^0-9]', '', 'g') <> '' AND trim(NULLIF(razao_social, '')) IS NOT NULL;
 
 -- For despesas_agregadas, follow similar staging + insert pattern shown above.
 
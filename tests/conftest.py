@@ -0,0 +1,4 @@
+import os
+
+# The backend tests patch Psycopg2Repository.connection, which only the psycopg2 driver uses
+os.environ.setdefault('DB_DRIVER', 'psycopg2')
@@ -0,0 +1,125 @@
+import gzip
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import ans_download
+
+
+ARQUIVOS = {
+    '/demonstracoes_contabeis/2024/4T2024.zip': b'a' * 5000,
+    '/demonstracoes_contabeis/2025/1T2025.zip': bytes(range(256)) * 40,
+    '/demonstracoes_contabeis/2025/2T2025.zip': b'b' * 3000,
+    '/demonstracoes_contabeis/2025/3T2025.zip': b'c' * 7000,
+}
+DIRETORIOS = {
+    '/demonstracoes_contabeis/': ['../', '2024/', '2025/', '?C=M;O=A'],
+    '/demonstracoes_contabeis/2024/': ['../', '4T2024.zip'],
+    '/demonstracoes_contabeis/2025/': ['../', '1T2025.zip', '2T2025.zip', '3T2025.zip', 'leiame.txt'],
+}
+
+
+class Handler(BaseHTTPRequestHandler):
+    requisicoes = []
+    gzip = False
+
+    def log_message(self, *args):
+        pass
+
+    def _cabecalhos(self, corpo, status=200, extras=()):
+        self.send_response(status)
+        self.send_header('Content-Length', str(len(corpo)))
+        for nome, valor in extras:
+            self.send_header(nome, valor)
+        self.end_headers()
+
+    def do_HEAD(self):
+        Handler.requisicoes.append(('HEAD', self.path, None))
+        corpo = ARQUIVOS.get(self.path)
+        if corpo is None:
+            return self._cabecalhos(b'', 404)
+        self._cabecalhos(corpo, extras=[('ETag', f'"{len(corpo)}"')])
+
+    def do_GET(self):
+        Handler.requisicoes.append(('GET', self.path, self.headers.get('Range')))
+        if self.path in DIRETORIOS:
+            corpo = ''.join(f'<a href="{nome}">{nome}</a>\n' for nome in DIRETORIOS[self.path]).encode()
+            self._cabecalhos(corpo)
+            return self.wfile.write(corpo)
+        corpo = ARQUIVOS.get(self.path)
+        if corpo is None:
+            return self._cabecalhos(b'', 404)
+        etag = f'"{len(corpo)}"'
+        intervalo = self.headers.get('Range')
+        if intervalo and self.headers.get('If-Range') == etag:
+            inicio = int(intervalo.split('=')[1].rstrip('-'))
+            parte = corpo[inicio:]
+            self._cabecalhos(parte, 206, [('ETag', etag),
+                                          ('Content-Range', f'bytes {inicio}-{len(corpo) - 1}/{len(corpo)}')])
+            return self.wfile.write(parte)
+        extras = [('ETag', etag)]
+        if Handler.gzip:
+            # Servidor que comprime mesmo com Accept-Encoding: identity
+            corpo = gzip.compress(corpo)
+            extras.append(('Content-Encoding', 'gzip'))
+        self._cabecalhos(corpo, extras=extras)
+        self.wfile.write(corpo)
+
+
+@pytest.fixture
+def servidor():
+    Handler.requisicoes = []
+    httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield f'http://127.0.0.1:{httpd.server_address[1]}/'
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def test_listar_trimestres_remotos(servidor):
+    trimestres = ans_download.listar_trimestres_remotos(servidor, quantidade=3)
+    assert [(ano, trim) for ano, trim, _ in trimestres] == [('2025', '3'), ('2025', '2'), ('2025', '1')]
+
+
+def test_baixar_trimestres_e_pular_existentes(servidor, tmp_path):
+    resultados = ans_download.baixar_trimestres(servidor, tmp_path, quantidade=3, workers=3)
+    assert [status for _, _, status in resultados] == ['baixado'] * 3
+    for url, caminho, _ in resultados:
+        assert caminho.read_bytes() == ARQUIVOS[url.replace(servidor, '/')]
+
+    Handler.requisicoes = []
+    resultados = ans_download.baixar_trimestres(servidor, tmp_path, quantidade=3, workers=3)
+    assert [status for _, _, status in resultados] == ['existente'] * 3
+    assert not [r for r in Handler.requisicoes if r[1].endswith('.zip') and r[0] == 'GET']
+
+
+def test_retomar_download_parcial(servidor, tmp_path):
+    url = servidor + 'demonstracoes_contabeis/2025/1T2025.zip'
+    corpo = ARQUIVOS['/demonstracoes_contabeis/2025/1T2025.zip']
+    destino = tmp_path / '1T2025.zip'
+    (tmp_path / '1T2025.zip.part').write_bytes(corpo[:4000])
+    (tmp_path / '1T2025.zip.part.meta.json').write_text(
+        f'{{"url": "{url}", "etag": "\\"{len(corpo)}\\"", "tamanho": {len(corpo)}}}')
+
+    assert ans_download.baixar_arquivo(url, destino) == 'retomado'
+    assert destino.read_bytes() == corpo
+    assert ('GET', '/demonstracoes_contabeis/2025/1T2025.zip', 'bytes=4000-') in Handler.requisicoes
+    assert not (tmp_path / '1T2025.zip.part').exists()
+
+
+def test_download_com_gzip_nao_confunde_content_length(servidor, tmp_path, monkeypatch):
+    monkeypatch.setattr(Handler, 'gzip', True)
+    url = servidor + 'demonstracoes_contabeis/2025/3T2025.zip'
+    destino = tmp_path / '3T2025.zip'
+    assert ans_download.baixar_arquivo(url, destino) == 'baixado'
+    assert destino.read_bytes() == ARQUIVOS['/demonstracoes_contabeis/2025/3T2025.zip']
+
+
+def test_erro_em_um_arquivo_nao_interrompe_os_demais(servidor, tmp_path):
+    urls = [servidor + 'demonstracoes_contabeis/2025/9T2025.zip',
+            servidor + 'demonstracoes_contabeis/2025/2T2025.zip']
+    resultados = ans_download.baixar_arquivos(urls, tmp_path, workers=2)
+    assert resultados[0][2].startswith('erro')
+    assert resultados[1][2] == 'baixado'
@@ -0,0 +1,450 @@
+import json
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import ans_integration
+import metricas_pipeline
+
+
+@pytest.fixture(autouse=True)
+def _cache_dialetos_temporario(tmp_path, monkeypatch):
+    monkeypatch.setattr(ans_integration, 'CACHE_DIALETOS_PATH', tmp_path / 'cache' / 'dialetos.json')
+
+
+def _dataframes_sujos():
+    df1 = pd.DataFrame({
+        'cnpj': ['123', ' 456 ', '', np.nan, '789', '123', '999'],
+        'razao_social': ['A SA', 'B SA', 'C SA', 'D SA', '', 'A LTDA', 'E SA'],
+        'valor': ['10.5', '0', '3', '4', '-1', 'abc', np.nan],
+        'trimestre': ['Q1', '1', '2', '3', 'q4', '2', '3'],
+        'ano': ['25', '2025', '2025', '2025', '2025', '2025', 'xx'],
+    })
+    df2 = pd.DataFrame({
+        'cnpj': [344800, 344800, 111],
+        'razao_social': ['Operadora X', 'Outra Descricao', None],
+        'valor': [100.0, 0.0, -5.0],
+    })
+    df2['ano'] = '2024'
+    df2['trimestre'] = '3'
+    return [df1, pd.DataFrame(), df2]
+
+
+def test_consolidacao_vetorizada_igual_linha_a_linha():
+    df_ref, rel_ref = ans_integration.consolidar_e_tratar_inconsistencias(
+        _dataframes_sujos(), modo='linha_a_linha')
+    df_vet, rel_vet = ans_integration.consolidar_e_tratar_inconsistencias(
+        _dataframes_sujos(), modo='vetorizado')
+
+    pd.testing.assert_frame_equal(df_vet, df_ref)
+
+    for chave in ('valores_invalidos', 'linhas_removidas', 'linhas_processadas', 'linhas_finais'):
+        assert rel_vet[chave] == rel_ref[chave]
+    # A ordem das razões sociais no modo linha a linha vem de um set
+    assert ({d['cnpj']: set(d['razoes_sociais']) for d in rel_vet['cnpj_duplicados_suspeitos']}
+            == {d['cnpj']: set(d['razoes_sociais']) for d in rel_ref['cnpj_duplicados_suspeitos']})
+
+
+def test_consolidacao_vetorizada_regras():
+    df, rel = ans_integration.consolidar_e_tratar_inconsistencias(_dataframes_sujos())
+
+    assert rel['linhas_processadas'] == 10
+    assert set(df['Trimestre']) <= {'01', '02', '03', '04'}
+    assert set(df['Ano']) == {'2024', '2025'}
+    assert (df['ValorDespesas'] >= 0).all()
+    assert df.loc[df['ValorDespesas'] == 0, 'status'].eq('ZERADO').all()
+    assert [d['cnpj'] for d in rel['cnpj_duplicados_suspeitos']] == ['344800']
+    assert rel['valores_invalidos']['por_tipo'] == {'NEGATIVO': 2, 'ZERADO': 3}
+    assert {d['tipo'] for d in rel['valores_invalidos']['amostra']} == {'NEGATIVO', 'ZERADO'}
+
+
+def test_valores_invalidos_amostra_limitada_e_lista_em_disco(tmp_path, monkeypatch):
+    monkeypatch.setattr(ans_integration, 'TAMANHO_AMOSTRA_INVALIDOS', 10)
+    df = pd.DataFrame({
+        'cnpj': [str(i) for i in range(5000)],
+        'razao_social': 'X',
+        'valor': [-1.0 if i % 3 == 0 else 0.0 for i in range(5000)],
+        'trimestre': '1',
+        'ano': '2025',
+    })
+    destino = tmp_path / 'valores_invalidos.csv'
+    _, rel = ans_integration.consolidar_e_tratar_inconsistencias(
+        [df.iloc[:1234], df.iloc[1234:]], destino_invalidos=destino)
+
+    invalidos = rel['valores_invalidos']
+    assert invalidos['total'] == 5000
+    assert invalidos['por_tipo'] == {'NEGATIVO': 1667, 'ZERADO': 3333}
+    assert len(invalidos['amostra']) == 10
+    assert invalidos['arquivo'] == 'valores_invalidos.csv'
+
+    lista = pd.read_csv(destino, sep=';', dtype={'cnpj': str})
+    assert list(lista.columns) == ['cnpj', 'tipo', 'valor']
+    assert lista['cnpj'].tolist() == df['cnpj'].tolist()
+    amostrados = [int(d['cnpj']) for d in invalidos['amostra']]
+    assert amostrados == sorted(amostrados)
+    assert all(lista.loc[i, 'tipo'] == d['tipo'] for i, d in zip(amostrados, invalidos['amostra']))
+
+
+def test_consolidacao_sem_linhas():
+    df, rel = ans_integration.consolidar_e_tratar_inconsistencias([pd.DataFrame()])
+    assert df.empty
+    assert rel['linhas_processadas'] == 0
+
+
+def _arquivos_trimestre(tmp_path):
+    pasta = tmp_path / '1T2025'
+    pasta.mkdir()
+    (pasta / 'a.csv').write_text('REG_ANS;DESCRICAO;VL_SALDO_FINAL\n123;Conta A;10,5\n456;Conta B;0\n',
+                                 encoding='latin-1')
+    (pasta / 'b.txt').write_text('REG_ANS\tDESCRICAO\tVL_SALDO_FINAL\n789\tConta C\t7\n', encoding='utf-8')
+    (pasta / 'vazio.csv').write_text('', encoding='utf-8')
+    (pasta / 'c.csv').write_text('cnpj,razao_social,valor\n111,X,1.5\n', encoding='utf-8')
+    return [
+        {'caminho': pasta / nome, 'ano': '2025', 'trimestre': '1', 'nome': nome}
+        for nome in ('a.csv', 'vazio.csv', 'b.txt', 'c.csv')
+    ]
+
+
+def test_processar_arquivos_paralelo_mesma_ordem(tmp_path):
+    arquivos = _arquivos_trimestre(tmp_path)
+    sequencial = ans_integration.processar_arquivos(arquivos, workers=1)
+    paralelo = ans_integration.processar_arquivos(arquivos, workers=3)
+
+    assert len(paralelo) == len(sequencial) == 3
+    for df_par, df_seq in zip(paralelo, sequencial):
+        pd.testing.assert_frame_equal(df_par, df_seq)
+
+
+def test_streaming_gera_mesmo_csv(tmp_path, monkeypatch):
+    arquivos = _arquivos_trimestre(tmp_path)
+    pasta = arquivos[0]['caminho'].parent
+    linhas = ''.join(f'{(i * 7919) % 50};Conta {i % 3};{i % 5},0\n' for i in range(200))
+    (pasta / 'grande.csv').write_text('REG_ANS;DESCRICAO;VL_SALDO_FINAL\n' + linhas, encoding='utf-8')
+    arquivos.append({'caminho': pasta / 'grande.csv', 'ano': '2025', 'trimestre': '1', 'nome': 'grande.csv'})
+
+    saida_memoria = tmp_path / 'memoria'
+    saida_memoria.mkdir()
+    monkeypatch.setattr(ans_integration, 'OUTPUT_DIR', saida_memoria)
+    df, rel = ans_integration.consolidar_e_tratar_inconsistencias(
+        ans_integration.processar_arquivos(arquivos))
+    ans_integration.salvar_resultado_final(df, rel)
+
+    saida_streaming = tmp_path / 'streaming'
+    saida_streaming.mkdir()
+    monkeypatch.setattr(ans_integration, 'OUTPUT_DIR', saida_streaming)
+    monkeypatch.setattr(ans_integration, 'MODO_STREAMING', 'sempre')
+    ans_integration.processar_em_streaming(arquivos, tamanho_chunk=17)
+
+    csv_memoria = (saida_memoria / 'consolidado_despesas.csv').read_bytes()
+    csv_streaming = (saida_streaming / 'consolidado_despesas.csv').read_bytes()
+    assert csv_streaming == csv_memoria
+    assert [p.name for p in saida_streaming.iterdir() if p.name.startswith('runs_')] == []
+
+
+def test_streaming_descarta_arquivo_com_leitura_interrompida(tmp_path, monkeypatch):
+    arquivos = _arquivos_trimestre(tmp_path)
+    pasta = arquivos[0]['caminho'].parent
+    linhas = ''.join(f'{900 + i % 40};Conta {i % 3};{i % 5},0\n' for i in range(200))
+    (pasta / 'grande.csv').write_text('REG_ANS;DESCRICAO;VL_SALDO_FINAL\n' + linhas, encoding='utf-8')
+    grande = {'caminho': pasta / 'grande.csv', 'ano': '2025', 'trimestre': '1', 'nome': 'grande.csv'}
+
+    saida_memoria = tmp_path / 'memoria'
+    saida_memoria.mkdir()
+    monkeypatch.setattr(ans_integration, 'OUTPUT_DIR', saida_memoria)
+    df, rel = ans_integration.consolidar_e_tratar_inconsistencias(
+        ans_integration.processar_arquivos(arquivos), destino_invalidos=saida_memoria / 'valores_invalidos.csv')
+    ans_integration.salvar_resultado_final(df, rel)
+
+    # O segundo bloco de grande.csv falha: os blocos já consolidados saem da saída
+    normalizar = ans_integration.normalizar_dataframe
+
+    def normalizar_com_falha(df, verbose=True, mapeamento=None):
+        if not verbose:
+            raise OSError('conexão perdida')
+        return normalizar(df, verbose, mapeamento)
+
+    saida_streaming = tmp_path / 'streaming'
+    saida_streaming.mkdir()
+    monkeypatch.setattr(ans_integration, 'OUTPUT_DIR', saida_streaming)
+    monkeypatch.setattr(ans_integration, 'MODO_STREAMING', 'sempre')
+    monkeypatch.setattr(ans_integration, 'normalizar_dataframe', normalizar_com_falha)
+    ans_integration.processar_em_streaming(arquivos[:2] + [grande] + arquivos[2:], tamanho_chunk=17)
+
+    for nome in ('consolidado_despesas.csv', 'valores_invalidos.csv'):
+        assert (saida_streaming / nome).read_bytes() == (saida_memoria / nome).read_bytes()
+    with open(saida_streaming / 'relatorio_inconsistencias.json', encoding='utf-8') as f:
+        relatorio = json.load(f)
+    assert relatorio['linhas_processadas'] == rel['linhas_processadas']
+    assert relatorio['valores_invalidos']['por_tipo'] == rel['valores_invalidos']['por_tipo']
+
+
+def test_cache_dialetos_reaproveita_layout(tmp_path):
+    arquivos = _arquivos_trimestre(tmp_path)
+    primeira = ans_integration.processar_arquivos(arquivos)
+
+    cache = ans_integration.CacheDialetos.carregar()
+    assert len(cache.dados['assinaturas']) == 3
+    assert all(cache.buscar(info) for info in arquivos if info['nome'] != 'vazio.csv')
+
+    # Mesmo cabeçalho em outro arquivo: acerto pela assinatura
+    pasta = arquivos[0]['caminho'].parent
+    (pasta / 'd.csv').write_text('REG_ANS;DESCRICAO;VL_SALDO_FINAL\n321;Conta D;5\n', encoding='latin-1')
+    novo = {'caminho': pasta / 'd.csv', 'ano': '2025', 'trimestre': '1', 'nome': 'd.csv'}
+    assert cache.buscar(novo)['sep'] == ';'
+
+    segunda = ans_integration.processar_arquivos(arquivos)
+    for df_1, df_2 in zip(primeira, segunda):
+        pd.testing.assert_frame_equal(df_1, df_2)
+
+
+def test_cache_dialetos_recusa_encoding_incompativel(tmp_path):
+    cabecalho = 'REG_ANS;DESCRICAO;VL_SALDO_FINAL\n'
+    (tmp_path / 'utf8.csv').write_text(cabecalho + '1;Operação;2\n', encoding='utf-8')
+    (tmp_path / 'latin.csv').write_text(cabecalho + '1;Operação;2\n', encoding='latin-1')
+    cache = ans_integration.CacheDialetos()
+    cache.registrar({'caminho': tmp_path / 'utf8.csv'},
+                    {'encoding': 'utf-8', 'sep': ';', 'mapeamento': {}})
+    assert cache.buscar({'caminho': tmp_path / 'latin.csv'}) is None
+    assert (cache.acertos, cache.falhas) == (0, 1)
+
+
+def test_cache_dialetos_obsoleto_descartado_e_detectado_de_novo(tmp_path):
+    (tmp_path / 'c.csv').write_text('REG_ANS,DESCRICAO,VL_SALDO_FINAL\n123,Conta A,10.5\n', encoding='utf-8')
+    info = {'caminho': tmp_path / 'c.csv', 'ano': '2025', 'trimestre': '1', 'nome': 'c.csv'}
+    obsoleto = {'encoding': 'utf-8', 'sep': ';', 'mapeamento': {}}
+
+    # Leitura inteira: o ';' do cache dá uma coluna só
+    cache = ans_integration.CacheDialetos()
+    cache.registrar(info, obsoleto)
+    df = ans_integration.processar_arquivo(info, cache)
+    assert df['valor'].tolist() == [10.5]
+    assert cache.buscar(info)['sep'] == ','
+
+    # Leitura em blocos
+    cache = ans_integration.CacheDialetos()
+    cache.registrar(info, obsoleto)
+    blocos = list(ans_integration.ler_arquivo_em_blocos(info, 10, cache))
+    assert [len(b) for b in blocos] == [1]
+    assert cache.buscar(info)['sep'] == ','
+
+    # Worker: o descarte e o dialeto novo chegam ao cache do processo principal
+    principal = ans_integration.CacheDialetos()
+    principal.registrar(info, obsoleto)
+    worker = ans_integration.CacheDialetos(json.loads(json.dumps(principal.dados)))
+    assert ans_integration.processar_arquivo(info, worker) is not None
+    principal.aplicar(worker.delta())
+    assert principal.buscar(info)['sep'] == ','
+    assert (worker.acertos, worker.falhas) == (0, 1)
+
+
+def test_projecao_le_apenas_colunas_mapeadas(tmp_path):
+    completo = pd.DataFrame({
+        'DATA': ['2025-01-01', '2025-01-01'],
+        'REG_ANS': [123, 456],
+        'CD_CONTA_CONTABIL': [411, 412],
+        'DESCRICAO': ['Conta A', 'Conta B'],
+        'OBS': ['x' * 50, 'y' * 50],
+        'VL_SALDO_FINAL': [10.5, 0.0],
+    })
+    completo.to_csv(tmp_path / 'largo.csv', sep=';', index=False)
+    completo.to_excel(tmp_path / 'largo.xlsx', index=False)
+
+    for nome in ('largo.csv', 'largo.xlsx'):
+        info = {'caminho': tmp_path / nome, 'ano': '2025', 'trimestre': '1', 'nome': nome}
+        df = ans_integration.processar_arquivo(info)
+        assert list(df.columns) == ['cnpj', 'razao_social', 'valor', 'ano', 'trimestre']
+        assert df['cnpj'].tolist() == [123, 456]
+        assert df['razao_social'].tolist() == ['Conta A', 'Conta B']
+        assert df['valor'].tolist() == [10.5, 0.0]
+
+
+def test_csv_com_virgula_nao_lido_como_uma_coluna(tmp_path):
+    # ';' lê este cabeçalho como uma coluna só; ',' precisa vir antes
+    (tmp_path / 'virgula.csv').write_text('REG_ANS,DESCRICAO,VL_SALDO_FINAL\n123,Conta A,10.5\n456,Conta B,0\n',
+                                          encoding='utf-8')
+    info = {'caminho': tmp_path / 'virgula.csv', 'ano': '2025', 'trimestre': '1', 'nome': 'virgula.csv'}
+
+    assert next(ans_integration._separadores_candidatos(info, 'utf-8')) == ','
+    df = ans_integration.processar_arquivo(info)
+    assert df['cnpj'].tolist() == [123, 456]
+    assert df['valor'].tolist() == [10.5, 0.0]
+
+
+def test_virgula_decimal_so_no_formato_inequivoco():
+    valores = pd.Series(['1234,56', ' -7,5 ', '1.234,56', 'abc,de', '12,3,4', '10.5', None])
+    convertidos = ans_integration._virgula_decimal(valores)
+    assert convertidos[:-1].tolist() == ['1234.56', ' -7.5 ', '1.234,56', 'abc,de', '12,3,4', '10.5']
+    assert pd.isna(convertidos.iloc[-1])
+    assert valores.iloc[0] == '1234,56'
+
+    numericos = pd.Series([1.5, 2.0])
+    assert ans_integration._virgula_decimal(numericos) is numericos
+
+
+def test_valor_com_virgula_decimal_mantido_na_consolidacao(tmp_path):
+    (tmp_path / 'contabil.csv').write_text(
+        'REG_ANS;DESCRICAO;VL_SALDO_FINAL\n123;Conta A;1234,56\n456;Conta B;1.234,56\n789;Conta C;abc\n',
+        encoding='latin-1')
+    info = {'caminho': tmp_path / 'contabil.csv', 'ano': '2025', 'trimestre': '1', 'nome': 'contabil.csv'}
+
+    df = ans_integration.processar_arquivo(info)
+    assert df['valor'].tolist() == ['1234.56', '1.234,56', 'abc']
+    consolidado, relatorio = ans_integration.consolidar_e_tratar_inconsistencias([df])
+    assert consolidado['ValorDespesas'].tolist() == [1234.56]
+    assert relatorio['linhas_removidas'] == 2
+
+
+def test_incremental_reaproveita_parciais(tmp_path, monkeypatch):
+    arquivos = _arquivos_trimestre(tmp_path)
+    monkeypatch.setattr(ans_integration, 'INCREMENTAL_DIR', tmp_path / 'incremental')
+
+    completo = tmp_path / 'completo'
+    completo.mkdir()
+    monkeypatch.setattr(ans_integration, 'OUTPUT_DIR', completo)
+    df, rel = ans_integration.consolidar_e_tratar_inconsistencias(
+        ans_integration.processar_arquivos(arquivos),
+        destino_invalidos=completo / 'valores_invalidos.csv')
+    ans_integration.salvar_resultado_final(df, rel)
+
+    incremental = tmp_path / 'saida'
+    incremental.mkdir()
+    monkeypatch.setattr(ans_integration, 'OUTPUT_DIR', incremental)
+    metricas = metricas_pipeline.MetricasExecucao('incremental')
+    monkeypatch.setattr(metricas_pipeline, '_ativa', metricas)
+    ans_integration.processar_incremental(arquivos)
+    csv_path = incremental / 'consolidado_despesas.csv'
+    # Contagens por arquivo, como nos modos completo e streaming
+    por_arquivo = {a['arquivo']: a for a in metricas.arquivos}
+    assert por_arquivo['a.csv']['linhas_entrada'] == 2 and por_arquivo['vazio.csv']['linhas_saida'] == 0
+    assert (sum(a['linhas_saida'] for a in metricas.arquivos)
+            == len(pd.read_csv(csv_path, encoding='utf-8-sig')))
+    assert csv_path.read_bytes() == (completo / 'consolidado_despesas.csv').read_bytes()
+    assert ((incremental / 'valores_invalidos.csv').read_bytes()
+            == (completo / 'valores_invalidos.csv').read_bytes())
+    with open(incremental / 'relatorio_inconsistencias.json', encoding='utf-8') as f:
+        assert json.load(f)['valores_invalidos']['por_tipo'] == rel['valores_invalidos']['por_tipo']
+
+    # Reexecução sem mudanças: nada é lido nem reescrito
+    mtime = csv_path.stat().st_mtime_ns
+    monkeypatch.setattr(ans_integration, '_processar_parcial',
+                        lambda *args, **kwargs: pytest.fail('arquivo reprocessado'))
+    ans_integration.processar_incremental(arquivos)
+    assert csv_path.stat().st_mtime_ns == mtime
+    monkeypatch.undo()
+
+    # Um arquivo alterado: só ele é reprocessado e a saída é atualizada
+    monkeypatch.setattr(ans_integration, 'CACHE_DIALETOS_PATH', tmp_path / 'cache' / 'dialetos.json')
+    monkeypatch.setattr(ans_integration, 'INCREMENTAL_DIR', tmp_path / 'incremental')
+    monkeypatch.setattr(ans_integration, 'OUTPUT_DIR', incremental)
+    with open(arquivos[0]['caminho'], 'a', encoding='latin-1') as f:
+        f.write('222;Conta Y;3\n')
+    processados = []
+    original = ans_integration._processar_parcial
+    monkeypatch.setattr(ans_integration, '_processar_parcial',
+                        lambda info, *args: processados.append(info['nome']) or original(info, *args))
+    ans_integration.processar_incremental(arquivos)
+    assert processados == ['a.csv']
+    assert '222' in csv_path.read_text(encoding='utf-8-sig')
+
+
+def test_zip_lido_sem_extracao(tmp_path, monkeypatch):
+    import zipfile
+
+    soltos = _arquivos_trimestre(tmp_path)
+    downloads = tmp_path / 'downloads'
+    downloads.mkdir()
+    with zipfile.ZipFile(downloads / '1T2025.zip', 'w', zipfile.ZIP_DEFLATED) as zf:
+        for info in soltos:
+            zf.write(info['caminho'], f"dados/{info['nome']}")
+    monkeypatch.setattr(ans_integration, 'DOWNLOAD_DIR', downloads)
+    monkeypatch.setattr(ans_integration, 'DADOS_LOCAIS_DIR', tmp_path / 'nada')
+
+    membros = ans_integration.preparar_arquivos_locais([('2025', '1')])
+    assert sorted(info['membro'] for info in membros) == sorted(f"dados/{i['nome']}" for i in soltos)
+    membros.sort(key=lambda info: [i['nome'] for i in soltos].index(info['nome']))
+
+    esperado = ans_integration.processar_arquivos(soltos, workers=1)
+    obtido = ans_integration.processar_arquivos(membros, workers=1)
+    assert len(obtido) == len(esperado)
+    for df_zip, df_solto in zip(obtido, esperado):
+        pd.testing.assert_frame_equal(df_zip, df_solto)
+    assert not list(downloads.glob('dados*'))
+
+
+def test_trimestre_em_pasta_e_zip_localizado_uma_vez(tmp_path, monkeypatch):
+    import zipfile
+
+    soltos = _arquivos_trimestre(tmp_path)
+    pasta = soltos[0]['caminho'].parent
+    downloads = tmp_path / 'downloads'
+    downloads.mkdir()
+    # O mesmo trimestre baixado (ANS_BAIXAR=1), já extraído e com o ZIP ao lado
+    for destino in (downloads / '1T2025.zip', pasta / '1T2025.zip'):
+        with zipfile.ZipFile(destino, 'w', zipfile.ZIP_DEFLATED) as zf:
+            for info in soltos:
+                zf.write(info['caminho'], f"dados/{info['nome']}")
+            zf.writestr('dados/extra.csv', 'cnpj,razao_social,valor\n555,Z,2\n')
+    monkeypatch.setattr(ans_integration, 'DOWNLOAD_DIR', downloads)
+    monkeypatch.setattr(ans_integration, 'DADOS_LOCAIS_DIR', tmp_path)
+
+    localizados = ans_integration.preparar_arquivos_locais([('2025', '1')])
+    assert sorted(info['nome'] for info in localizados) == sorted(
+        [info['nome'] for info in soltos] + ['extra.csv'])
+    assert all('membro' not in info for info in localizados if info['nome'] != 'extra.csv')
+
+
+def test_parquet_particionado_por_trimestre(tmp_path, monkeypatch):
+    pytest.importorskip('pyarrow')
+    import saida_colunar
+
+    monkeypatch.setattr(ans_integration, 'OUTPUT_DIR', tmp_path)
+    df, _ = ans_integration.consolidar_e_tratar_inconsistencias(_dataframes_sujos())
+    csv_path = tmp_path / 'consolidado_despesas.csv'
+    df.to_csv(csv_path, index=False, encoding='utf-8-sig')
+
+    for origem in (df, None):
+        parquet_path = ans_integration.salvar_parquet_consolidado(csv_path, origem)
+        assert sorted(p.name for p in parquet_path.iterdir()) == ['Ano=2024', 'Ano=2025']
+
+        lido = saida_colunar.ler_parquet(parquet_path, colunas=['CNPJ', 'ValorDespesas'],
+                                         anos=['2025'], trimestres=['1'])
+        esperado = df[(df['Ano'] == '2025') & (df['Trimestre'] == '01')]
+        assert list(lido.columns) == ['CNPJ', 'ValorDespesas']
+        assert lido['ValorDespesas'].dtype == 'float64'
+        assert sorted(lido['CNPJ']) == sorted(esperado['CNPJ'])
+
+
+def test_main_grava_metricas_por_etapa_e_arquivo(tmp_path, monkeypatch):
+    _arquivos_trimestre(tmp_path)
+    saida = tmp_path / 'output'
+    saida.mkdir()
+    monkeypatch.setattr(ans_integration, 'DADOS_LOCAIS_DIR', tmp_path)
+    monkeypatch.setattr(ans_integration, 'DOWNLOAD_DIR', tmp_path / 'downloads')
+    monkeypatch.setattr(ans_integration, 'OUTPUT_DIR', saida)
+    monkeypatch.setattr(ans_integration, 'MODO_INCREMENTAL', False)
+    monkeypatch.setattr(ans_integration, 'MODO_STREAMING', 'nunca')
+
+    ans_integration.main()
+
+    with open(saida / 'metricas_execucao.json', encoding='utf-8') as f:
+        metricas = json.load(f)
+    etapas = {e['etapa']: e for e in metricas['etapas']}
+    assert list(etapas) == ['passo_1_trimestres', 'passo_2_localizar_arquivos',
+                            'passo_3_processar_arquivos', 'passo_4_consolidar', 'passo_5_salvar']
+    assert etapas['passo_3_processar_arquivos']['linhas_entrada'] == 4
+    consolidado = pd.read_csv(saida / 'consolidado_despesas.csv', encoding='utf-8-sig')
+    assert etapas['passo_4_consolidar']['linhas_saida'] == len(consolidado)
+    assert all(e['segundos'] >= 0 and e['pico_rss_bytes'] for e in metricas['etapas'])
+    arquivos = {a['arquivo']: a for a in metricas['arquivos']}
+    assert sorted(arquivos) == ['a.csv', 'b.txt', 'c.csv', 'vazio.csv']
+    assert arquivos['a.csv']['linhas_entrada'] == 2
+    assert arquivos['vazio.csv']['linhas_saida'] == 0
+    assert metricas['erro'] is None
+
+    # Erro no meio da execução: main não propaga, mas marca a falha nas métricas
+    monkeypatch.setattr(ans_integration, 'consolidar_e_tratar_inconsistencias',
+                        lambda *args, **kwargs: 1 / 0)
+    ans_integration.main()
+    with open(saida / 'metricas_execucao.json', encoding='utf-8') as f:
+        assert json.load(f)['erro'] == 'ZeroDivisionError: division by zero'
@@ -39,7 +39,7 @@ def test_list_operadoras():
         {"cnpj": "123", "razao_social": "A SA", "nome_fantasia": "A", "uf": "SP"},
         {"cnpj": "456", "razao_social": "B SA", "nome_fantasia": "B", "uf": "RJ"},
     ]
-    with patch('backend.main.get_conn', return_value=MockConn(fetchone_result=fetchone, fetchall_result=fetchall)):
+    with patch('backend.repository.Psycopg2Repository.connection', return_value=MockConn(fetchone_result=fetchone, fetchall_result=fetchall)):
         client = TestClient(app)
         r = client.get('/api/operadoras?page=1&limit=10')
         assert r.status_code == 200
@@ -50,7 +50,7 @@ def test_list_operadoras():
 
 def test_get_operadora_found():
     fetchone = {"cnpj": "123", "razao_social": "A SA", "uf": "SP"}
-    with patch('backend.main.get_conn', return_value=MockConn(fetchone_result=fetchone)):
+    with patch('backend.repository.Psycopg2Repository.connection', return_value=MockConn(fetchone_result=fetchone)):
         client = TestClient(app)
         r = client.get('/api/operadoras/123')
         assert r.status_code == 200
@@ -59,7 +59,7 @@ def test_get_operadora_found():
 
 
 def test_get_operadora_not_found():
-    with patch('backend.main.get_conn', return_value=MockConn(fetchone_result=None)):
+    with patch('backend.repository.Psycopg2Repository.connection', return_value=MockConn(fetchone_result=None)):
         client = TestClient(app)
         r = client.get('/api/operadoras/000')
         assert r.status_code == 404
@@ -70,7 +70,7 @@ def test_operadora_despesas():
         {"trimestre_date": "2025-01-01", "despesa_total": "1000.00"},
         {"trimestre_date": "2025-04-01", "despesa_total": "1200.00"},
     ]
-    with patch('backend.main.get_conn', return_value=MockConn(fetchall_result=fetchall)):
+    with patch('backend.repository.Psycopg2Repository.connection', return_value=MockConn(fetchall_result=fetchall)):
         client = TestClient(app)
         r = client.get('/api/operadoras/123/despesas')
         assert r.status_code == 200
@@ -83,7 +83,7 @@ def test_estatisticas():
     # prepare totals (fetchone) and top5 (fetchall)
     totals = {"total": 2200, "media": 1100}
     top5 = [{"cnpj": "123", "total": 1500}, {"cnpj": "456", "total": 700}]
-    with patch('backend.main.get_conn', return_value=MockConn(fetchone_result=totals, fetchall_result=top5)):
+    with patch('backend.repository.Psycopg2Repository.connection', return_value=MockConn(fetchone_result=totals, fetchall_result=top5)):
         client = TestClient(app)
         r = client.get('/api/estatisticas')
         assert r.status_code == 200
@@ -0,0 +1,118 @@
+import threading
+import time
+from unittest.mock import patch
+
+import pytest
+from fastapi.testclient import TestClient
+
+import backend.main
+from backend.main import app
+from backend import repository
+from backend.pool import ConnectionPool, PoolTimeout
+
+
+class FakeConn:
+    def __init__(self, number):
+        self.number = number
+        self.closed = 0
+        self.broken = False
+        self.log = []
+
+    def cursor(self):
+        conn = self
+
+        class Cursor:
+            def execute(self, sql):
+                if conn.broken:
+                    raise RuntimeError('server closed the connection')
+
+            def fetchone(self):
+                return (1,)
+        return Cursor()
+
+    def commit(self):
+        self.log.append('commit')
+
+    def rollback(self):
+        self.log.append('rollback')
+
+    def close(self):
+        self.closed = 1
+
+
+def _pool(**kwargs):
+    created = []
+
+    def connect():
+        created.append(FakeConn(len(created)))
+        return created[-1]
+    return ConnectionPool(connect, **kwargs), created
+
+
+def test_connections_reused_with_commit_and_rollback():
+    pool, created = _pool(min_size=2, max_size=3)
+    pool.open()
+    assert len(created) == 2 and pool.stats()['idle'] == 2
+
+    with pool.connection() as conn:
+        assert pool.stats()['in_use'] == 1
+    with pool.connection() as again:
+        pass
+    assert again is conn and conn.log == ['commit', 'commit']
+
+    with pytest.raises(ValueError):
+        with pool.connection() as conn:
+            raise ValueError('query failed')
+    assert conn.log[-1] == 'rollback'
+    assert len(created) == 2 and pool.stats()['in_use'] == 0
+
+    pool.close()
+    assert all(c.closed for c in created)
+    with pytest.raises(PoolTimeout):
+        pool.acquire()
+
+
+def test_wait_and_timeout_when_pool_is_full():
+    pool, created = _pool(min_size=0, max_size=1, acquire_timeout=0.05)
+    conn = pool.acquire()
+    with pytest.raises(PoolTimeout):
+        pool.acquire()
+
+    threading.Timer(0.05, pool.release, args=[conn]).start()
+    assert pool.acquire(timeout=2) is conn
+    stats = pool.stats()
+    assert stats['timeouts'] == 1 and stats['waits'] == 1
+    assert stats['max_wait_seconds'] >= 0.04 and stats['avg_wait_seconds'] > 0
+    assert len(created) == 1
+
+
+def test_broken_and_old_connections_replaced():
+    pool, created = _pool(min_size=1, max_size=2, health_check_after=0)
+    pool.open()
+    created[0].broken = True
+    with pool.connection() as conn:
+        assert conn is created[1]
+    assert created[0].closed and pool.stats()['health_check_failures'] == 1
+
+    pool.max_lifetime = 0
+    time.sleep(0.01)
+    with pool.connection() as conn:
+        pass
+    assert conn.closed and pool.stats()['recycled'] >= 1
+    assert pool.stats()['size'] == 0
+
+
+def test_stats_endpoint_and_503_without_connection(monkeypatch):
+    pool, _ = _pool(min_size=1, max_size=4)
+    repo = repository.Psycopg2Repository(backend.main.DB_PARAMS)
+    repo._pool = pool
+    monkeypatch.setattr(backend.main, '_repository', repo)
+    with TestClient(app) as client:
+        stats = client.get('/api/pool').json()
+        assert stats['max_size'] == 4 and stats['idle'] == 1 and stats['in_use'] == 0
+
+        with patch('backend.repository.Psycopg2Repository.connection', side_effect=PoolTimeout('no connection')):
+            r = client.get('/api/operadoras/123')
+        assert r.status_code == 503 and r.headers['Retry-After'] == '1'
+    # Shutdown closes the pool
+    assert repo._pool is None and pool.stats()['closed']
@@ -0,0 +1,329 @@
+import asyncio
+import base64
+import re
+import time
+import types
+import unicodedata
+from unittest.mock import patch
+
+import pytest
+from fastapi.testclient import TestClient
+
+import backend.main
+from backend import repository
+from backend.main import app
+
+
+def test_placeholders_numbered_for_asyncpg():
+    assert repository.numbered("SELECT 1 WHERE a = %s OR b = %s LIMIT %s") == \
+        "SELECT 1 WHERE a = $1 OR b = $2 LIMIT $3"
+    assert repository.numbered(repository.SQL['totals']) == repository.SQL['totals']
+
+
+class SlowConn:
+    """Connection with slow queries; records how many run at the same time."""
+    running = 0
+    peak = 0
+
+    def cursor(self):
+        return self
+
+    def execute(self, sql, params=None):
+        self.sql = sql
+        SlowConn.running += 1
+        SlowConn.peak = max(SlowConn.peak, SlowConn.running)
+        time.sleep(0.2)
+        SlowConn.running -= 1
+
+    def fetchone(self):
+        return {"total": 10, "media": 5}
+
+    def fetchall(self):
+        return [{"cnpj": "123", "total": 10}]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+def test_estatisticas_runs_both_queries_concurrently():
+    SlowConn.peak = 0
+    with patch('backend.repository.Psycopg2Repository.connection', side_effect=lambda: SlowConn()):
+        client = TestClient(app)
+        start = time.perf_counter()
+        r = client.get('/api/estatisticas?force=true')
+        elapsed = time.perf_counter() - start
+    assert r.status_code == 200 and r.json()['top5'] == [{"cnpj": "123", "total": 10}]
+    assert SlowConn.peak == 2 and elapsed < 0.38
+
+
+class FakeAsyncpgPool:
+    def __init__(self, rows, conn=None):
+        self.rows = rows
+        self.conn = conn  # acquired connection; the pool answers queries itself by default
+        self.queries = []
+        self.released = 0
+        self.expired = 0
+
+    async def acquire(self, timeout=None):
+        return self.conn or self
+
+    async def release(self, conn):
+        self.released += 1
+
+    async def fetch(self, sql, *params):
+        self.queries.append((sql, params))
+        return self.rows
+
+    async def fetchrow(self, sql, *params):
+        self.queries.append((sql, params))
+        return self.rows[0] if self.rows else None
+
+    async def expire_connections(self):
+        self.expired += 1
+
+    async def close(self):
+        pass
+
+
+def test_asyncpg_repository(monkeypatch):
+    pool = FakeAsyncpgPool([{"count": 1, "cnpj": "123", "razao_social": "A SA"}])
+
+    async def create_pool(**kwargs):
+        assert kwargs['database'] == 'desafio' and kwargs['max_size'] == 3
+        assert 'max_inactive_connection_lifetime' not in kwargs
+        return pool
+    monkeypatch.setattr(repository, 'asyncpg', types.SimpleNamespace(create_pool=create_pool))
+    repo = repository.AsyncpgRepository(backend.main.DB_PARAMS, max_size=3)
+
+    async def query():
+        await repo.open()
+        return (await repo.page_operadoras(10, 'a sa'), await repo.count_operadoras('a sa'),
+                await repo.get_operadora('123'))
+    (rows, more), (total, source), operadora = asyncio.run(query())
+
+    assert total == 1 and source == 'exact' and not more
+    assert rows[0]['cnpj'] == '123' and operadora['razao_social'] == 'A SA'
+    assert (repository.numbered(repository.SQL['count_search']), ('a sa', 'a sa', None)) in pool.queries
+    assert pool.released == 3 and pool.expired == 0
+
+    # Max lifetime: connections older than the deadline are replaced by the pool
+    repo._expired_at -= repo._max_lifetime + 1
+    asyncio.run(repo.totals())
+    assert pool.expired == 1
+    asyncio.run(repo.totals())
+    assert pool.expired == 1
+
+
+def test_repository_requires_driver_queries():
+    class WithoutFetch(repository.Repository):
+        async def pool_stats(self):
+            return {}
+
+    with pytest.raises(TypeError, match='fetch'):
+        WithoutFetch()
+
+
+class FakeAsyncpgConnection:
+    """asyncpg-style connection: $n placeholders only, one argument per placeholder."""
+
+    def __init__(self):
+        self.queries = []
+
+    def _check(self, sql, params):
+        assert '%s' not in sql and '%%' not in sql, sql
+        numbers = sorted({int(n) for n in re.findall(r'\$(\d+)', sql)})
+        assert numbers == list(range(1, len(params) + 1)), (sql, params)
+        self.queries.append((sql, params))
+
+    async def fetch(self, sql, *params):
+        self._check(sql, params)
+        return [{'cnpj': '12345678000190', 'razao_social': 'A SA', 'count': 1}]
+
+    async def fetchrow(self, sql, *params):
+        self._check(sql, params)
+        return {'cnpj': '12345678000190', 'count': 1, 'total': 10, 'media': 5}
+
+
+def test_asyncpg_driver_runs_numbered_sql(monkeypatch):
+    conn = FakeAsyncpgConnection()
+    pool = FakeAsyncpgPool([], conn)
+
+    async def create_pool(**kwargs):
+        return pool
+    # The pinned asyncpg is imported; only the network pool is replaced
+    assert repository.asyncpg is not None
+    monkeypatch.setattr(repository.asyncpg, 'create_pool', create_pool)
+    repo = repository.AsyncpgRepository(backend.main.DB_PARAMS)
+
+    async def run():
+        await repo.page_operadoras(5)
+        await repo.page_operadoras(5, after=('A SA', '1'))
+        await repo.page_operadoras(5, before=('B SA', '2'))
+        await repo.page_operadoras(5, q='50% a_b')
+        await repo.count_operadoras('50% a_b', exact=True)
+        await repo.get_operadora('12.345.678/0001-90')
+        await repo.despesas('12.345.678/0001-90')
+        await repo.totals()
+    asyncio.run(run())
+
+    assert len(conn.queries) == 8 and pool.released == 8
+    sql, params = conn.queries[1]
+    assert sql == ("SELECT cnpj, razao_social, nome_fantasia, uf FROM operadoras "
+                   "WHERE (razao_social, cnpj) > ($1, $2) ORDER BY razao_social, cnpj LIMIT $3 OFFSET $4")
+    assert params == ('A SA', '1', 6, 0)
+    search_sql, search_params = conn.queries[3]
+    assert "LIKE '%' || lower(f_unaccent($1)) || '%'" in search_sql
+    assert search_params[:3] == ('50\\% a\\_b', '50% a_b', '%50%')
+    assert conn.queries[5] == (repository.numbered(repository.SQL['operadora']), ('12345678000190',))
+
+
+def _unaccented(text):
+    return unicodedata.normalize('NFKD', text).encode('ascii', 'ignore').decode('ascii').lower()
+
+
+def _key(row):
+    return row['razao_social'], row['cnpj']
+
+
+class MemoryRepository(repository.Repository):
+    """Runs the named queries of repository.SQL over an in-memory list."""
+
+    def __init__(self, rows):
+        super().__init__()
+        self.rows = sorted(rows, key=_key)
+        self.queries = []
+
+    async def pool_stats(self):
+        return {'driver': 'memory'}
+
+    def _filter(self, name, params):
+        rows = self.rows
+        if 'search' in name:
+            # Accent/case-insensitive substring of razao_social or CNPJ digits (no pg_trgm)
+            _, term, cnpj_pattern = params[:3]
+            params = params[5:] if name == 'page_search' else params[3:]
+            term = _unaccented(term)
+            digits = cnpj_pattern.strip('%') if cnpj_pattern else None
+            rows = [r for r in rows if term in _unaccented(r['razao_social'])
+                    or digits and digits in r['cnpj']]
+            rows.sort(key=lambda r: not (digits and digits in r['cnpj']))
+        return rows, params
+
+    async def fetch(self, name, *params):
+        self.queries.append(name)
+        rows, (*key, limit, offset) = self._filter(name, params)
+        if name.endswith('_after'):
+            rows = [r for r in rows if _key(r) > tuple(key)]
+        elif name.endswith('_before'):
+            rows = [r for r in rows if _key(r) < tuple(key)][::-1]
+        return rows[offset:offset + limit]
+
+    async def fetch_one(self, name, *params):
+        self.queries.append(name)
+        if name == 'estimate_operadoras':
+            return {'count': -1}
+        return {'count': len(self._filter(name, params)[0])}
+
+
+def test_cursor_pagination_forward_and_back(monkeypatch):
+    rows = [{'cnpj': f'{i:014d}', 'razao_social': f'OPERADORA {i % 7}', 'nome_fantasia': None, 'uf': 'SP'}
+            for i in range(23)]
+    repo = MemoryRepository(rows)
+    monkeypatch.setattr(backend.main, '_repository', repo)
+    client = TestClient(app)
+
+    pages = [client.get('/api/operadoras?limit=5').json()]
+    while pages[-1]['next_cursor']:
+        pages.append(client.get(f"/api/operadoras?limit=5&cursor={pages[-1]['next_cursor']}").json())
+    assert [p['page'] for p in pages] == [1, 2, 3, 4, 5]
+    assert [r['cnpj'] for p in pages for r in p['data']] == [r['cnpj'] for r in repo.rows]
+    assert pages[0]['prev_cursor'] is None
+    # Same pages as by page number (OFFSET), which still works
+    assert client.get('/api/operadoras?limit=5&page=3').json()['data'] == pages[2]['data']
+    assert 'page_operadoras_after' in repo.queries
+
+    back = client.get(f"/api/operadoras?limit=5&cursor={pages[-1]['prev_cursor']}").json()
+    assert back['page'] == 4 and back['data'] == pages[3]['data']
+    first = client.get(f"/api/operadoras?limit=5&cursor={pages[1]['prev_cursor']}").json()
+    assert first['data'] == pages[0]['data'] and first['prev_cursor'] is None
+
+    assert client.get('/api/operadoras?cursor=invalid').status_code == 400
+    # Valid JSON that is not a cursor: 5, null, short list, bool page
+    for payload in (b'5', b'null', b'[2, "A", "1"]', b'[true, null, null, "next"]'):
+        cursor = base64.urlsafe_b64encode(payload).decode('ascii').rstrip('=')
+        assert client.get(f'/api/operadoras?cursor={cursor}').status_code == 400, payload
+    assert client.get('/api/operadoras?cursor=NQ').status_code == 400
+
+
+def test_cached_total_with_optional_exact_count(monkeypatch):
+    repo = MemoryRepository([{'cnpj': str(i), 'razao_social': f'OP {i}', 'nome_fantasia': None, 'uf': 'RJ'}
+                             for i in range(12)])
+    monkeypatch.setattr(backend.main, '_repository', repo)
+    client = TestClient(app)
+
+    assert client.get('/api/operadoras?q=op 1').json()['total_source'] == 'exact'
+    repo.rows = [r for r in repo.rows if r['cnpj'] != '11']
+    r = client.get('/api/operadoras?q=op 1').json()
+    assert r['total_source'] == 'cached' and r['total'] == 3
+    r = client.get('/api/operadoras?q=op 1&exact_count=true').json()
+    assert r['total_source'] == 'exact' and r['total'] == 2
+    assert repo.queries.count('count_search') == 2
+
+    async def estimate(name, *params):
+        return {'count': 5000}
+    monkeypatch.setattr(repo, 'fetch_one', estimate)
+    r = client.get('/api/operadoras').json()
+    assert r['total_source'] == 'estimate' and r['total'] == 5000
+
+
+def test_accent_insensitive_search_paged_by_offset(monkeypatch):
+    names = ['SAÚDE TOTAL', 'Saude Vida', 'ODONTO SAUDE', 'AMIL', 'UNIMED']
+    repo = MemoryRepository([{'cnpj': f'1122233300{i:04d}', 'razao_social': name, 'nome_fantasia': None, 'uf': 'SP'}
+                             for i, name in enumerate(names)])
+    monkeypatch.setattr(backend.main, '_repository', repo)
+    client = TestClient(app)
+
+    first = client.get('/api/operadoras?q=saúde&limit=2').json()
+    assert first['total'] == 3 and len(first['data']) == 2
+    second = client.get(f"/api/operadoras?q=saúde&limit=2&cursor={first['next_cursor']}").json()
+    assert second['page'] == 2 and second['next_cursor'] is None
+    assert {r['razao_social'] for r in first['data'] + second['data']} == {'SAÚDE TOTAL', 'Saude Vida', 'ODONTO SAUDE'}
+    assert 'page_search' in repo.queries and not any(q.endswith(('_after', '_before')) for q in repo.queries)
+
+    # Search by formatted CNPJ: only its digits are compared, and CNPJ hits come first
+    r = client.get('/api/operadoras?q=000.04').json()
+    assert [row['razao_social'] for row in r['data']] == ['UNIMED']
+
+
+def test_search_params():
+    assert repository.search_params('50%_a') == ('50\\%\\_a', '50%_a', '%50%')
+    assert repository.search_params('amil')[2] is None
+    assert '%%' not in repository.numbered(repository.SQL['page_search'])
+
+
+def test_cnpj_normalized_before_query():
+    executed = []
+
+    class Conn(SlowConn):
+        def execute(self, sql, params=None):
+            executed.append((sql, params))
+
+        def fetchone(self):
+            return {"cnpj": "12345678000190"}
+
+    with patch('backend.repository.Psycopg2Repository.connection', side_effect=lambda: Conn()):
+        client = TestClient(app)
+        assert client.get('/api/operadoras/12.345.678.0001-90').status_code == 200
+        assert client.get('/api/operadoras/12.345.678-0001.90/despesas').status_code == 200
+        assert client.get('/api/operadoras/abc').status_code == 404
+        # Official format, with the slash literal or encoded (%2F)
+        assert client.get('/api/operadoras/12.345.678/0001-90').status_code == 200
+        assert client.get('/api/operadoras/12.345.678/0001-90/despesas').status_code == 200
+        assert client.get('/api/operadoras/12.345.678%2F0001-90').status_code == 200
+        assert client.get('/api/operadoras/12.345.678%2F0001-90/despesas').status_code == 200
+    assert executed == [(repository.SQL['operadora'], ('12345678000190',)),
+                          (repository.SQL['despesas'], ('12345678000190',))] * 3
+    assert 'regexp_replace' not in repository.SQL['operadora'] + repository.SQL['despesas']
@@ -0,0 +1,71 @@
+"""Query plans on the PostgreSQL at DB_HOST/DB_NAME/...; skipped without a database."""
+import json
+import os
+import re
+from pathlib import Path
+
+import pytest
+
+psycopg2 = pytest.importorskip('psycopg2')
+
+from backend import repository
+from backend.main import DB_PARAMS
+
+SCRIPT = Path(__file__).resolve().parents[1] / 'sql' / 'teste3_sql_scripts.sql'
+
+
+@pytest.fixture
+def cur():
+    try:
+        conn = psycopg2.connect(connect_timeout=3, **DB_PARAMS)
+    except psycopg2.OperationalError as e:
+        pytest.skip(f"PostgreSQL unavailable: {e}")
+    schema = f"test_plans_{os.getpid()}"
+    cur = conn.cursor()
+    cur.execute(f"CREATE SCHEMA {schema}")
+    cur.execute(f"SET search_path TO {schema}")
+    try:
+        yield cur
+    finally:
+        conn.rollback()
+        cur.execute(f"DROP SCHEMA IF EXISTS {schema} CASCADE")
+        conn.commit()
+        conn.close()
+
+
+def _ddl(table):
+    """CREATE TABLE and CREATE INDEX statements of `table` as in the SQL script."""
+    text = SCRIPT.read_text(encoding='utf-8')
+    table_sql = re.search(rf"CREATE TABLE IF NOT EXISTS {table} \(.*?\n\);", text, re.S).group()
+    indexes = re.findall(rf"CREATE INDEX IF NOT EXISTS \w+ ON {table}\(.*?\);", text)
+    return [table_sql, *indexes]
+
+
+def _plan(cur, name, *params):
+    cur.execute("EXPLAIN (FORMAT JSON) " + repository.SQL[name], params)
+    plan = cur.fetchone()[0]
+    return json.dumps(plan if not isinstance(plan, str) else json.loads(plan))
+
+
+def test_cnpj_queries_use_index(cur):
+    for statement in _ddl('operadoras') + _ddl('consolidado_despesas'):
+        cur.execute(statement)
+    cur.execute("""
+        INSERT INTO operadoras(cnpj, razao_social, uf)
+        SELECT lpad(i::text, 14, '0'), 'OPERADORA ' || i, 'SP' FROM generate_series(1, 20000) i;
+        INSERT INTO consolidado_despesas(cnpj, uf, trimestre_date, despesa_total)
+        SELECT lpad((i % 20000 + 1)::text, 14, '0'), 'SP', date '2025-01-01' + (i % 3) * interval '3 months', i
+        FROM generate_series(1, 60000) i;
+        ANALYZE operadoras;
+        ANALYZE consolidado_despesas;
+    """)
+    cnpj = repository.normalize_cnpj('00.000.000/0123-45')
+
+    plan = _plan(cur, 'operadora', cnpj)
+    assert 'Seq Scan' not in plan and 'operadoras_pkey' in plan
+    plan = _plan(cur, 'despesas', cnpj)
+    assert 'Seq Scan' not in plan and 'idx_consolidado_cnpj_trimestre' in plan
+
+    # Formatted CNPJs are rejected by the table
+    with pytest.raises(psycopg2.errors.CheckViolation):
+        cur.execute("INSERT INTO operadoras(cnpj, razao_social) VALUES ('12.345.678/0001-90', 'X')")
@@ -0,0 +1,107 @@
+import json
+
+import pandas as pd
+import pytest
+
+from benchmarks import executar, gerar_dados
+
+
+def test_gerador_mistura_formatos_e_sujeira(tmp_path):
+    manifesto = gerar_dados.gerar(tmp_path, 3000, linhas_xlsx=40, tamanho_bloco=700)
+
+    assert manifesto['trimestres'] == ['1T2025', '2T2025', '3T2025']
+    assert sum(a['linhas'] for a in manifesto['arquivos']) == 3000
+    assert 0.9 * 3000 < manifesto['linhas_validas'] < 3000
+    nomes = {p.name for p in (tmp_path / '1T2025').iterdir()}
+    assert nomes == {'1T2025.csv', 'despesas_1T2025.txt', 'eventos_1T2025.csv', 'sinistros_1T2025.xlsx'}
+
+    ans = pd.read_csv(tmp_path / '1T2025' / '1T2025.csv', sep=';', encoding='latin-1', dtype=str)
+    assert len(ans) == 600
+    assert ans['VL_SALDO_FINAL'].str.contains(',').any()
+    assert ans['REG_ANS'].isna().any()
+    with open(tmp_path / '1T2025' / '1T2025.csv', 'rb') as f:
+        conteudo = f.read()
+    assert 'SAÚDE'.encode('latin-1') in conteudo or 'MÉDICA'.encode('latin-1') in conteudo
+
+    txt = pd.read_csv(tmp_path / '1T2025' / 'despesas_1T2025.txt', sep='\t', dtype=str)
+    assert set(txt['TRIMESTRE']) == {'Q1'} and set(txt['ANO']) == {'25'}
+    valores = pd.to_numeric(txt['VALOR_DESPESA'], errors='coerce')
+    assert (valores == 0).any() and (valores < 0).any()
+    assert txt['CNPJ'].str.contains('/', na=False).any()
+
+    assert len(pd.read_excel(tmp_path / '1T2025' / 'sinistros_1T2025.xlsx')) == 40
+    cadastro = pd.read_csv(tmp_path / 'cadastro_operadoras.csv', dtype=str)
+    assert cadastro['CNPJ'].duplicated().any()
+
+    # Mesma semente, mesmos dados
+    outra = tmp_path / 'outra'
+    gerar_dados.gerar(outra, 3000, linhas_xlsx=40, tamanho_bloco=700)
+    assert ((outra / '2T2025' / 'despesas_2T2025.txt').read_bytes()
+            == (tmp_path / '2T2025' / 'despesas_2T2025.txt').read_bytes())
+
+
+def test_interpretar_tamanho():
+    assert gerar_dados.interpretar_tamanho('100k') == 100_000
+    assert gerar_dados.interpretar_tamanho('50m') == 50_000_000
+    assert gerar_dados.interpretar_tamanho('2.5k') == 2500
+    assert gerar_dados.interpretar_tamanho('1234') == 1234
+
+
+def test_conferir_linhas_recusa_execucao_que_perdeu_linhas(tmp_path):
+    (tmp_path / 'output').mkdir()
+    with open(tmp_path / 'manifesto_benchmark.json', 'w', encoding='utf-8') as f:
+        json.dump({'linhas': 100, 'linhas_validas': 90}, f)
+
+    def relatorios(linhas_finais, lidas_transformacao):
+        with open(tmp_path / 'output' / executar.RELATORIO_CONSOLIDACAO, 'w', encoding='utf-8') as f:
+            json.dump({'linhas_processadas': 100, 'linhas_finais': linhas_finais}, f)
+        with open(tmp_path / 'output' / executar.RELATORIO_TRANSFORMACAO, 'w', encoding='utf-8') as f:
+            json.dump({'rows_read_approx_chunked': lidas_transformacao}, f)
+
+    relatorios(90, 90)
+    executar.conferir_linhas('ans_integration', tmp_path)
+    executar.conferir_linhas('transform_validate', tmp_path)
+
+    relatorios(60, 60)
+    with pytest.raises(RuntimeError, match='linhas_finais'):
+        executar.conferir_linhas('ans_integration', tmp_path)
+    relatorios(90, 60)
+    with pytest.raises(RuntimeError, match='rows_read'):
+        executar.conferir_linhas('transform_validate', tmp_path)
+    (tmp_path / 'output' / executar.RELATORIO_TRANSFORMACAO).unlink()
+    with pytest.raises(RuntimeError, match='relatório'):
+        executar.conferir_linhas('transform_validate', tmp_path)
+
+
+def test_comparar_acusa_so_pioras_acima_da_tolerancia():
+    baseline = {'resultados': {'1m': {'ans_integration': {
+        'segundos': 10.0, 'pico_rss_bytes': 1000,
+        'etapas': {'passo_3_processar_arquivos': {'segundos': 4.0}},
+    }}}}
+    atual = {'resultados': {
+        '1m': {'ans_integration': {
+            'segundos': 11.0, 'pico_rss_bytes': 1500,
+            'etapas': {'passo_3_processar_arquivos': {'segundos': 6.0}, 'nova': {'segundos': 1.0}},
+        }},
+        '10m': {'ans_integration': {'segundos': 99.0, 'pico_rss_bytes': 1, 'etapas': {}}},
+    }}
+    regressoes = executar.comparar(atual, baseline, tolerancia=0.2)
+    assert [(r['metrica'], r['variacao']) for r in regressoes] == [
+        ('pico_rss_bytes', 0.5), ('etapa passo_3_processar_arquivos', 0.5)]
+
+
+def test_benchmark_de_ponta_a_ponta(tmp_path, monkeypatch):
+    monkeypatch.setattr(executar, 'RESULTADOS_DIR', tmp_path / 'resultados')
+    baseline = tmp_path / 'baseline.json'
+    argumentos = ['--tamanhos', '2k', '--dados', str(tmp_path / 'dados'), '--baseline', str(baseline)]
+
+    assert executar.main(argumentos + ['--salvar-baseline']) == 0
+    with open(baseline, encoding='utf-8') as f:
+        resultado = json.load(f)['resultados']['2k']
+    assert set(resultado) == {'ans_integration', 'transform_validate'}
+    assert resultado['ans_integration']['etapas']['passo_3_processar_arquivos']['linhas_entrada'] > 0
+    assert 'enrich_chunks' in resultado['transform_validate']['etapas']
+    assert (tmp_path / 'dados' / '2k_s42' / 'output' / 'consolidado_enriquecido.csv').exists()
+
+    # Dados reaproveitados e comparação com tolerância folgada
+    assert executar.main(argumentos + ['--tolerancia', '100']) == 0
@@ -0,0 +1,88 @@
+import pandas as pd
+
+import correspondencia_nomes
+import transform_validate
+
+
+def test_normalizar_nome():
+    assert correspondencia_nomes.normalizar_nome('Saúde & Vida S/A - Ltda.') == 'SAUDE VIDA'
+    assert correspondencia_nomes.normalizar_nome(None) == ''
+
+
+def test_indice_encontra_nomes_parecidos():
+    nomes = ['UNIMED DE SÃO PAULO LTDA', 'UNIMED DO RIO DE JANEIRO', 'AMIL ASSISTÊNCIA MÉDICA S.A.', '']
+    indice = correspondencia_nomes.IndiceNomes(nomes, ['sp', 'rj', 'amil', 'vazio'])
+
+    assert indice.buscar('Unimed de Sao Paulo') == ('sp', 1.0, 0)
+    dados, pontuacao, _ = indice.buscar('UNIMED RIO DE JANERIO')
+    assert dados == 'rj' and 0.8 < pontuacao < 1
+    assert indice.buscar('') is None
+    assert indice.buscar('XYZW') is None
+
+    propostas = indice.propor(['AMIL ASSISTENCIA MEDICA', 'UNIMED', 'BRADESCO SAUDE'])
+    assert propostas == {'AMIL ASSISTENCIA MEDICA': ('amil', 1.0)}
+
+
+def test_nome_de_mais_de_uma_chave_e_ambiguo():
+    nomes = ['SAUDE VIDA LTDA', 'Saúde Vida S.A.', 'UNIMED NORTE', 'UNIMED NORTE']
+    indice = correspondencia_nomes.IndiceNomes(nomes, ['a', 'b', 'c1', 'c2'], ['1', '2', '3', '3'])
+
+    assert indice.buscar('SAUDE VIDA') == (None, 1.0, None)
+    assert indice.buscar('UNIMED NORTE') == ('c1', 1.0, 2)
+    dados, pontuacao, posicao = indice.buscar('SAUDE VIDAS')
+    assert dados is None and posicao is None and pontuacao > 0.8
+    assert indice.propor(['SAUDE VIDA']) == {'SAUDE VIDA': (None, 1.0)}
+
+
+def test_propostas_por_nome_para_cnpjs_sem_cadastro():
+    cadastro = pd.DataFrame({
+        'CNPJ': ['11222333000181', '44555666000199'],
+        'RegistroANS': ['301', '302'],
+        'Razao_Social': ['OPERADORA ALFA SAÚDE LTDA', 'OPERADORA BETA ODONTO S.A.'],
+        'Modalidade': ['Cooperativa', 'Odontologia'],
+        'UF': ['SP', 'RJ'],
+    })
+    indice = transform_validate.build_cadastro_index(cadastro)
+    sem_cadastro = {('112223330001', 'Operadora Alfa Saude'): 7,
+                    ('4455566600', 'OPERADORA BETA ODNTO'): 2,
+                    ('999', 'OUTRA EMPRESA'): 1}
+
+    propostas, resumo = transform_validate.match_by_name(sem_cadastro, indice)
+    assert list(propostas['CNPJ_clean']) == ['112223330001', '4455566600']
+    assert list(propostas['RegistroANS']) == ['301', '302']
+    assert propostas['score'].iloc[0] == 1.0 and propostas['score'].iloc[1] >= 0.8
+    assert resumo['unmatched_rows'] == 10 and resumo['matched_rows'] == 9
+    assert resumo['hit_rate'] == 0.9 and resumo['matched_keys'] == 2
+    assert resumo['ambiguous_keys'] == 0
+
+
+def test_nome_repetido_no_cadastro_nao_gera_proposta():
+    cadastro = pd.DataFrame({
+        'CNPJ': ['11222333000181', '44555666000199'],
+        'RegistroANS': ['301', '302'],
+        'Razao_Social': ['OPERADORA GAMA LTDA', 'Operadora Gama S.A.'],
+        'Modalidade': ['Cooperativa', 'Odontologia'],
+        'UF': ['SP', 'RJ'],
+    })
+    indice = transform_validate.build_cadastro_index(cadastro)
+
+    propostas, resumo = transform_validate.match_by_name({('123', 'OPERADORA GAMA'): 4}, indice)
+    assert propostas.empty
+    assert resumo['ambiguous_keys'] == 1 and resumo['ambiguous_rows'] == 4
+    assert resumo['matched_rows'] == 0
+
+
+def test_linhas_sem_cadastro_contadas_so_com_correspondencia_ligada():
+    cadastro = pd.DataFrame({'CNPJ': ['11222333000181'], 'RegistroANS': ['301'],
+                             'Modalidade': ['Cooperativa'], 'UF': ['SP']})
+    indice = transform_validate.build_cadastro_index(cadastro)
+
+    def bloco():
+        return pd.DataFrame({'CNPJ': ['11222333000181', '999', '999'],
+                             'RazaoSocial': ['ALFA', 'OUTRA', 'OUTRA'],
+                             'Trimestre': ['1'] * 3, 'Ano': ['2025'] * 3, 'ValorDespesas': ['10'] * 3})
+
+    desligada = transform_validate.transform_chunk(bloco(), indice, ',', match_names=False)
+    assert desligada['missing_cadastro'] == 2 and desligada['unmatched'] == {}
+    ligada = transform_validate.transform_chunk(bloco(), indice, ',', match_names=True)
+    assert ligada['unmatched'] == {('999', 'OUTRA'): 2}
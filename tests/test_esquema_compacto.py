@@ -0,0 +1,115 @@
+import io
+import json
+
+import pandas as pd
+import pytest
+
+import ans_integration
+import esquema_compacto
+import transform_validate
+from benchmarks import gerar_dados
+
+
+def _bloco(trimestre, valores, cnpjs=('123', '456')):
+    return pd.DataFrame({
+        'CNPJ': list(cnpjs),
+        'RazaoSocial': ['B SA', 'A SA'],
+        'Trimestre': [trimestre] * 2,
+        'Ano': ['2025'] * 2,
+        'ValorDespesas': valores,
+        'status': ['OK', 'ZERADO'],
+    })
+
+
+def test_compactar_e_expandir_sem_perda():
+    blocos = [
+        _bloco('01', [10.5, 0.0]),
+        _bloco('02', [1.25, 3.0], cnpjs=('789', '123')),
+        _bloco('3', [0.001, 2.0]),   # largura e precisão diferentes: volta ao texto/float
+    ]
+    esperado = pd.concat(blocos, ignore_index=True)
+
+    compactos = [esquema_compacto.compactar(bloco) for bloco in blocos]
+    assert compactos[0]['Trimestre'].dtype == 'int8'
+    assert compactos[0]['Ano'].dtype == 'int16'
+    assert compactos[0]['ValorDespesas'].dtype == 'int64'
+    assert isinstance(compactos[0]['CNPJ'].dtype, pd.CategoricalDtype)
+    assert compactos[2]['ValorDespesas'].dtype == 'float64'
+
+    df = esquema_compacto.concatenar(compactos)
+    assert list(df['CNPJ'].cat.categories) == ['123', '456', '789']
+    expandido = esquema_compacto.expandir(df)
+    pd.testing.assert_frame_equal(expandido.astype(object), esperado.astype(object))
+
+    # Ordenar os códigos dá a mesma ordem que ordenar o texto
+    ordenado = esquema_compacto.expandir(df.iloc[:6].sort_values(['Ano', 'Trimestre', 'CNPJ']))
+    referencia = esperado.iloc[:6].sort_values(['Ano', 'Trimestre', 'CNPJ'])
+    assert list(ordenado.index) == list(referencia.index)
+
+
+def test_juntar_textos_e_preencher_nulos():
+    ano = pd.Series(['2025', '2024', '2025'], dtype='category')
+    trimestre = pd.Series(['01', '03', '02'])
+    periodo = esquema_compacto.juntar_textos(ano, trimestre, '_')
+    assert list(periodo.astype(str)) == ['2025_01', '2024_03', '2025_02']
+    assert list(periodo.cat.categories) == ['2024_03', '2025_01', '2025_02']
+
+    compacto = esquema_compacto.compactar(pd.DataFrame({'Ano': ['2025', '2024', '2025'],
+                                                        'Trimestre': ['01', '03', '02']}))
+    assert compacto['Ano'].dtype == 'int16' and compacto['Trimestre'].dtype == 'int8'
+    periodo = esquema_compacto.juntar_textos(esquema_compacto.categoria_texto(compacto, 'Ano'),
+                                             esquema_compacto.categoria_texto(compacto, 'Trimestre'), '_')
+    assert list(periodo.astype(str)) == ['2025_01', '2024_03', '2025_02']
+
+    uf = esquema_compacto.preencher_nulos(pd.Series(['SP', None], dtype='category'), 'N/A')
+    assert list(uf) == ['SP', 'N/A'] and list(uf.cat.categories) == ['N/A', 'SP']
+
+
+@pytest.fixture
+def dados(tmp_path):
+    gerar_dados.gerar(tmp_path, 3000, linhas_xlsx=40, tamanho_bloco=700)
+    return tmp_path
+
+
+def _executar_pipeline(dados, saida, compacto, monkeypatch):
+    saida.mkdir()
+    monkeypatch.setattr(esquema_compacto, 'USAR_ESQUEMA_COMPACTO', compacto)
+    monkeypatch.setattr(ans_integration, 'OUTPUT_DIR', saida)
+    monkeypatch.setattr(ans_integration, 'CACHE_DIALETOS_PATH', saida / 'dialetos.json')
+    monkeypatch.setattr(ans_integration, 'DADOS_LOCAIS_DIR', dados)
+    monkeypatch.setattr(ans_integration, 'DOWNLOAD_DIR', dados / 'downloads')
+    arquivos = ans_integration.preparar_arquivos_locais([('2025', '1'), ('2025', '2')])
+    df, rel = ans_integration.consolidar_e_tratar_inconsistencias(
+        ans_integration.processar_arquivos(arquivos, workers=1))
+    ans_integration.salvar_resultado_final(df, rel)
+
+    monkeypatch.setattr(transform_validate, 'OUTPUT_DIR', str(saida))
+    monkeypatch.setattr(transform_validate, 'WORK_DIR', str(dados))
+    transform_validate.process()
+    return df
+
+
+def test_modo_compacto_gera_mesmos_arquivos(dados, tmp_path, monkeypatch):
+    normal = tmp_path / 'normal'
+    compacta = tmp_path / 'compacta'
+    _executar_pipeline(dados, normal, False, monkeypatch)
+    df = _executar_pipeline(dados, compacta, True, monkeypatch)
+
+    assert isinstance(df['RazaoSocial'].dtype, pd.CategoricalDtype)
+    for nome in ('consolidado_despesas.csv', 'consolidado_enriquecido.csv',
+                 'aggregados_operadora_uf.csv', 'media_desvio_por_operadora_uf.csv'):
+        assert (compacta / nome).read_bytes() == (normal / nome).read_bytes(), nome
+
+    with open(compacta / 'metricas_transformacao.json', encoding='utf-8') as f:
+        etapas = {e['etapa']: e for e in json.load(f)['etapas']}
+    enriquecimento = etapas['enrich_chunks']
+    assert 0 < enriquecimento['memoria_compacta_bytes'] < enriquecimento['memoria_texto_bytes']
+
+    # Mesmo esquema nos dois scripts: Ano/Trimestre como inteiros pequenos
+    bloco = pd.read_csv(compacta / 'consolidado_despesas.csv', dtype=str, nrows=50)
+    trimestres = list(bloco['Trimestre'].unique())
+    enriquecido = transform_validate.transform_chunk(bloco, None, ',', compact=True)
+    assert enriquecido['compact_bytes'] < enriquecido['text_bytes']
+    assert df['Ano'].dtype == 'int16' and df['Trimestre'].dtype == 'int8'
+    texto = pd.read_csv(io.StringIO(''.join(enriquecido['enriched_csv'])), dtype=str)
+    assert list(texto['Trimestre'].unique()) == trimestres
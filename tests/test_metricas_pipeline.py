@@ -0,0 +1,54 @@
+import json
+
+import pytest
+
+import metricas_pipeline
+
+
+def _trabalho():
+    return sum(i * i for i in range(200_000))
+
+
+def test_etapas_sem_coletor_ativo_apenas_executam():
+    with metricas_pipeline.etapa('qualquer') as etapa:
+        etapa['linhas_entrada'] = 10
+    metricas_pipeline.anotar(linhas_saida=1)
+    metricas_pipeline.registrar_arquivo('x.csv', 0.1)
+
+
+def test_coletor_grava_etapas_e_arquivos(tmp_path):
+    metricas = metricas_pipeline.iniciar('teste')
+    with metricas_pipeline.etapa('calculo'):
+        _trabalho()
+        metricas_pipeline.anotar(linhas_entrada=1000, linhas_saida=10, bytes_lidos=4096)
+    metricas_pipeline.registrar_arquivo('a.csv', 0.5, linhas_entrada=100, bytes_lidos=1024 * 1024)
+
+    caminho = metricas_pipeline.finalizar(tmp_path / 'metricas.json')
+    assert metricas_pipeline.ativa() is None
+    with open(caminho, encoding='utf-8') as f:
+        dados = json.load(f)
+
+    etapa, = dados['etapas']
+    assert etapa['etapa'] == 'calculo'
+    assert etapa['linhas_saida'] == 10
+    assert etapa['linhas_por_segundo'] == pytest.approx(1000 / etapa['segundos'], rel=0.01)
+    arquivo, = dados['arquivos']
+    assert arquivo['linhas_por_segundo'] == 200.0
+    assert arquivo['mb_por_segundo'] == 2.0
+    assert metricas.resumo()['execucao'] == 'teste'
+
+
+@pytest.mark.parametrize('modo, arquivos', [
+    ('cprofile', {'perfil_teste.prof', 'perfil_teste.txt'}),
+    ('amostragem', {'perfil_teste.txt'}),
+])
+def test_perfilar_grava_perfil(tmp_path, modo, arquivos):
+    with metricas_pipeline.perfilar(tmp_path, 'teste', modo=modo):
+        _trabalho()
+    assert {p.name for p in tmp_path.iterdir()} == arquivos
+
+
+def test_perfilar_desligado(tmp_path):
+    with metricas_pipeline.perfilar(tmp_path, 'teste', modo='') as perfil:
+        assert perfil is None
+    assert list(tmp_path.iterdir()) == []
@@ -0,0 +1,297 @@
+import gzip
+import io
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import ans_integration
+import transform_validate
+from benchmarks import gerar_dados
+
+
+def _gravar_cadastro(caminho, linhas):
+    pd.DataFrame(linhas, columns=['CNPJ', 'RegistroANS', 'Modalidade', 'UF']).to_csv(caminho, index=False)
+
+
+def test_indice_cadastro_reaproveitado_ate_o_arquivo_mudar(tmp_path):
+    cadastro = tmp_path / 'cadastro_operadoras.csv'
+    indice = tmp_path / 'cache' / 'cadastro_index.pkl'
+    _gravar_cadastro(cadastro, [
+        ['12.345.678/0001-90', '1', 'Cooperativa', 'SP'],
+        ['12345678000190', '2', 'Medicina', 'RJ'],
+        ['999', '3', 'Seguradora', 'MG'],
+    ])
+
+    construido, reaproveitado = transform_validate.load_cadastro_index(str(cadastro), str(indice))
+    assert not reaproveitado
+    assert list(construido['lookup'].loc['12345678000190']) == ['1', 'Cooperativa', 'SP']
+    assert [r['RegistroANS'] for r in construido['conflicts']['12345678000190']] == ['1', '2']
+
+    _, reaproveitado = transform_validate.load_cadastro_index(str(cadastro), str(indice))
+    assert reaproveitado
+
+    # Mesmo conteúdo com outro mtime: reaproveitado; conteúdo novo: reconstruído
+    os.utime(cadastro, ns=(1, 1))
+    _, reaproveitado = transform_validate.load_cadastro_index(str(cadastro), str(indice))
+    assert reaproveitado
+    _gravar_cadastro(cadastro, [['999', '4', 'Autogestão', 'BA']])
+    novo, reaproveitado = transform_validate.load_cadastro_index(str(cadastro), str(indice))
+    assert not reaproveitado and novo['conflicts'] == {}
+
+
+def test_enriquecimento_pelo_indice_igual_ao_merge(tmp_path):
+    cadastro = pd.DataFrame({
+        'CNPJ': ['111', '222', '222', '333'],
+        'RegistroANS': ['1', '2', '9', '3'],
+        'Modalidade': ['A', 'B', 'C', None],
+        'UF': ['SP', 'RJ', 'RJ', 'MG'],
+    })
+    chunk = pd.DataFrame({'CNPJ': ['333', '444', '111', '222', '111']}, index=range(10, 15))
+    chunk['CNPJ_clean'] = chunk['CNPJ']
+
+    indice = transform_validate.build_cadastro_index(cadastro)
+    enriquecido = transform_validate.enrich_from_index(chunk, indice)
+
+    cadastro['CNPJ_clean'] = cadastro['CNPJ']
+    esperado = chunk.merge(cadastro.drop_duplicates('CNPJ_clean')[['CNPJ_clean', 'RegistroANS', 'Modalidade', 'UF']],
+                           on='CNPJ_clean', how='left')
+    pd.testing.assert_frame_equal(enriquecido, esperado)
+
+
+def test_limpeza_de_cnpj_em_coluna_igual_a_limpeza_por_valor():
+    valores = pd.Series(['12.345.678/0001-95', ' 344800 ', None, '', 'abc', 'x' * 40 + '12',
+                         7.0, 344800, '٣٤٥٦٧'], dtype=object)
+    limpos = transform_validate.clean_cnpj_series(valores)
+    assert list(limpos) == [transform_validate.clean_cnpj(v) for v in valores]
+    numericos = transform_validate.clean_cnpj_series(pd.Series([344800.0, None]))
+    assert list(numericos) == ['344800', '']
+
+
+def test_validacao_de_cnpj_por_modo():
+    limpos = pd.Series(['11222333000181', '11222333000182', '00000000000000', '344800', '123', ''])
+    assert list(transform_validate.cnpj_failures(limpos, 'lenient')) == ['', '', '', '', 'too_short', 'empty']
+    assert list(transform_validate.cnpj_failures(limpos, 'strict')) == [
+        '', 'check_digits', 'repeated_digits', 'length', 'length', 'empty']
+    assert transform_validate.validate_cnpj('11.222.333/0001-81', 'strict')
+    assert not transform_validate.validate_cnpj('11.222.333/0001-80', 'strict')
+    assert transform_validate.validate_cnpj('344800')
+
+
+def test_agregados_por_bloco_iguais_ao_groupby():
+    rng = np.random.default_rng(7)
+    df = pd.DataFrame({
+        'RazaoSocial': rng.choice(['A', 'B', 'C', 'D'], 500),
+        'UF': rng.choice(['SP', 'RJ', None], 500),
+        'valor': rng.normal(1e7, 5e6, 500).round(2),
+    })
+    df.loc[rng.choice(500, 40), 'valor'] = np.nan
+    df.loc[df['RazaoSocial'] == 'D', 'valor'] = np.nan
+
+    stats = transform_validate.GroupStats(['RazaoSocial', 'UF'])
+    for inicio in range(0, len(df), 37):
+        bloco = df.iloc[inicio:inicio + 37]
+        parcial = transform_validate.GroupStats(['RazaoSocial', 'UF'])
+        parcial.add([bloco['RazaoSocial'], bloco['UF'].fillna('N/A')], bloco['valor'])
+        stats.merge(parcial)
+
+    esperado = (df.groupby([df['RazaoSocial'], df['UF'].fillna('N/A')])['valor']
+                .agg(total='sum', mean='mean', std='std', count='count').reset_index())
+    pd.testing.assert_frame_equal(stats.result(), esperado, check_dtype=False, check_exact=False, rtol=1e-9)
+
+
+def _preparar_consolidado(tmp_path, monkeypatch):
+    gerar_dados.gerar(tmp_path, 2000, linhas_xlsx=40, tamanho_bloco=700)
+    saida = tmp_path / 'output'
+    saida.mkdir()
+    monkeypatch.setattr(ans_integration, 'DADOS_LOCAIS_DIR', tmp_path)
+    monkeypatch.setattr(ans_integration, 'DOWNLOAD_DIR', tmp_path / 'downloads')
+    monkeypatch.setattr(ans_integration, 'OUTPUT_DIR', saida)
+    monkeypatch.setattr(ans_integration, 'CACHE_DIALETOS_PATH', tmp_path / 'dialetos.json')
+    arquivos = ans_integration.preparar_arquivos_locais([('2025', '1'), ('2025', '2'), ('2025', '3')])
+    df, rel = ans_integration.consolidar_e_tratar_inconsistencias(ans_integration.processar_arquivos(arquivos))
+    ans_integration.salvar_resultado_final(df, rel)
+    monkeypatch.setattr(transform_validate, 'OUTPUT_DIR', str(saida))
+    monkeypatch.setattr(transform_validate, 'WORK_DIR', str(tmp_path))
+    return saida
+
+
+def test_process_em_blocos_pequenos_mesmas_agregacoes(tmp_path, monkeypatch):
+    saida = _preparar_consolidado(tmp_path, monkeypatch)
+    monkeypatch.setattr(transform_validate, 'CNPJ_VALIDATION', 'strict')
+
+    resultados = {}
+    arquivos = {}
+    for tamanho in (200_000, 97):
+        monkeypatch.setattr(transform_validate, 'CHUNK_SIZE', tamanho)
+        transform_validate.process()
+        resultados[tamanho] = {nome: pd.read_csv(saida / nome, sep='|')
+                               for nome in ('aggregados_operadora_uf.csv', 'media_desvio_por_operadora_uf.csv')}
+        arquivos[tamanho] = {nome: (saida / nome).read_bytes()
+                             for nome in ('consolidado_enriquecido.csv', 'invalidos_cnpj.csv')}
+
+    for nome, esperado in resultados[200_000].items():
+        assert len(esperado) > 0
+        pd.testing.assert_frame_equal(resultados[97][nome], esperado, check_exact=False, rtol=1e-9)
+    # Gravados bloco a bloco com um único cabeçalho, sem temporários sobrando
+    assert arquivos[97] == arquivos[200_000]
+    assert arquivos[97]['consolidado_enriquecido.csv'].count(b'CNPJ_clean') == 1
+    assert [p.name for p in saida.iterdir() if p.name.startswith('.')] == []
+
+
+def test_process_paralelo_igual_ao_sequencial(tmp_path, monkeypatch):
+    saida = _preparar_consolidado(tmp_path, monkeypatch)
+    monkeypatch.setattr(transform_validate, 'CNPJ_VALIDATION', 'strict')
+    monkeypatch.setattr(transform_validate, 'CHUNK_SIZE', 150)
+    nomes = ('consolidado_enriquecido.csv', 'invalidos_cnpj.csv', 'aggregados_operadora_uf.csv',
+             'media_desvio_por_operadora_uf.csv', 'relatorio_transformacao.json')
+
+    saidas = {}
+    for workers in (1, 2):
+        monkeypatch.setattr(transform_validate, 'WORKERS', workers)
+        transform_validate.process()
+        saidas[workers] = {nome: (saida / nome).read_bytes() for nome in nomes}
+
+    assert saidas[2] == saidas[1]
+
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_process_grava_parquet_igual_ao_csv(tmp_path, monkeypatch, workers):
+    pytest.importorskip('pyarrow')
+    import saida_colunar
+
+    saida = _preparar_consolidado(tmp_path, monkeypatch)
+    monkeypatch.setattr(saida_colunar, 'GERAR_PARQUET', True)
+    monkeypatch.setattr(transform_validate, 'CHUNK_SIZE', 150)
+    monkeypatch.setattr(transform_validate, 'WORKERS', workers)
+    transform_validate.process()
+
+    csv = pd.read_csv(saida / 'consolidado_enriquecido.csv', dtype={'CNPJ_clean': str})
+    parquet = saida_colunar.ler_parquet(saida / 'consolidado_enriquecido.parquet',
+                                        colunas=['CNPJ_clean', 'ValorDespesas_num', 'CNPJ_valid'])
+    assert len(parquet) == len(csv) > 0
+    assert parquet['ValorDespesas_num'].dtype == 'float64'
+    assert parquet['CNPJ_valid'].dtype == 'bool'
+    assert sorted(parquet['CNPJ_clean']) == sorted(csv['CNPJ_clean'])
+    assert parquet['ValorDespesas_num'].sum() == pytest.approx(csv['ValorDespesas_num'].sum())
+    assert [p.name for p in saida.iterdir() if p.name.startswith('.')] == []
+
+
+def test_blocos_de_texto_nao_cortam_campos_entre_aspas(tmp_path):
+    caminho = tmp_path / 'consolidado.csv'
+    caminho.write_text('﻿CNPJ,RazaoSocial\n1,A\n2,"B\nSEGUNDA LINHA"\n3,C\n4,D\n', encoding='utf-8')
+    blocos = list(transform_validate.iter_raw_chunks(str(caminho), 2))
+    assert [cabecalho for cabecalho, _ in blocos] == ['CNPJ,RazaoSocial\n'] * 2
+    assert blocos[0][1] == '1,A\n2,"B\nSEGUNDA LINHA"\n'
+    assert blocos[1][1] == '3,C\n4,D\n'
+
+    # Blocos de N registros, não de N linhas: os mesmos de read_csv(chunksize=N)
+    linhas = ''.join(f'{i},"NOME\n{i}"\n' if i % 3 == 0 else f'{i},NOME {i}\n' for i in range(20))
+    caminho.write_text('CNPJ,RazaoSocial\n' + linhas, encoding='utf-8')
+    blocos = [pd.read_csv(io.StringIO(cabecalho + texto), dtype=str)
+              for cabecalho, texto in transform_validate.iter_raw_chunks(str(caminho), 4)]
+    esperados = list(pd.read_csv(caminho, dtype=str, chunksize=4))
+    assert [len(b) for b in blocos] == [len(b) for b in esperados] == [4] * 5
+    for bloco, esperado in zip(blocos, esperados):
+        pd.testing.assert_frame_equal(bloco, esperado.reset_index(drop=True))
+
+
+class CadastroHandler(BaseHTTPRequestHandler):
+    corpo = b'CNPJ,RegistroANS,Modalidade,UF\n11222333000181,1,Cooperativa,SP\n'
+    etag = '"v1"'
+    ignorar_validadores = False
+    gzip = False
+    requisicoes = []
+    codificacoes = []
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        cls = CadastroHandler
+        cls.requisicoes.append((self.path, self.headers.get('If-None-Match')))
+        cls.codificacoes.append(self.headers.get('Accept-Encoding'))
+        if self.path == '/operadoras/':
+            corpo = b'<a href="../">../</a><a href="leiame.pdf">x</a><a href="Relatorio_cadop.csv">csv</a>'
+            extras = []
+        elif self.path == '/operadoras/Relatorio_cadop.csv':
+            if not cls.ignorar_validadores and self.headers.get('If-None-Match') == cls.etag:
+                self.send_response(304)
+                self.end_headers()
+                return
+            corpo = cls.corpo
+            extras = [('ETag', cls.etag), ('Last-Modified', 'Wed, 01 Oct 2025 00:00:00 GMT')]
+            if cls.gzip:
+                # Servidor que comprime mesmo com Accept-Encoding: identity
+                corpo = gzip.compress(corpo)
+                extras.append(('Content-Encoding', 'gzip'))
+        else:
+            self.send_response(404)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(corpo)))
+        for nome, valor in extras:
+            self.send_header(nome, valor)
+        self.end_headers()
+        self.wfile.write(corpo)
+
+
+@pytest.fixture
+def servidor_cadastro():
+    CadastroHandler.requisicoes = []
+    CadastroHandler.codificacoes = []
+    httpd = ThreadingHTTPServer(('127.0.0.1', 0), CadastroHandler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield f'http://127.0.0.1:{httpd.server_address[1]}/operadoras/'
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def test_cadastro_revalidado_com_get_condicional(servidor_cadastro, tmp_path, monkeypatch):
+    cache = str(tmp_path / 'cache')
+    caminho, status = transform_validate.fetch_cadastro(servidor_cadastro, cache)
+    assert status == 'downloaded' and caminho.endswith('cadastro_operadoras.csv')
+    assert open(caminho, 'rb').read() == CadastroHandler.corpo
+
+    caminho, status = transform_validate.fetch_cadastro(servidor_cadastro, cache)
+    assert status == 'not_modified'
+    assert CadastroHandler.requisicoes[-1] == ('/operadoras/Relatorio_cadop.csv', '"v1"')
+
+    # Servidor que ignora os validadores: mesmo sha256, arquivo intocado
+    monkeypatch.setattr(CadastroHandler, 'ignorar_validadores', True)
+    mtime = os.stat(caminho).st_mtime_ns
+    assert transform_validate.fetch_cadastro(servidor_cadastro, cache)[1] == 'unchanged'
+    assert os.stat(caminho).st_mtime_ns == mtime
+
+    monkeypatch.setattr(CadastroHandler, 'corpo', CadastroHandler.corpo + b'999,2,Medicina,RJ\n')
+    monkeypatch.setattr(CadastroHandler, 'etag', '"v2"')
+    caminho, status = transform_validate.fetch_cadastro(servidor_cadastro, cache)
+    assert status == 'downloaded' and open(caminho, 'rb').read().endswith(b'RJ\n')
+
+
+def test_cadastro_com_gzip_nao_confunde_content_length(servidor_cadastro, tmp_path, monkeypatch):
+    monkeypatch.setattr(CadastroHandler, 'gzip', True)
+    monkeypatch.setattr(CadastroHandler, 'corpo', CadastroHandler.corpo * 500)
+    caminho, status = transform_validate.fetch_cadastro(servidor_cadastro, str(tmp_path / 'cache'))
+    assert status == 'downloaded'
+    assert open(caminho, 'rb').read() == CadastroHandler.corpo
+    assert CadastroHandler.codificacoes[-1] == 'identity'
+
+
+def test_cadastro_em_cache_usado_sem_rede_e_limite_de_tamanho(servidor_cadastro, tmp_path, monkeypatch):
+    cache = str(tmp_path / 'cache')
+    assert transform_validate.fetch_cadastro('http://127.0.0.1:1/', cache) == (None, 'unavailable')
+    caminho, _ = transform_validate.fetch_cadastro(servidor_cadastro, cache)
+    assert transform_validate.fetch_cadastro('http://127.0.0.1:1/', cache) == (caminho, 'offline')
+
+    # Corpo acima do limite: download recusado, cópia anterior mantida
+    monkeypatch.setattr(CadastroHandler, 'ignorar_validadores', True)
+    monkeypatch.setattr(transform_validate, 'CADASTRO_MAX_BYTES', 10)
+    assert transform_validate.fetch_cadastro(servidor_cadastro, cache) == (caminho, 'offline')
+    assert sorted(os.listdir(cache)) == ['cadastro.meta.json', 'cadastro_operadoras.csv']
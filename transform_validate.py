@@ -1,15 +1,46 @@
 import os
 import io
+import re
 import json
+import time
+import pickle
+import hashlib
+import tempfile
 import requests
+import numpy as np
 import pandas as pd
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from typing import Optional
+from urllib.parse import urljoin, urlparse
+
+import correspondencia_nomes
+import esquema_compacto
+import metricas_pipeline
+import saida_colunar
 
 
 BASE_DIR = os.path.abspath(os.path.dirname(__file__))
-OUTPUT_DIR = os.path.join(BASE_DIR, "dados_trabalho", "output")
+WORK_DIR = os.getenv('ANS_TRABALHO_DIR', os.path.join(BASE_DIR, "dados_trabalho"))
+OUTPUT_DIR = os.path.join(WORK_DIR, "output")
 os.makedirs(OUTPUT_DIR, exist_ok=True)
 
+# Rows per chunk read from the consolidated CSV
+CHUNK_SIZE = int(os.getenv('ANS_TAMANHO_CHUNK', '200000'))
+
+# Worker processes for the chunk stages (clean, validate, enrich, render);
+# 1 keeps everything in the main process
+WORKERS = int(os.getenv('ANS_TRANSFORM_WORKERS', '1'))
+
+# Column types for the parquet copy of the enriched dataset; remaining text
+# columns are stored as strings
+ENRICHED_TYPES = {
+    'ValorDespesas_num': 'float64',
+    'CNPJ_valid': 'bool',
+    'valid_valor': 'bool',
+    'valid_razao': 'bool',
+}
+
 
 def clean_cnpj(s: str) -> str:
     if pd.isna(s):
@@ -19,88 +50,732 @@ def clean_cnpj(s: str) -> str:
     return ''.join(ch for ch in s_str if ch.isdigit())
 
 
-def validate_cnpj(cnpj: str) -> bool:
-    """Validate CNPJ format and check digits. A CNPJ must have 14 digits."""
-    c = clean_cnpj(cnpj)
-    # Most ANS CNPJs are actually shorter (8-12 digits, not full 14)
-    # So we accept CNPJs that are numeric and >= 5 digits as "valid format"
-    # Full 14-digit validation is optional/strict mode
-    if len(c) < 5 or not c.isdigit():
-        return False
-    # For strict CNPJ validation (14 digits with check digits), uncomment:
-    # if len(c) != 14:
-    #     return False
-    # def calc(digs):
-    #     s = 0
-    #     pos = len(digs) - 7
-    #     for i in range(len(digs)-1):
-    #         s += int(digs[i]) * pos
-    #         pos -= 1
-    #         if pos < 2:
-    #             pos = 9
-    #     r = s % 11
-    #     return '0' if r < 2 else str(11 - r)
-    # v1 = calc(c)
-    # v2 = calc(c + v1)
-    # return c[-2:] == (v1 + v2)
-    return True  # Accept numeric CNPJs >= 5 digits
-
-
-def download_cadastro(dest_path: str) -> Optional[str]:
-    # Try to fetch a CSV from the ANS folder; if not possible, return None
-    base_url = "https://dadosabertos.ans.gov.br/FTP/PDA/operadoras_de_plano_de_saude/"
+# CNPJ validation rule, selectable per run:
+# - 'lenient': most ANS CNPJs are actually shorter (8-12 digits, not full
+#   14), so any numeric CNPJ with >= 5 digits is accepted
+# - 'strict':  14 digits, not all equal, with valid mod-11 check digits
+CNPJ_VALIDATION = os.getenv('ANS_CNPJ_VALIDATION', 'lenient')
+CNPJ_MODES = ('lenient', 'strict')
+
+# Weights of the two CNPJ check digits (over the first 12 and 13 digits)
+_CNPJ_WEIGHTS_1 = np.array([5, 4, 3, 2, 9, 8, 7, 6, 5, 4, 3, 2], dtype=np.int32)
+_CNPJ_WEIGHTS_2 = np.array([6, 5, 4, 3, 2, 9, 8, 7, 6, 5, 4, 3, 2], dtype=np.int32)
+
+
+def validate_cnpj(cnpj: str, mode: Optional[str] = None) -> bool:
+    """Validate a single CNPJ with the rule of `mode` (see CNPJ_VALIDATION)."""
+    return cnpj_failures(pd.Series([clean_cnpj(cnpj)], dtype=object), mode).iloc[0] == ''
+
+
+# Longer strings are cleaned one by one, so a stray long value does not
+# widen the fixed-width array used for the whole column
+_CNPJ_MAX_WIDTH = 32
+
+
+def clean_cnpj_series(values: pd.Series) -> pd.Series:
+    """
+    clean_cnpj for a whole column: digits only, '' for missing values.
+    Strings are laid out as a fixed-width code point matrix and the digits
+    are moved to the front of each row, without a Python loop per character.
+    """
+    if pd.api.types.is_numeric_dtype(values) and not pd.api.types.is_bool_dtype(values):
+        numbers = values.astype('float64')
+        cleaned = pd.Series('', index=values.index, dtype=object)
+        present = numbers.notna()
+        cleaned[present] = numbers[present].astype('int64').abs().astype(str)
+        return cleaned
+
+    raw = values.to_numpy(dtype=object)
+    cleaned = np.full(len(raw), '', dtype=object)
+    if pd.api.types.infer_dtype(values, skipna=True) in ('string', 'empty'):
+        strings = np.flatnonzero(~pd.isna(raw))
+        other = np.array([], dtype=np.int64)
+    else:
+        is_str = np.fromiter((isinstance(v, str) for v in raw), dtype=bool, count=len(raw))
+        strings = np.flatnonzero(is_str)
+        other = np.flatnonzero(~is_str & ~pd.isna(raw))
+    lengths = np.fromiter(map(len, raw[strings]), dtype=np.int64, count=len(strings))
+    short = strings[lengths <= _CNPJ_MAX_WIDTH]
+    slow = [other, strings[lengths > _CNPJ_MAX_WIDTH]]
+
+    if len(short):
+        text = raw[short].astype(str)
+        width = text.dtype.itemsize // 4
+        codes = text.view(np.uint32).reshape(len(text), width)
+        digit = (codes >= ord('0')) & (codes <= ord('9'))
+        # Values that are digits already are kept as they are
+        clean = digit.sum(axis=1) == lengths[lengths <= _CNPJ_MAX_WIDTH]
+        cleaned[short[clean]] = raw[short[clean]]
+        dirty = ~clean
+        if dirty.any():
+            codes, digit = codes[dirty], digit[dirty]
+            order = np.argsort(~digit, axis=1, kind='stable')
+            packed = np.where(np.take_along_axis(digit, order, axis=1),
+                              np.take_along_axis(codes, order, axis=1), 0).astype(np.uint32)
+            cleaned[short[dirty]] = packed.view(f'<U{width}').ravel().astype(object)
+            # Non-ASCII text may contain other Unicode digits: keep clean_cnpj's rule
+            slow.append(short[dirty][(codes > 127).any(axis=1)])
+
+    for i in np.concatenate(slow):
+        cleaned[i] = clean_cnpj(raw[i])
+    return pd.Series(cleaned, index=values.index, dtype=object)
+
+
+def cnpj_failures(cleaned: pd.Series, mode: Optional[str] = None) -> pd.Series:
+    """
+    Rule failed by each cleaned CNPJ ('' when valid): 'empty', 'too_short'
+    (lenient) or 'length', 'repeated_digits', 'check_digits' (strict).
+    """
+    mode = mode or CNPJ_VALIDATION
+    if mode not in CNPJ_MODES:
+        raise ValueError(f"Unknown CNPJ validation mode: {mode}")
+    values = cleaned.to_numpy(dtype=object)
+    lengths = np.fromiter(map(len, values), dtype=np.int64, count=len(values))
+    reasons = np.full(len(values), '', dtype=object)
+    reasons[lengths == 0] = 'empty'
+
+    if mode == 'lenient':
+        reasons[(lengths > 0) & (lengths < 5)] = 'too_short'
+        return pd.Series(reasons, index=cleaned.index, dtype=object)
+
+    reasons[(lengths > 0) & (lengths != 14)] = 'length'
+    candidates = np.flatnonzero(lengths == 14)
+    if len(candidates):
+        codes = values[candidates].astype('<U14').view(np.uint32).reshape(-1, 14)
+        digits = codes.astype(np.int32) - ord('0')
+        remainder = digits[:, :12] @ _CNPJ_WEIGHTS_1 % 11
+        first = np.where(remainder < 2, 0, 11 - remainder)
+        remainder = (digits[:, :12] @ _CNPJ_WEIGHTS_2[:12] + first * _CNPJ_WEIGHTS_2[12]) % 11
+        second = np.where(remainder < 2, 0, 11 - remainder)
+        wrong = ((digits[:, 12] != first) | (digits[:, 13] != second)
+                 | ((digits < 0) | (digits > 9)).any(axis=1))  # non-ASCII digits
+        repeated = (digits == digits[:, :1]).all(axis=1)
+        reasons[candidates[wrong]] = 'check_digits'
+        reasons[candidates[repeated & ~wrong]] = 'repeated_digits'
+    return pd.Series(reasons, index=cleaned.index, dtype=object)
+
+
+# ============================================================================
+# Cadastro download cache
+# ============================================================================
+
+# Directory listing where the operadoras cadastro (CSV or XLSX) is published
+CADASTRO_URL = os.getenv('ANS_CADASTRO_URL',
+                         'https://dadosabertos.ans.gov.br/FTP/PDA/operadoras_de_plano_de_saude/')
+# Downloads larger than this are refused (the file is a few MB)
+CADASTRO_MAX_BYTES = int(os.getenv('ANS_CADASTRO_MAX_BYTES', str(200 * 1024 * 1024)))
+HTTP_TIMEOUT = (10, 60)  # (connect, read between packets)
+_CADASTRO_LINK = re.compile(r'href\s*=\s*["\']([^"\'?#]+\.(?:csv|xlsx))["\']', re.IGNORECASE)
+
+# The downloaded file lives in WORK_DIR/cache/cadastro with a metadata file
+# holding its URL, ETag, Last-Modified and sha256; later runs revalidate it
+# with a conditional GET and keep the local copy on 304 or without network
+CADASTRO_META_FILE = 'cadastro.meta.json'
+
+
+def _cadastro_cache_dir() -> str:
+    return os.path.join(WORK_DIR, 'cache', 'cadastro')
+
+
+def _read_json(path: str) -> dict:
     try:
-        r = requests.get(base_url, timeout=20)
-        if r.status_code != 200:
-            return None
-        html = r.text
-        # look for .csv or .xlsx link (simple heuristic)
-        for ext in ('.csv', '.xlsx'):
-            idx = html.find(ext)
-            if idx != -1:
-                # find start of href before idx
-                start = html.rfind('href="', 0, idx)
-                if start == -1:
-                    start = html.rfind("href='", 0, idx)
-                    if start == -1:
-                        continue
-                    start += 6
-                else:
-                    start += 6
-                end = html.find('"', start)
-                if end == -1:
-                    end = html.find("'", start)
-                link = html[start:end]
-                if not link.startswith('http'):
-                    link = requests.compat.urljoin(base_url, link)
-                # download
-                rr = requests.get(link, timeout=60)
-                if rr.status_code == 200:
-                    with open(dest_path, 'wb') as f:
-                        f.write(rr.content)
-                    return dest_path
-        return None
-    except Exception:
-        return None
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
 
 
-def load_cadastro(path_hint: str) -> Optional[pd.DataFrame]:
-    # Priority: user-provided file at path_hint, then try remote download
-    if os.path.exists(path_hint):
-        return pd.read_csv(path_hint, dtype=str)
-    tmp = os.path.join(OUTPUT_DIR, 'cadastro_operadoras_downloaded')
+def _write_json(path: str, data: dict) -> None:
+    fd, tmp = tempfile.mkstemp(prefix='.meta.', dir=os.path.dirname(path))
+    with os.fdopen(fd, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+    os.replace(tmp, path)
+
+
+def _cadastro_link(session, listing_url: str) -> Optional[str]:
+    """First .csv/.xlsx link of the directory listing (CSV preferred)."""
+    r = session.get(listing_url, timeout=HTTP_TIMEOUT)
+    r.raise_for_status()
+    links = _CADASTRO_LINK.findall(r.text)
     for ext in ('.csv', '.xlsx'):
-        try_path = tmp + ext
-        got = download_cadastro(try_path)
-        if got and os.path.exists(got):
-            if got.endswith('.csv'):
-                return pd.read_csv(got, dtype=str)
-            else:
-                return pd.read_excel(got, dtype=str)
+        for link in links:
+            if link.lower().endswith(ext):
+                return urljoin(listing_url, link)
     return None
 
 
+def _download_to_temp(response, cache_dir: str):
+    """
+    Stream `response` into a temp file, refusing bodies over CADASTRO_MAX_BYTES.
+    Content-Length is checked only for unencoded bodies: under gzip it is the
+    compressed size, while iter_content yields the decoded bytes.
+    """
+    declared = response.headers.get('Content-Length')
+    encoded = response.headers.get('Content-Encoding', 'identity').lower() != 'identity'
+    if declared is not None and int(declared) > CADASTRO_MAX_BYTES:
+        raise IOError(f"cadastro too large: {declared} bytes")
+    sha = hashlib.sha256()
+    size = 0
+    fd, tmp = tempfile.mkstemp(prefix='.cadastro.', dir=cache_dir)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            for block in response.iter_content(chunk_size=1024 * 1024):
+                size += len(block)
+                if size > CADASTRO_MAX_BYTES:
+                    raise IOError(f"cadastro larger than {CADASTRO_MAX_BYTES} bytes")
+                sha.update(block)
+                f.write(block)
+        if declared is not None and not encoded and size != int(declared):
+            raise IOError(f"incomplete cadastro download: {size} of {declared} bytes")
+    except Exception:
+        os.unlink(tmp)
+        raise
+    return tmp, size, sha.hexdigest()
+
+
+def fetch_cadastro(listing_url: Optional[str] = None, cache_dir: Optional[str] = None,
+                   session=None):
+    """
+    Local copy of the remote cadastro, revalidated with If-None-Match /
+    If-Modified-Since. Returns (path, status) with status 'downloaded',
+    'not_modified', 'unchanged' (200 with the same sha256) or 'offline'
+    (cached copy kept after a network error); (None, 'unavailable') when
+    there is neither a remote file nor a cached one.
+    """
+    listing_url = listing_url or CADASTRO_URL
+    cache_dir = cache_dir or _cadastro_cache_dir()
+    os.makedirs(cache_dir, exist_ok=True)
+    meta_path = os.path.join(cache_dir, CADASTRO_META_FILE)
+    meta = _read_json(meta_path)
+    cached = os.path.join(cache_dir, meta['file']) if meta.get('file') else None
+    if cached and not (os.path.exists(cached) and os.path.getsize(cached) == meta.get('size')):
+        cached, meta = None, {}
+
+    session = session or requests.Session()
+    try:
+        url = _cadastro_link(session, listing_url)
+        if url is None:
+            return (cached, 'offline') if cached else (None, 'unavailable')
+        headers = {'Accept-Encoding': 'identity'}
+        if cached and meta.get('url') == url:
+            if meta.get('etag'):
+                headers['If-None-Match'] = meta['etag']
+            if meta.get('last_modified'):
+                headers['If-Modified-Since'] = meta['last_modified']
+        with session.get(url, headers=headers, stream=True, timeout=HTTP_TIMEOUT) as r:
+            if r.status_code == 304 and cached:
+                return cached, 'not_modified'
+            r.raise_for_status()
+            tmp, size, sha = _download_to_temp(r, cache_dir)
+            validators = {'etag': r.headers.get('ETag'), 'last_modified': r.headers.get('Last-Modified')}
+    except (requests.RequestException, OSError) as e:
+        print(f"⚠ Cadastro download failed ({str(e)[:80]})")
+        return (cached, 'offline') if cached else (None, 'unavailable')
+
+    if cached and sha == meta.get('sha256'):
+        # Same content served again (server ignored the validators): keep the
+        # file untouched so its mtime - and the lookup index - stay valid
+        os.unlink(tmp)
+        status = 'unchanged'
+    else:
+        name = 'cadastro_operadoras' + os.path.splitext(urlparse(url).path)[1].lower()
+        cached = os.path.join(cache_dir, name)
+        os.replace(tmp, cached)
+        status = 'downloaded'
+    _write_json(meta_path, dict(validators, url=url, file=os.path.basename(cached), size=size, sha256=sha))
+    return cached, status
+
+
+def find_cadastro(path_hint: str) -> Optional[str]:
+    # Priority: user-provided file at path_hint, then the cached/remote copy
+    if os.path.exists(path_hint):
+        return path_hint
+    path, status = fetch_cadastro()
+    if path:
+        print(f"Cadastro ({status}): {path}")
+    return path
+
+
+def read_cadastro(path: str) -> pd.DataFrame:
+    if path.endswith('.xlsx'):
+        return pd.read_excel(path, dtype=str)
+    return pd.read_csv(path, dtype=str)
+
+
+def load_cadastro(path_hint: str) -> Optional[pd.DataFrame]:
+    path = find_cadastro(path_hint)
+    return read_cadastro(path) if path else None
+
+
+# ============================================================================
+# Cadastro lookup index
+# ============================================================================
+
+# The cadastro is turned once into a lookup table keyed by clean CNPJ and
+# pickled next to the other caches; it is rebuilt only when the source file
+# changes (size/mtime, then sha256 when only the mtime differs)
+CADASTRO_INDEX_FILE = 'cadastro_index.pkl'
+CADASTRO_INDEX_VERSION = 2
+CADASTRO_FIELDS = ['RegistroANS', 'Modalidade', 'UF']
+
+
+def _sha256(path: str) -> str:
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+def build_cadastro_index(cadastro: pd.DataFrame) -> dict:
+    """
+    Lookup table (index = CNPJ_clean, columns = CADASTRO_FIELDS, first row
+    wins) plus the cadastro rows of every CNPJ that appears more than once,
+    and the distinct (name, CADASTRO_FIELDS) rows for matching by razão social.
+    """
+    cad = cadastro.copy()
+    if 'CNPJ' not in cad.columns:
+        # try to find cnpj-like column
+        for c in cad.columns:
+            if 'cnpj' in c.lower():
+                cad.rename(columns={c: 'CNPJ'}, inplace=True)
+                break
+    name_column = next((c for c in cad.columns
+                        if correspondencia_nomes.normalizar_nome(c).replace(' ', '') in ('RAZAOSOCIAL', 'RAZAO')),
+                       None)
+    cad['CNPJ_clean'] = clean_cnpj_series(cad['CNPJ'])
+
+    # detect conflicts: multiple cadastro rows per CNPJ
+    conflicts = {}
+    dup = cad[cad.duplicated('CNPJ_clean', keep=False)]
+    for k, g in dup.groupby('CNPJ_clean'):
+        conflicts[k] = g.to_dict(orient='records')
+
+    lookup = (cad.drop_duplicates('CNPJ_clean', keep='first')
+              .set_index('CNPJ_clean')
+              .reindex(columns=CADASTRO_FIELDS))
+    names = pd.DataFrame(columns=['name', 'CNPJ_clean'] + CADASTRO_FIELDS)
+    if name_column is not None:
+        names = (cad.rename(columns={name_column: 'name'})
+                 .reindex(columns=names.columns)
+                 .dropna(subset=['name'])
+                 .drop_duplicates(['name'] + CADASTRO_FIELDS)
+                 .reset_index(drop=True))
+    return {'lookup': lookup, 'conflicts': conflicts, 'rows': len(cad), 'names': names}
+
+
+def load_cadastro_index(path: str, index_path: Optional[str] = None):
+    """
+    Index for the cadastro at `path`, reused from `index_path` while the
+    source file is unchanged. Returns (index, reused).
+    """
+    index_path = index_path or os.path.join(WORK_DIR, 'cache', CADASTRO_INDEX_FILE)
+    stat = os.stat(path)
+    source = {'path': os.path.abspath(path), 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+    stored = None
+    if os.path.exists(index_path):
+        try:
+            with open(index_path, 'rb') as f:
+                stored = pickle.load(f)
+        except Exception:
+            stored = None
+    if stored and stored.get('version') == CADASTRO_INDEX_VERSION:
+        old = stored['source']
+        if old['path'] == source['path'] and old['size'] == source['size']:
+            if old['mtime_ns'] == source['mtime_ns']:
+                return stored['index'], True
+            sha = _sha256(path)
+            if sha == old['sha256']:
+                # Same content copied again: keep the index, refresh the mtime
+                _save_cadastro_index(index_path, stored['index'], dict(source, sha256=sha))
+                return stored['index'], True
+
+    index = build_cadastro_index(read_cadastro(path))
+    _save_cadastro_index(index_path, index, dict(source, sha256=_sha256(path)))
+    return index, False
+
+
+def _save_cadastro_index(index_path: str, index: dict, source: dict) -> None:
+    os.makedirs(os.path.dirname(index_path), exist_ok=True)
+    fd, tmp = tempfile.mkstemp(prefix='.cadastro_index.', dir=os.path.dirname(index_path))
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump({'version': CADASTRO_INDEX_VERSION, 'source': source, 'index': index}, f,
+                        protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, index_path)
+    except Exception:
+        os.unlink(tmp)
+        raise
+
+
+def match_by_name(unmatched: dict, index: dict, min_score: Optional[float] = None):
+    """
+    Proposed cadastro rows for the (CNPJ_clean, RazaoSocial) keys without an
+    exact CNPJ match, found by razão social through a trigram blocking index
+    (see correspondencia_nomes). `unmatched` maps each key to its row count.
+    Returns (proposals, summary); proposals are only reported, not applied.
+    Names whose best match is shared by several cadastro CNPJs get no
+    proposal and are counted as ambiguous in the summary.
+    """
+    names = index['names']
+    name_index = correspondencia_nomes.IndiceNomes(
+        names['name'], names[['name', 'CNPJ_clean'] + CADASTRO_FIELDS].itertuples(index=False, name=None),
+        names['CNPJ_clean'])
+    found = name_index.propor({name for _, name in unmatched}, min_score)
+    ambiguous = {key: count for key, count in unmatched.items() if key[1] in found and found[key[1]][0] is None}
+
+    rows = [[cnpj, name, count, *found[name][0], round(found[name][1], 4)]
+            for (cnpj, name), count in unmatched.items() if name in found and found[name][0] is not None]
+    proposals = pd.DataFrame(rows, columns=['CNPJ_clean', 'RazaoSocial', 'rows', 'cadastro_name',
+                                            'cadastro_CNPJ'] + CADASTRO_FIELDS + ['score'])
+    proposals = proposals.sort_values(['rows', 'CNPJ_clean', 'RazaoSocial'],
+                                      ascending=[False, True, True], ignore_index=True)
+
+    unmatched_rows = sum(unmatched.values())
+    matched_rows = int(proposals['rows'].sum())
+    summary = {
+        'min_score': correspondencia_nomes.PONTUACAO_MINIMA if min_score is None else min_score,
+        'unmatched_keys': len(unmatched),
+        'matched_keys': len(proposals),
+        'unmatched_rows': unmatched_rows,
+        'matched_rows': matched_rows,
+        'ambiguous_keys': len(ambiguous),
+        'ambiguous_rows': sum(ambiguous.values()),
+        'hit_rate': round(matched_rows / unmatched_rows, 4) if unmatched_rows else 0.0,
+    }
+    return proposals, summary
+
+
+def enrich_from_index(chunk: pd.DataFrame, index: dict) -> pd.DataFrame:
+    """Left join of `chunk` with the cadastro index on CNPJ_clean (chunk order kept)."""
+    left = chunk.reset_index(drop=True)
+    found = index['lookup'].reindex(left['CNPJ_clean']).reset_index(drop=True)
+    for field in CADASTRO_FIELDS:
+        left[field] = found[field]
+    return left
+
+
+# ============================================================================
+# Mergeable aggregates
+# ============================================================================
+
+class GroupStats:
+    """
+    count, sum and sample variance of a value per group, updated chunk by
+    chunk. Partial states are merged with the parallel variance formula of
+    Chan et al. (through the sums of squared deviations), which stays
+    accurate for large values where a plain sum of squares would cancel
+    out. A group seen in a single chunk keeps pandas' own sum and variance.
+    Memory depends on the number of groups only.
+    """
+
+    def __init__(self, keys):
+        self.keys = list(keys)
+        self.state = None
+
+    def add(self, keys, values):
+        """Fold in one chunk: `keys` is a list of Series (the group keys), `values` a Series."""
+        grouped = values.groupby(keys, observed=True)
+        part = pd.DataFrame({'count': grouped.count(), 'sum': grouped.sum(), 'var': grouped.var()})
+        # Plain object levels, so partials of categorical chunks line up
+        part.index = pd.MultiIndex.from_arrays(
+            [part.index.get_level_values(i).astype(object) for i in range(part.index.nlevels)],
+            names=self.keys)
+        self.merge(part)
+
+    def merge(self, other):
+        """Merge another GroupStats (or a partial state DataFrame) into this one."""
+        part = other.state if isinstance(other, GroupStats) else other
+        if part is None:
+            return
+        if self.state is None:
+            self.state = part
+            return
+        index = self.state.index.union(part.index)
+        a = self.state.reindex(index)
+        b = part.reindex(index)
+        count_a = a['count'].fillna(0)
+        count_b = b['count'].fillna(0)
+        count = count_a + count_b
+        both = (count_a > 0) & (count_b > 0)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            delta = b['sum'] / count_b - a['sum'] / count_a
+            m2 = (a['var'].fillna(0) * (count_a - 1).clip(lower=0)
+                  + b['var'].fillna(0) * (count_b - 1).clip(lower=0)
+                  + delta ** 2 * count_a * count_b / count)
+            var = (m2 / (count - 1)).where(both, a['var'].where(count_a > 0, b['var']))
+        self.state = pd.DataFrame({
+            'count': count.astype('int64'),
+            'sum': a['sum'].fillna(0) + b['sum'].fillna(0),
+            'var': var,
+        })
+
+    def result(self):
+        """total/mean/std/count per group (as groupby().agg would give), sorted by the keys."""
+        if self.state is None:
+            return pd.DataFrame(columns=self.keys + ['total', 'mean', 'std', 'count'])
+        state = self.state.sort_index()
+        count = state['count'].astype('int64')
+        return pd.DataFrame({
+            'total': state['sum'],
+            'mean': (state['sum'] / count).where(count > 0),
+            'std': np.sqrt(state['var']),
+            'count': count,
+        }).reset_index()
+
+
+# ============================================================================
+# Incremental CSV output
+# ============================================================================
+
+class AtomicCsvWriter:
+    """
+    CSV appended chunk by chunk into a temporary file next to `path`, with
+    the header written once; commit() renames it over `path`, so readers
+    never see a half-written file. abort() drops the temporary file.
+    """
+
+    def __init__(self, path: str, sep: str = ','):
+        self.path = path
+        self.sep = sep
+        self._file = None
+        self._tmp = None
+
+    def write(self, frame: pd.DataFrame) -> None:
+        self.write_text(*render_csv(frame, self.sep))
+
+    def write_text(self, header: str, body: str) -> None:
+        """Append rows already rendered as CSV (see render_csv)."""
+        if self._file is None:
+            fd, self._tmp = tempfile.mkstemp(prefix=f'.{os.path.basename(self.path)}.',
+                                             dir=os.path.dirname(self.path) or '.')
+            self._file = os.fdopen(fd, 'w', encoding='utf-8', newline='')
+            self._file.write(header)
+        self._file.write(body)
+
+    def commit(self) -> None:
+        if self._file is None:
+            return
+        self._file.close()
+        os.replace(self._tmp, self.path)
+        self._file = self._tmp = None
+
+    def abort(self) -> None:
+        if self._file is None:
+            return
+        self._file.close()
+        os.unlink(self._tmp)
+        self._file = self._tmp = None
+
+
+METRICS_FILE = 'metricas_transformacao.json'
+
+# Columns compacted when ANS_ESQUEMA_COMPACTO=1 with the same rules as
+# ans_integration (see esquema_compacto): Ano/Trimestre as small ints, the
+# repetitive text as categories. ValorDespesas stays as read so the
+# enriched CSV is written back unchanged
+COMPACT_COLUMNS = ['CNPJ', 'CNPJ_clean', 'RazaoSocial', 'Trimestre', 'Ano', 'status',
+                   'RegistroANS', 'Modalidade', 'UF']
+
+
+def transform_chunk(chunk: pd.DataFrame, cadastro_index: Optional[dict], delim: str,
+                    validation: Optional[str] = None, compact: Optional[bool] = None,
+                    parquet_dir: Optional[str] = None, chunk_number: int = 0,
+                    match_names: Optional[bool] = None) -> dict:
+    """
+    Clean, validate and enrich one chunk of the consolidated file. The
+    enriched and invalid rows come back already rendered as CSV text, along
+    with the chunk's partial aggregates and counters, so the same result can
+    be produced in a worker process and merged in order by the parent. With
+    `parquet_dir` the enriched rows are also written there as Parquet part
+    `chunk_number` (see saida_colunar.gravar_bloco), so no DataFrame has to
+    travel back to the parent. The rows without a cadastro match are counted
+    per (CNPJ_clean, RazaoSocial) only with `match_names`.
+    """
+    start = time.perf_counter()
+    compact = esquema_compacto.USAR_ESQUEMA_COMPACTO if compact is None else compact
+    match_names = correspondencia_nomes.USAR_CORRESPONDENCIA if match_names is None else match_names
+    result = {'rows_in': len(chunk), 'invalid_count': 0, 'invalid_reasons': {},
+              'invalid_csv': None, 'missing_cadastro': 0, 'unmatched': {},
+              'text_bytes': 0, 'compact_bytes': 0}
+
+    # ensure expected cols
+    if 'CNPJ' not in chunk.columns:
+        if 'CNPJ_CPF' in chunk.columns:
+            chunk.rename(columns={'CNPJ_CPF': 'CNPJ'}, inplace=True)
+    chunk['CNPJ_clean'] = clean_cnpj_series(chunk['CNPJ'])
+    cnpj_reasons = cnpj_failures(chunk['CNPJ_clean'], validation)
+    chunk['CNPJ_valid'] = (cnpj_reasons == '').to_numpy()
+
+    # numeric value
+    if 'ValorDespesas' in chunk.columns:
+        chunk['ValorDespesas_num'] = pd.to_numeric(chunk['ValorDespesas'].str.replace(',','.'), errors='coerce')
+    else:
+        chunk['ValorDespesas_num'] = pd.to_numeric(chunk.iloc[:, -1], errors='coerce')
+
+    # RazaoSocial
+    if 'RazaoSocial' not in chunk.columns and 'Razao_Social' in chunk.columns:
+        chunk.rename(columns={'Razao_Social': 'RazaoSocial'}, inplace=True)
+    chunk['RazaoSocial'] = chunk['RazaoSocial'].fillna('').astype(str)
+
+    # Validation rules
+    chunk['valid_valor'] = chunk['ValorDespesas_num'].notna() & (chunk['ValorDespesas_num'] >= 0)
+    chunk['valid_razao'] = chunk['RazaoSocial'].str.strip() != ''
+
+    # Strategy chosen for invalid CNPJs: keep rows but flag them, and record separately for manual audit.
+    invalids = chunk[~chunk['CNPJ_valid']]
+    if not invalids.empty:
+        reasons = cnpj_reasons[~chunk['CNPJ_valid']]
+        result['invalid_csv'] = render_csv(invalids.assign(CNPJ_invalid_reason=reasons), delim)
+        result['invalid_count'] = len(invalids)
+        result['invalid_reasons'] = {reason: int(count) for reason, count in reasons.value_counts().items()}
+
+    # Enrichment: probe the cadastro index if available
+    if cadastro_index is not None:
+        left = enrich_from_index(chunk, cadastro_index)
+        missing = left['RegistroANS'].isna()
+        result['missing_cadastro'] = int(missing.sum())
+        # Rows per (CNPJ_clean, RazaoSocial) without an exact match, for the
+        # optional matching by name after all chunks
+        if match_names and result['missing_cadastro']:
+            counts = left.loc[missing].groupby(['CNPJ_clean', 'RazaoSocial'], sort=False).size()
+            result['unmatched'] = {key: int(n) for key, n in counts.items()}
+    else:
+        left = chunk.copy()
+        left['RegistroANS'] = pd.NA
+        left['Modalidade'] = pd.NA
+        left['UF'] = pd.NA
+
+    if compact:
+        result['text_bytes'] = esquema_compacto.memoria_bytes(left)
+        left = esquema_compacto.compactar(left, COMPACT_COLUMNS, coluna_valor=None)
+        result['compact_bytes'] = esquema_compacto.memoria_bytes(left)
+    # Outputs are written in the text format of the normal mode
+    frame = esquema_compacto.expandir(left) if compact else left
+
+    result['enriched_csv'] = render_csv(frame, delim)
+    result['parquet_rows'] = (saida_colunar.gravar_bloco(frame, parquet_dir, chunk_number, ENRICHED_TYPES)
+                              if parquet_dir is not None else 0)
+    result['columns'] = list(left.columns)
+    result['rows'] = len(left)
+    result['operadora_uf_stats'] = GroupStats(['RazaoSocial', 'UF'])
+    result['quarter_stats'] = GroupStats(['CNPJ_clean', 'RazaoSocial', 'UF', 'Periodo'])
+    update_aggregates(left, result['operadora_uf_stats'], result['quarter_stats'], compact)
+    result['seconds'] = time.perf_counter() - start
+    return result
+
+
+def render_csv(frame: pd.DataFrame, sep: str):
+    """(header line, rows) of `frame` as CSV text, for AtomicCsvWriter.write_text."""
+    return frame.iloc[:0].to_csv(index=False, sep=sep), frame.to_csv(index=False, header=False, sep=sep)
+
+
+def iter_raw_chunks(path: str, chunk_size: int):
+    """
+    Split the consolidated CSV into (header, text) blocks of `chunk_size`
+    records without parsing it. A record ends at a line break outside quoted
+    fields, so a value with an embedded newline stays whole and the blocks
+    hold the same rows as read_csv(chunksize=chunk_size) chunks.
+    """
+    with open(path, 'r', encoding='utf-8-sig', newline='') as f:
+        header = f.readline()
+        lines = []
+        records = 0
+        quoted = False
+        for line in f:
+            lines.append(line)
+            if line.count('"') % 2:
+                quoted = not quoted
+            if not quoted:
+                records += 1
+                if records >= chunk_size:
+                    yield header, ''.join(lines)
+                    lines = []
+                    records = 0
+        if lines:
+            yield header, ''.join(lines)
+
+
+# State of each worker process, set once by _init_worker
+_worker_state = {}
+
+
+def _init_worker(cadastro_index, delim, validation, compact, parquet_dir, match_names):
+    _worker_state.update(cadastro_index=cadastro_index, delim=delim, validation=validation,
+                         compact=compact, parquet_dir=parquet_dir, match_names=match_names)
+
+
+def _transform_raw_chunk(header: str, text: str, chunk_number: int) -> dict:
+    state = _worker_state
+    chunk = pd.read_csv(io.StringIO(header + text), sep=state['delim'], dtype=str)
+    return transform_chunk(chunk, state['cadastro_index'], state['delim'], state['validation'],
+                           state['compact'], state['parquet_dir'], chunk_number, state['match_names'])
+
+
+def iter_chunk_results(path: str, delim: str, cadastro_index: Optional[dict],
+                       workers: int = 1, parquet_dir: Optional[str] = None):
+    """
+    transform_chunk results for every chunk of `path`, in file order. With
+    more than one worker, raw text blocks are parsed and transformed in a
+    process pool that received the cadastro index once at start-up; at
+    most 2 blocks per worker are in flight, so memory stays bounded.
+    """
+    compact = esquema_compacto.USAR_ESQUEMA_COMPACTO
+    match_names = correspondencia_nomes.USAR_CORRESPONDENCIA
+    if workers <= 1:
+        chunks = pd.read_csv(path, sep=delim, dtype=str, chunksize=CHUNK_SIZE)
+        for chunk_number, chunk in enumerate(chunks):
+            yield transform_chunk(chunk, cadastro_index, delim, CNPJ_VALIDATION, compact,
+                                  parquet_dir, chunk_number, match_names)
+        return
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(cadastro_index, delim, CNPJ_VALIDATION, compact, parquet_dir,
+                                       match_names)) as executor:
+        pending = deque()
+        for chunk_number, (header, text) in enumerate(iter_raw_chunks(path, CHUNK_SIZE)):
+            pending.append(executor.submit(_transform_raw_chunk, header, text, chunk_number))
+            if len(pending) >= 2 * workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def update_aggregates(chunk: pd.DataFrame, operadora_uf_stats: GroupStats, quarter_stats: GroupStats,
+                      compact: Optional[bool] = None) -> None:
+    """Fold one enriched chunk into the per-RazaoSocial/UF and per-quarter aggregates."""
+    compact = esquema_compacto.USAR_ESQUEMA_COMPACTO if compact is None else compact
+    operadora_uf_stats.add([esquema_compacto.preencher_nulos(chunk['RazaoSocial'], 'N/A'),
+                            esquema_compacto.preencher_nulos(chunk['UF'], 'N/A')],
+                           chunk['ValorDespesas_num'])
+
+    # Média de despesas por trimestre: soma por operadora/UF/período
+    if 'Trimestre' in chunk.columns and 'Ano' in chunk.columns:
+        if compact:
+            # Built from the int/category codes instead of one string per row
+            periodo = esquema_compacto.juntar_textos(esquema_compacto.categoria_texto(chunk, 'Ano'),
+                                                     esquema_compacto.categoria_texto(chunk, 'Trimestre'), '_')
+        else:
+            periodo = chunk['Ano'].astype(str) + '_' + chunk['Trimestre'].astype(str)
+        quarter_stats.add([chunk['CNPJ_clean'], chunk['RazaoSocial'], chunk['UF'], periodo.rename('Periodo')],
+                          chunk['ValorDespesas_num'])
+
+
 def process():
+    # Stage/chunk timings, rows and peak memory (optional profiler via ANS_PERFIL)
+    metricas_pipeline.iniciar('transform_validate')
+    try:
+        with metricas_pipeline.perfilar(OUTPUT_DIR, 'transform_validate'):
+            _process()
+    except Exception as e:
+        metricas_pipeline.registrar_erro(e)
+        raise
+    finally:
+        metricas_pipeline.finalizar(os.path.join(OUTPUT_DIR, METRICS_FILE))
+
+
+def _process():
     consolidated = os.path.join(OUTPUT_DIR, 'consolidado_despesas.csv')
     if not os.path.exists(consolidated):
         print('Arquivo consolidado não encontrado:', consolidated)
@@ -113,120 +788,162 @@ def process():
     delim = ';' if ';' in first_line else ','
     print(f"Delimitador detectado: '{delim}'")
 
-    chunk_size = 200_000
-    reader = pd.read_csv(consolidated, sep=delim, dtype=str, chunksize=chunk_size)
-
-    cadastro_hint = os.path.join(BASE_DIR, 'dados_trabalho', 'cadastro_operadoras.csv')
-    cadastro = load_cadastro(cadastro_hint)
+    cadastro_hint = os.path.join(WORK_DIR, 'cadastro_operadoras.csv')
+    with metricas_pipeline.etapa('load_cadastro') as stage:
+        cadastro_path = find_cadastro(cadastro_hint)
+        if cadastro_path:
+            cadastro_index, reused = load_cadastro_index(cadastro_path)
+            print('Cadastro index:', 'reused' if reused else 'built', f"({cadastro_index['rows']} rows)")
+            stage['linhas_saida'] = cadastro_index['rows']
+            stage['index_reused'] = reused
+        else:
+            cadastro_index = None
+            stage['linhas_saida'] = 0
 
-    invalid_cnpj_rows = []
+    invalid_count = 0
+    invalid_reasons = {}
     missing_cadastro = 0
-    cadastro_conflicts = {}
-
-    enriched_parts = []
-
-    for chunk in reader:
-        # ensure expected cols
-        if 'CNPJ' not in chunk.columns:
-            if 'CNPJ_CPF' in chunk.columns:
-                chunk.rename(columns={'CNPJ_CPF': 'CNPJ'}, inplace=True)
-        chunk['CNPJ_clean'] = chunk['CNPJ'].apply(clean_cnpj)
-        chunk['CNPJ_valid'] = chunk['CNPJ_clean'].apply(validate_cnpj)
-
-        # numeric value
-        if 'ValorDespesas' in chunk.columns:
-            chunk['ValorDespesas_num'] = pd.to_numeric(chunk['ValorDespesas'].str.replace(',','.'), errors='coerce')
-        else:
-            chunk['ValorDespesas_num'] = pd.to_numeric(chunk.iloc[:, -1], errors='coerce')
-
-        # RazaoSocial
-        if 'RazaoSocial' not in chunk.columns and 'Razao_Social' in chunk.columns:
-            chunk.rename(columns={'Razao_Social': 'RazaoSocial'}, inplace=True)
-        chunk['RazaoSocial'] = chunk['RazaoSocial'].fillna('').astype(str)
-
-        # Validation rules
-        chunk['valid_valor'] = chunk['ValorDespesas_num'].notna() & (chunk['ValorDespesas_num'] >= 0)
-        chunk['valid_razao'] = chunk['RazaoSocial'].str.strip() != ''
-
-        # Strategy chosen for invalid CNPJs: keep rows but flag them, and record separately for manual audit.
-        invalids = chunk[~chunk['CNPJ_valid']]
-        if not invalids.empty:
-            invalid_cnpj_rows.append(invalids)
-
-        # Enrichment: join with cadastro if available
-        if cadastro is not None:
-            # prepare cadastro
-            cad = cadastro.copy()
-            if 'CNPJ' not in cad.columns:
-                # try to find cnpj-like column
-                for c in cad.columns:
-                    if 'cnpj' in c.lower():
-                        cad.rename(columns={c: 'CNPJ'}, inplace=True)
-                        break
-            cad['CNPJ_clean'] = cad['CNPJ'].apply(clean_cnpj)
-            # detect conflicts: multiple cadastro rows per CNPJ
-            dup = cad[cad.duplicated('CNPJ_clean', keep=False)]
-            for k, g in dup.groupby('CNPJ_clean'):
-                cadastro_conflicts[k] = g.to_dict(orient='records')
-
-            cad_unique = cad.drop_duplicates('CNPJ_clean', keep='first')
-            left = chunk.merge(cad_unique[['CNPJ_clean', 'RegistroANS', 'Modalidade', 'UF']], on='CNPJ_clean', how='left')
-            missing_cadastro += left['RegistroANS'].isna().sum()
+    unmatched = {}
+    cadastro_conflicts = cadastro_index['conflicts'] if cadastro_index is not None else {}
+
+    chunk_count = 0
+    text_bytes = 0
+    compact_bytes = 0
+    total_rows = 0
+    # Each chunk's partial aggregates are merged in as it completes (see GroupStats)
+    operadora_uf_stats = GroupStats(['RazaoSocial', 'UF'])
+    quarter_stats = GroupStats(['CNPJ_clean', 'RazaoSocial', 'UF', 'Periodo'])
+
+    # Outputs are appended as each chunk finishes - use same delimiter as original
+    out_enriched = os.path.join(OUTPUT_DIR, 'consolidado_enriquecido.csv')
+    enriched_writer = AtomicCsvWriter(out_enriched, sep=delim)
+    invalid_writer = AtomicCsvWriter(os.path.join(OUTPUT_DIR, 'invalidos_cnpj.csv'), sep=delim)
+    # Optional typed/partitioned copy (requires pyarrow, see saida_colunar)
+    parquet_writer = None
+    if saida_colunar.GERAR_PARQUET:
+        if saida_colunar.disponivel():
+            parquet_writer = saida_colunar.EscritorParquet(
+                os.path.join(OUTPUT_DIR, 'consolidado_enriquecido.parquet'), ENRICHED_TYPES)
         else:
-            left = chunk.copy()
-            left['RegistroANS'] = pd.NA
-            left['Modalidade'] = pd.NA
-            left['UF'] = pd.NA
+            print("⚠ pyarrow não instalado: saída Parquet ignorada")
 
-        enriched_parts.append(left)
+    results = None
 
-    if enriched_parts:
-        df = pd.concat(enriched_parts, ignore_index=True)
-    else:
+    def discard_outputs():
+        if results is not None:
+            # Stops the worker pool first, so no Parquet part lands after the cleanup
+            results.close()
+        enriched_writer.abort()
+        invalid_writer.abort()
+        if parquet_writer is not None:
+            parquet_writer.descartar()
+
+    try:
+        with metricas_pipeline.etapa('enrich_chunks') as stage:
+            if WORKERS > 1:
+                print(f"Parallel mode: {WORKERS} processes")
+            parquet_dir = str(parquet_writer.diretorio_temporario()) if parquet_writer is not None else None
+            results = iter_chunk_results(consolidated, delim, cadastro_index, WORKERS, parquet_dir)
+            for chunk_number, result in enumerate(results):
+                # Results arrive in file order: write and merge them as they come
+                if result['invalid_csv'] is not None:
+                    invalid_writer.write_text(*result['invalid_csv'])
+                    invalid_count += result['invalid_count']
+                    for reason, count in result['invalid_reasons'].items():
+                        invalid_reasons[reason] = invalid_reasons.get(reason, 0) + count
+                enriched_writer.write_text(*result['enriched_csv'])
+                if parquet_writer is not None:
+                    parquet_writer.registrar(result['parquet_rows'])
+                operadora_uf_stats.merge(result['operadora_uf_stats'])
+                quarter_stats.merge(result['quarter_stats'])
+                missing_cadastro += result['missing_cadastro']
+                for key, count in result['unmatched'].items():
+                    unmatched[key] = unmatched.get(key, 0) + count
+                text_bytes += result['text_bytes']
+                compact_bytes += result['compact_bytes']
+
+                chunk_count += 1
+                total_rows += result['rows']
+                enriched_columns = result['columns']
+                metricas_pipeline.registrar_arquivo(
+                    f'chunk {chunk_number}', result['seconds'],
+                    linhas_entrada=result['rows_in'], linhas_saida=result['rows'])
+
+            stage['linhas_entrada'] = total_rows
+            stage['linhas_saida'] = stage['linhas_entrada']
+            stage['bytes_lidos'] = os.path.getsize(consolidated)
+
+            if chunk_count and esquema_compacto.USAR_ESQUEMA_COMPACTO:
+                print(f"Compact schema (all chunks): {text_bytes / 1024 / 1024:,.1f} MB -> "
+                      f"{compact_bytes / 1024 / 1024:,.1f} MB")
+                metricas_pipeline.anotar(memoria_texto_bytes=text_bytes,
+                                         memoria_compacta_bytes=compact_bytes)
+    except BaseException:
+        discard_outputs()
+        raise
+
+    if not chunk_count:
+        discard_outputs()
         print('Nenhum dado lido do consolidado.')
         return
 
-    # Persist enriched - use same delimiter as original
-    out_enriched = os.path.join(OUTPUT_DIR, 'consolidado_enriquecido.csv')
-    df.to_csv(out_enriched, index=False, sep=delim)
-
-    # Save invalid CNPJ sample - use same delimiter
-    if invalid_cnpj_rows:
-        invalid_df = pd.concat(invalid_cnpj_rows, ignore_index=True)
-        invalid_df.to_csv(os.path.join(OUTPUT_DIR, 'invalidos_cnpj.csv'), index=False, sep=delim)
-    else:
-        invalid_df = pd.DataFrame()
-
-    # Aggregations - use pipe as delimiter to avoid issues with embedded semicolons
-    # Group by RazaoSocial and UF
-    gb = df.groupby([df['RazaoSocial'].fillna('N/A'), df['UF'].fillna('N/A')])
-    agg = gb['ValorDespesas_num'].agg(total='sum', mean='mean', std='std', count='count').reset_index()
-    agg.rename(columns={'RazaoSocial': 'RazaoSocial', 'UF': 'UF'}, inplace=True)
-    agg.to_csv(os.path.join(OUTPUT_DIR, 'aggregados_operadora_uf.csv'), index=False, sep='|')
-
-    # Média de despesas por trimestre para cada operadora/UF
-    if 'Trimestre' in df.columns and 'Ano' in df.columns:
-        # Convert to numeric/string for grouping
-        df['Trimestre_str'] = df['Trimestre'].astype(str)
-        df['Ano_str'] = df['Ano'].astype(str)
-        df['Periodo'] = df['Ano_str'] + '_' + df['Trimestre_str']
-        # Sum by period and CNPJ/RazaoSocial/UF
-        mean_quarter = df.groupby(['CNPJ_clean', 'RazaoSocial', 'UF', 'Periodo'])['ValorDespesas_num'].sum().reset_index()
-        mean_quarter.rename(columns={'ValorDespesas_num': 'ValorTrimestral'}, inplace=True)
-        # Calculate stats per operadora
-        mean_by_q = mean_quarter.groupby(['CNPJ_clean', 'RazaoSocial', 'UF'])['ValorTrimestral'].agg(
-            media_trimestral='mean', 
-            desvio_trimestral='std', 
-            trimestres='count'
-        ).reset_index()
-        mean_by_q.to_csv(os.path.join(OUTPUT_DIR, 'media_desvio_por_operadora_uf.csv'), index=False, sep='|')
+    with metricas_pipeline.etapa('write_enriched') as stage:
+        # Readers only ever see complete files
+        enriched_writer.commit()
+        if parquet_writer is not None:
+            parquet_writer.concluir()
+            print('Enriched (parquet):', parquet_writer.destino)
+        stage['linhas_entrada'] = total_rows
+
+        # Save invalid CNPJ sample
+        if invalid_count:
+            invalid_writer.commit()
+        else:
+            invalid_writer.abort()
+
+    with metricas_pipeline.etapa('aggregations') as stage:
+        stage['linhas_entrada'] = total_rows
+        # Aggregations - use pipe as delimiter to avoid issues with embedded semicolons
+        # Group by RazaoSocial and UF
+        agg = operadora_uf_stats.result()
+        agg.to_csv(os.path.join(OUTPUT_DIR, 'aggregados_operadora_uf.csv'), index=False, sep='|')
+        stage['linhas_saida'] = len(agg)
+
+        # Média de despesas por trimestre para cada operadora/UF
+        if 'Trimestre' in enriched_columns and 'Ano' in enriched_columns:
+            # Sum by period and CNPJ/RazaoSocial/UF
+            mean_quarter = quarter_stats.result()[quarter_stats.keys + ['total']]
+            mean_quarter.rename(columns={'total': 'ValorTrimestral'}, inplace=True)
+            # Calculate stats per operadora
+            mean_by_q = mean_quarter.groupby(['CNPJ_clean', 'RazaoSocial', 'UF'])['ValorTrimestral'].agg(
+                media_trimestral='mean', 
+                desvio_trimestral='std', 
+                trimestres='count'
+            ).reset_index()
+            mean_by_q.to_csv(os.path.join(OUTPUT_DIR, 'media_desvio_por_operadora_uf.csv'), index=False, sep='|')
+
+    name_matching = None
+    if correspondencia_nomes.USAR_CORRESPONDENCIA and cadastro_index is not None and unmatched:
+        with metricas_pipeline.etapa('name_matching') as stage:
+            # Secondary stage: propose cadastro rows by razão social for keys
+            # that had no exact CNPJ match (written for review, not merged)
+            proposals, name_matching = match_by_name(unmatched, cadastro_index)
+            proposals.to_csv(os.path.join(OUTPUT_DIR, 'propostas_cadastro_por_nome.csv'), index=False, sep='|')
+            stage['linhas_entrada'] = len(unmatched)
+            stage['linhas_saida'] = len(proposals)
+            print(f"Name matching: {name_matching['matched_rows']}/{name_matching['unmatched_rows']} "
+                  f"rows without cadastro matched (hit rate {name_matching['hit_rate']:.1%})")
 
     report = {
-        'rows_read_approx_chunked': len(df),
-        'invalid_cnpj_count': len(invalid_df),
+        'rows_read_approx_chunked': total_rows,
+        'invalid_cnpj_count': invalid_count,
+        'cnpj_validation': CNPJ_VALIDATION,
+        'invalid_cnpj_by_reason': invalid_reasons,
         'missing_in_cadastro': int(missing_cadastro),
         'cadastro_conflicts_count': len(cadastro_conflicts),
     }
+    if name_matching is not None:
+        report['name_matching'] = name_matching
     with open(os.path.join(OUTPUT_DIR, 'relatorio_transformacao.json'), 'w', encoding='utf-8') as f:
         json.dump(report, f, ensure_ascii=False, indent=2)
 